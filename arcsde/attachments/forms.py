@@ -14,6 +14,7 @@ class CaptionForm(forms.Form):
         self.instance = instance
 
     def save(self):
+        """ Save just the caption - instance may be metadata only (see SdeAttachmentMetadataManager) """
         if self.is_valid():
             self.instance.att_name = self.cleaned_data['att_name']
             self.instance.save(update_fields=['att_name'])  # this implies force_update=True
@@ -14,5 +14,27 @@ class SdeAttachmentQuerySet(managers.ArcSdeQuerySet):
         """
         return self.filter(content_type__contains='image')
 
+    def sde_metadata(self):
+        """
+            Defer loading the attachment data, which may be many MB per attachment - just the metadata
+            Data is loaded on access, or streamed with attachment.iter_data()
+        """
+        return self.defer('data')
+
+    def sde_with_data(self):
+        """
+            Load the attachment data along with the metadata, e.g., to render images inline as data URIs
+            Note: clears any deferred fields
+        """
+        return self.defer(None)
+
 
 SdeAttachmentManager = managers.ArcSdeManager.from_queryset(SdeAttachmentQuerySet, class_name='SdeAttachmentManager')
+
+
+class SdeAttachmentMetadataManager(SdeAttachmentManager):
+    """
+        Attachments without their data, for listing names, captions, counts or URLs - use sde_with_data() to load it.
+    """
+    def get_queryset(self):
+        return super().get_queryset().sde_metadata()
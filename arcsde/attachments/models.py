@@ -14,13 +14,17 @@ Also recommended, add the ArcSdeAttachmentsMixin to the sde feature model class:
         sde_attachments = arcsde.ArcSdeAttachments()
         ...
 """
-import base64, functools
-from django.db import models, connection
+import base64
+from django.db import models
+from django.db.models.functions import Substr
 from django.urls import reverse
 from django.utils.functional import cached_property
+from django.utils.http import quote_etag
 
+from arcsde import settings
 from arcsde.models import AbstractArcSdeBase, sde_db_table, sde_base_db_table
-from arcsde.attachments.managers import SdeAttachmentManager
+from arcsde.models.catalog import sde_catalog
+from arcsde.attachments.managers import SdeAttachmentManager, SdeAttachmentMetadataManager
 
 
 class AttachmentModelRegistry:
@@ -96,6 +100,7 @@ class AbstractSdeAttachModel(AbstractArcSdeBase):
         abstract = True
 
     objects = SdeAttachmentManager()
+    metadata = SdeAttachmentMetadataManager()  # defers data - use for queries that don't need the attachment itself
 
     @property
     def related_model_class(self):
@@ -128,6 +133,59 @@ class AbstractSdeAttachModel(AbstractArcSdeBase):
         """
         return "data:%s;base64,%s"%(self.content_type, self.get_base64_utf8_encoding())
 
+    @property
+    def data_etag(self) -> str:
+        """ Return a (quoted) ETag for this attachment's data - data is immutable for a given globalid and size """
+        return quote_etag('{id}-{size}'.format(id=self.globalid.strip('{}'), size=self.data_size))
+
+    @property
+    def data_last_modified(self):
+        """ Return the datetime this attachment was last edited, for attach tables with editor tracking, or None """
+        return getattr(self, 'last_edited_date', None)
+
+    def iter_data(self, start=0, stop=None, chunk_size=None):
+        """
+            Yield this attachment's data[start:stop] in chunks of chunk_size bytes (default: SDE_ATTACHMENT_CHUNK_SIZE)
+            Unless data was loaded with the instance, each chunk is read from the DB with substring(),
+                so a large blob is never held in memory whole - fetch the instance with .defer('data')
+        """
+        stop = self.data_size if stop is None else min(stop, self.data_size)
+        chunk_size = chunk_size or settings.SDE_ATTACHMENT_CHUNK_SIZE
+        if 'data' not in self.get_deferred_fields():
+            data = self.data or b''
+            for offset in range(start, stop, chunk_size):
+                yield bytes(data[offset:min(offset + chunk_size, stop)])
+            return
+
+        attachment = type(self)._default_manager.filter(pk=self.pk)
+        for offset in range(start, stop, chunk_size):
+            # substring positions are 1-based
+            chunk = attachment.annotate(
+                chunk=Substr('data', offset + 1, min(chunk_size, stop - offset), output_field=models.BinaryField())
+            ).values_list('chunk', flat=True).first()
+            if not chunk:
+                return  # data is shorter than data_size claims, or attachment was deleted mid-stream
+            yield bytes(chunk)
+
+    def download_url(self):
+        related_model = self.related_model_class.__name__
+        app_label=self.related_model_class._meta.app_label
+        return reverse('arcsde:attachments:download',
+                        args=(app_label, related_model, self.related_pk, self.pk)
+                      )
+
+    def image_url(self):
+        """ Return a URL for the src attribute of an html img tag - an alternative to get_data_URI the browser can cache """
+        return self.download_url()
+
+    def thumbnail_url(self, size='small'):
+        """ Return a URL for a thumbnail of this image, in one of the named sizes in settings.SDE_THUMBNAIL_SIZES """
+        related_model = self.related_model_class.__name__
+        app_label=self.related_model_class._meta.app_label
+        return reverse('arcsde:attachments:thumbnail',
+                        args=(app_label, related_model, self.related_pk, self.pk, size)
+                      )
+
     def image_list_url(self):
         related_model = self.related_model_class.__name__
         app_label=self.related_model_class._meta.app_label
@@ -151,12 +209,12 @@ class AbstractSdeAttachModel(AbstractArcSdeBase):
         return cls(content_type='image/png', data=test_red_dot, data_size=len(test_red_dot))
 
 
-@functools.lru_cache()   # Avoid repeating DB introspection - the db table isn't going to suddenly appear :-)
 def db_table_exists(table_name):
     """
         Return True iff given table or view name exits in DB.
+        Avoids repeating DB introspection by reading the catalog cache - the db table isn't going to suddenly appear :-)
     """
-    return table_name in connection.introspection.table_names(include_views=True)
+    return sde_catalog.exists(table_name)
 
 def get_attachment_model_db_table_name(related_model):
     # noinspection PyProtectedMember
@@ -181,7 +239,8 @@ def get_attachment_model(related_model, attachment_model_db_table_name=None):
     attachment_model = AttachmentModelRegistry.get_attachment_model(related_model)
     if attachment_model:
         return attachment_model
-    elif not db_table_exists(db_table_name):
+    elif not (db_table_exists(attachment_model_db_table_name) if attachment_model_db_table_name else
+              sde_catalog.table_info(related_model._meta.db_table).attach_exists):
         return None  # no such related attachments exist, so there is no such model
     else:
         pass  # create the concrete django Model for identified attachments db_table
@@ -255,6 +314,11 @@ class ArcSdeAttachmentsApi:
         """ Return complete queryset of image attachments for this feature, or None """
         return self.attachment_set.all().sde_image_attachments() if self.has_attachments else None
 
+    @cached_property
+    def metadata(self):
+        """ Return complete queryset of attachments for this feature, without their data, or None """
+        return self.attachment_set.all().sde_metadata() if self.has_attachments else None
+
     @cached_property
     def count(self):
         """ Return the number of attachments objects related to this feature """
@@ -0,0 +1,231 @@
+"""
+Thumbnails for image attachments
+@author: powderflask
+
+Resized JPEG / WebP variants of image attachments, at the named sizes in settings.SDE_THUMBNAIL_SIZES,
+    so galleries need not download full-resolution field photos just to show them small.
+Thumbnails are keyed by attachment globalid + data_size (attachment data is immutable for a given key),
+    and stored in a bounded, on-disk LRU cache shared by all processes (settings.SDE_THUMBNAIL_CACHE_DIR).
+Thumbnails are generated on demand (see views.AttachmentThumbnailView), or in bulk, in a process pool:
+    backfill_thumbnails(MyFeature.sde_attachments.objects.all())    # or:  ./manage.py sde_thumbnails app.MyFeature
+Requires Pillow:  pip install django-arcsde[thumbnails]
+"""
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.exceptions import ImproperlyConfigured
+
+from arcsde import settings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is an optional dependency
+    Image = ImageOps = None
+
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+
+def require_pillow():
+    if Image is None:
+        raise ImproperlyConfigured('Attachment thumbnails require Pillow:  pip install django-arcsde[thumbnails]')
+
+
+def thumbnail_format():
+    """ Return the configured thumbnail image format, one of CONTENT_TYPES """
+    fmt = settings.SDE_THUMBNAIL_FORMAT.upper()
+    if fmt not in CONTENT_TYPES:
+        raise ImproperlyConfigured(f"SDE_THUMBNAIL_FORMAT must be one of {', '.join(CONTENT_TYPES)}, not {fmt}")
+    return fmt
+
+
+def thumbnail_key(attachment, size_name, fmt=None):
+    """ Return the cache key (a file name) for the named thumbnail size of the given attachment """
+    fmt = fmt or thumbnail_format()
+    return '{id}-{data_size}-{size}.{ext}'.format(
+        id=attachment.globalid.strip('{}'), data_size=attachment.data_size, size=size_name, ext=fmt.lower()
+    )
+
+
+def make_thumbnail(data, size, fmt='JPEG', quality=None):
+    """
+        Return the image data (bytes) resized to fit within a size x size box, encoded in the given image format
+        A plain function of bytes, so it can run in a worker process.
+    """
+    require_pillow()
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)  # field photos are often rotated by EXIF orientation only
+        image.thumbnail((size, size))
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        image.save(out, fmt, quality=quality or settings.SDE_THUMBNAIL_QUALITY)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """
+        A bounded, on-disk LRU cache of thumbnail files, shared by all processes using the same directory
+        Recency is tracked by file modification time, which is touched on every hit.
+        When the total size exceeds max_bytes, the least recently used files are removed, down to 90% of max_bytes.
+    """
+    LOW_WATER = 0.9
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or settings.SDE_THUMBNAIL_CACHE_DIR or \
+            os.path.join(tempfile.gettempdir(), 'arcsde-thumbnails')
+        self.max_bytes = settings.SDE_THUMBNAIL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._size = None   # total size of cached files - scanned lazily, then tracked approximately
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """ Return the cached data for key, or None """
+        path = self.path(key)
+        try:
+            os.utime(path)  # mark as recently used
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:  # not cached, or just pruned
+            return None
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def set(self, key, data):
+        """ Store data for key, atomically - readers never see a partial file """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path(key))
+        with self._lock:
+            if self._size is None:
+                self._size = self.scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self.prune()
+
+    def _entries(self):
+        """ Return list of (mtime, size, path) for the cached files """
+        try:
+            files = [entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith('.tmp')]
+        except FileNotFoundError:
+            return []
+        entries = []
+        for entry in files:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def prune(self):
+        """ Remove least recently used files until the cache is below its low-water mark """
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.LOW_WATER
+        for mtime, file_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        self._size = size
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                os.remove(path)
+            self._size = 0
+
+    def stats(self):
+        entries = self._entries()
+        return dict(files=len(entries), bytes=sum(size for _, size, _ in entries), max_bytes=self.max_bytes)
+
+
+# The thumbnail cache shared by the views and backfills
+thumbnail_cache = ThumbnailCache()
+
+
+def thumbnail_size(size_name):
+    """ Return the size, in pixels, for the named thumbnail size - raises KeyError for unknown sizes """
+    return settings.SDE_THUMBNAIL_SIZES[size_name]
+
+
+def get_thumbnail(attachment, size_name, cache=None):
+    """
+        Return the named size of thumbnail (bytes) for the given image attachment, generating it if not cached
+        The attachment's data is read (in chunks, if it was deferred) only on a cache miss.
+    """
+    cache = cache or thumbnail_cache
+    size = thumbnail_size(size_name)
+    fmt = thumbnail_format()
+    key = thumbnail_key(attachment, size_name, fmt)
+    thumbnail = cache.get(key)
+    if thumbnail is None:
+        thumbnail = make_thumbnail(b''.join(attachment.iter_data()), size, fmt)
+        cache.set(key, thumbnail)
+    return thumbnail
+
+
+def backfill_thumbnails(queryset, sizes=None, processes=None, cache=None, batch_size=None):
+    """
+        Generate any missing thumbnails, for the named sizes (default: all), for the image attachments in queryset
+        Images are resized in a pool of processes (default: one per CPU), processes=0 to resize in this process.
+        Attachment data is loaded only for attachments missing a thumbnail, batch_size at a time, to bound memory.
+        Return the number of thumbnails generated.
+    """
+    require_pillow()
+    cache = cache or thumbnail_cache
+    sizes = sizes or tuple(settings.SDE_THUMBNAIL_SIZES)
+    fmt = thumbnail_format()
+    batch_size = batch_size or (processes or os.cpu_count() or 1) * 4
+
+    def missing():
+        """ Yield (key, size, pk) for each thumbnail not yet in the cache """
+        for attachment in queryset.sde_image_attachments().defer('data').iterator():
+            for size_name in sizes:
+                key = thumbnail_key(attachment, size_name, fmt)
+                if key not in cache:
+                    yield key, thumbnail_size(size_name), attachment.pk
+
+    def batches():
+        batch = []
+        for job in missing():
+            batch.append(job)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    count = 0
+    executor = ProcessPoolExecutor(max_workers=processes) if processes != 0 else None
+    try:
+        for batch in batches():
+            data = dict(queryset.filter(pk__in={pk for _, _, pk in batch}).values_list('pk', 'data'))
+            jobs = [(key, bytes(data[pk]), size) for key, size, pk in batch if data.get(pk)]
+            keys, images, image_sizes = zip(*jobs) if jobs else ((), (), ())
+            resize = executor.map if executor else map
+            for key, thumbnail in zip(keys, resize(make_thumbnail, images, image_sizes, [fmt] * len(jobs))):
+                cache.set(key, thumbnail)
+                count += 1
+    finally:
+        if executor:
+            executor.shutdown()
+    return count
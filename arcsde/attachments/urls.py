@@ -8,7 +8,8 @@ app_name = "attachments"
 # URL Arguments:
 # related_model:  Required model class name - identifies which model the attachments are related to
 # related_pk:     Required primary key / id - identifies which specific related model the attachments belong to
-# attachment_pk:  Attachment primary key / id - identifies which specific attachment to save caption for
+# attachment_pk:  Attachment primary key / id - identifies which specific attachment to save caption for / download
+# size:           Thumbnail size name - one of settings.SDE_THUMBNAIL_SIZES
 
 # CAUTION: These views are only login-protected -- no other permissions checks applied -- see Design Notes
 urlpatterns = [
@@ -20,4 +21,12 @@ urlpatterns = [
         view = arcsde.attachments.views.AjaxAttachedCaptionSave.as_view(),
         name = 'caption-save-ajax'
     ),
+    path('download/<slug:related_model_app>/<slug:related_model>/<int:related_pk>/<int:attachment_pk>/',
+        view = arcsde.attachments.views.AttachmentDownloadView.as_view(),
+        name = 'download'
+    ),
+    path('thumbnail/<slug:related_model_app>/<slug:related_model>/<int:related_pk>/<int:attachment_pk>/<slug:size>/',
+        view = arcsde.attachments.views.AttachmentThumbnailView.as_view(),
+        name = 'thumbnail'
+    ),
 ]
@@ -1,11 +1,19 @@
+import calendar
+import re
 from functools import cached_property
+from urllib.parse import quote
 
 from django.apps import apps
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from django.template.loader import get_template
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views import generic
 
+from arcsde import settings
 from arcsde.views import AjaxOnlyView
+from arcsde.attachments import thumbnails
 from arcsde.attachments.models import AttachmentModelRegistry
 from arcsde.attachments.forms import CaptionForm
 
@@ -60,10 +68,10 @@ class BaseAttachmentViewMixin:
         return self._get_related_object()
 
     def _get_attachments_qs(self):
-        """ returns queryset for SDE attachments defined by the kwargs """
+        """ returns queryset for SDE attachments defined by the kwargs - metadata only, data is deferred """
         # roughly equivalent to: self._get_related_object().attachment_set.all()
         # use the explicit form below too ensure the attachment model is dynamically created
-        return self._get_attachment_model().objects.filter(related_object=self.related_object)
+        return self._get_attachment_model().metadata.filter(related_object=self.related_object)
 
     @cached_property
     def attachments_qs(self):
@@ -74,15 +82,25 @@ class AjaxAttachedImagesView(BaseAttachmentViewMixin, AjaxOnlyView):
     """
         Get all image attachments related the model specified in the URL
         Return as a set of HTML .item elements, intended to be loaded to a target viewer on the client-side
+        image_mode:  'inline' renders images as data URIs, 'url' as lazy-loaded image URLs (see AttachmentDownloadView)
     """
     image_tag_template = get_template("arcsde/attachments/as_modal_image_item.html")
+    image_mode = None  # default: settings.SDE_ATTACHMENT_IMAGE_MODE
+    IMAGE_MODES = ('inline', 'url')
 
     def get(self, request, *args, **kwargs):
         # Format results as a set of HTML image tags
         return HttpResponse("\n".join(self.get_image_tags(request)))
 
+    def get_image_mode(self):
+        image_mode = self.image_mode or settings.SDE_ATTACHMENT_IMAGE_MODE
+        assert image_mode in self.IMAGE_MODES, f"Attachment image mode must be one of {', '.join(self.IMAGE_MODES)}"
+        return image_mode
+
     def get_image_attachments(self):
-        return super().attachments_qs.sde_image_attachments()
+        attachments = super().attachments_qs.sde_image_attachments()
+        # images referenced by URL are fetched individually - the list needs only the metadata
+        return attachments if self.get_image_mode() == 'url' else attachments.sde_with_data()
 
     @cached_property
     def attachments_qs(self):
@@ -94,9 +112,12 @@ class AjaxAttachedImagesView(BaseAttachmentViewMixin, AjaxOnlyView):
         """
         # Filter for image-type attachments
         attachments_qs = self.get_image_attachments()
+        image_mode = self.get_image_mode()
 
         return [
-            self.image_tag_template.render(context={'attachment': a, 'caption_form': CaptionForm(a)}, request=request)
+            self.image_tag_template.render(
+                context={'attachment': a, 'caption_form': CaptionForm(a), 'image_mode': image_mode}, request=request
+            )
             for a in attachments_qs
         ]
 
@@ -116,3 +137,125 @@ class AjaxAttachedCaptionSave(BaseAttachmentViewMixin, AjaxOnlyView):
             return self.render_to_json_response({'success':True, 'caption_text': updated_attachment.att_name})
         else:
             return self.render_to_json_response(self._form_errors_context(caption_form))
+
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(header, size):
+    """
+        Return (start, stop) for a single HTTP byte range header, for a resource of the given size,
+            or None if the header should be ignored (malformed, or multiple ranges - the whole resource is sent instead)
+        Raises ValueError if the range is not satisfiable.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:  # suffix range:  the last n bytes
+        if int(last) == 0:
+            raise ValueError('Empty suffix byte range')
+        return max(size - int(last), 0), size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('Byte range starts beyond the end of the resource')
+    return start, min(int(last) + 1, size) if last else size
+
+
+class AttachmentDownloadView(BaseAttachmentViewMixin, generic.View):
+    """
+        Stream an attachment's data, in chunks read from the DB, so large files are never buffered whole in the worker
+        Supports single HTTP Range requests (206 / 416) and conditional requests (304) on the attachment's ETag.
+        ?download=1 to serve the attachment as a file download, rather than inline.
+    """
+    def get_attachment(self):
+        # data is streamed in chunks - attachments_qs doesn't load it with the instance
+        return get_object_or_404(self.attachments_qs, pk=self.kwargs.get('attachment_pk', None))
+
+    def if_range_matches(self, request, etag, last_modified):
+        """ Return True unless an If-Range precondition shows the client's partial copy is out of date """
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if_range_date = parse_http_date_safe(if_range)
+        if if_range_date is not None:
+            return last_modified is not None and if_range_date >= last_modified
+        return if_range == etag
+
+    def set_headers(self, response, attachment):
+        response['ETag'] = attachment.data_etag
+        response['Accept-Ranges'] = 'bytes'
+        if attachment.data_last_modified:
+            response['Last-Modified'] = http_date(self.last_modified(attachment))
+        patch_cache_control(response, private=True, max_age=settings.SDE_ATTACHMENT_CACHE_MAX_AGE)
+        return response
+
+    @staticmethod
+    def last_modified(attachment):
+        modified = attachment.data_last_modified
+        return calendar.timegm(modified.utctimetuple()) if modified else None
+
+    def get(self, request, *args, **kwargs):
+        attachment = self.get_attachment()
+        etag, last_modified = attachment.data_etag, self.last_modified(attachment)
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:  # 304 Not Modified or 412 Precondition Failed
+            return self.set_headers(not_modified, attachment)
+
+        size = attachment.data_size
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and self.if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_byte_range(request.META['HTTP_RANGE'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{size}'.format(size=size)
+                return self.set_headers(response, attachment)
+
+        start, stop = byte_range or (0, size)
+        response = StreamingHttpResponse(attachment.iter_data(start, stop), status=206 if byte_range else 200,
+                                         content_type=attachment.content_type)
+        response['Content-Length'] = stop - start
+        if byte_range:
+            response['Content-Range'] = 'bytes {start}-{end}/{size}'.format(start=start, end=stop - 1, size=size)
+        disposition = 'attachment' if request.GET.get('download') else 'inline'
+        response['Content-Disposition'] = "{disposition}; filename*=utf-8''{name}".format(
+            disposition=disposition, name=quote(attachment.att_name)
+        )
+        return self.set_headers(response, attachment)
+
+
+class AttachmentThumbnailView(AttachmentDownloadView):
+    """
+        Serve a thumbnail of an image attachment, in one of the named sizes in settings.SDE_THUMBNAIL_SIZES
+        Thumbnails are generated on first request, then served from the on-disk thumbnail cache (requires Pillow).
+    """
+    cache = None  # default: thumbnails.thumbnail_cache
+
+    def set_thumbnail_headers(self, response, etag):
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.SDE_ATTACHMENT_CACHE_MAX_AGE)
+        return response
+
+    def get(self, request, *args, **kwargs):
+        size = self.kwargs.get('size', None)
+        if size not in settings.SDE_THUMBNAIL_SIZES:
+            raise Http404
+        attachment = self.get_attachment()
+        if 'image' not in attachment.content_type:
+            raise Http404
+
+        etag = quote_etag(thumbnails.thumbnail_key(attachment, size))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return self.set_thumbnail_headers(not_modified, etag)
+
+        try:
+            thumbnail = thumbnails.get_thumbnail(attachment, size, cache=self.cache)
+        except OSError:  # data is not an image Pillow can read
+            raise Http404
+        response = HttpResponse(thumbnail, content_type=thumbnails.CONTENT_TYPES[thumbnails.thumbnail_format()])
+        return self.set_thumbnail_headers(response, etag)
@@ -0,0 +1,11 @@
+from arcsde.layers.strtree import (
+    STRtree,
+)
+
+from arcsde.layers.cache import (
+    SdeLayerCache, SdeLayerFeature,
+)
+
+from arcsde.layers.tiles import (
+    SdeTileLayer, TileCache, tile_cache,
+)
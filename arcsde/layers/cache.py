@@ -0,0 +1,227 @@
+"""
+    In-process cache of a mostly static SDE feature layer, with an STR-tree spatial index
+
+    Point-in-polygon lookups against a polygon layer (e.g., which district is this point in?) otherwise cost a
+    DB round trip each.  SdeLayerCache loads the layer's shapes once, as WKB, builds an STR-tree over their
+    bounding boxes, and answers point queries locally:  tree search for candidates, then an exact point-in-polygon test.
+
+    The cache refreshes incrementally:  only features edited since the last load are re-fetched (by last_edited_date),
+    deleted features are dropped, and the (cheap, in-memory) tree is re-built only when something changed.
+    Usage:
+        districts = SdeLayerCache(District.objects.all(), fields=('name', ))
+        district = districts.feature_at(x, y)   # point in the layer's spatial reference (or srid)
+        districts.stats()                        # feature count, memory footprint, build times, ...
+"""
+import logging
+import sys
+import threading
+import time
+from array import array
+from typing import NamedTuple, Any
+
+from django.db import models
+
+from arcsde import settings, wkb
+from arcsde.layers import geometry
+from arcsde.layers.strtree import STRtree, NODE_CAPACITY
+
+logger = logging.getLogger('arcsde')
+
+
+class SdeLayerFeature(NamedTuple):
+    """ A cached feature: its key (pk), shape, bounding box, selected field values, and last edit date """
+    key: Any
+    geometry: wkb.WkbGeometry
+    bbox: tuple
+    values: dict
+    last_edited: Any = None
+
+    def contains(self, x, y):
+        return geometry.contains_point(self.geometry, x, y)
+
+
+def _sizeof(obj, seen):
+    """ Approximate deep size of obj in bytes, counting each object only once """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, array):  # getsizeof includes the array's buffer
+        return size
+    if isinstance(obj, dict):
+        return size + sum(_sizeof(k, seen) + _sizeof(v, seen) for k, v in obj.items())
+    if isinstance(obj, (tuple, list)):
+        return size + sum(_sizeof(item, seen) for item in obj)
+    return size
+
+
+class SdeLayerCache:
+    """
+        A cache of the active features in queryset (or a model's default queryset), spatially indexed by shape.
+        fields:  names of attributes to cache with each feature, e.g., for display
+        srid:  optionally transform shapes to this spatial reference - query points must use the same one.
+        refresh_interval:  queries refresh the cache when it is older than this many seconds (0: only on demand)
+    """
+    WKB_ANNOTATION = 'arcsde_layer_wkb'
+
+    def __init__(self, queryset, fields=(), srid=None, refresh_interval=None, node_capacity=NODE_CAPACITY):
+        self.queryset = queryset if isinstance(queryset, models.QuerySet) else queryset._default_manager.all()
+        self.model = self.queryset.model
+        self.fields = tuple(fields)
+        self.srid = srid
+        self.refresh_interval = settings.SDE_LAYER_CACHE_REFRESH_INTERVAL \
+            if refresh_interval is None else refresh_interval
+        self.node_capacity = node_capacity
+        self.key_field = self.model._meta.pk.attname
+        # incremental refresh requires SDE edit tracking fields - see ArcSdeRevisionFieldsMixin
+        self.edited_field = getattr(self.model, 'last_edited_date_field', None)
+
+        self._features = {}            # key : SdeLayerFeature
+        self._index = (None, [])       # (STRtree, features list) - replaced, never mutated, so queries need no lock
+        self._lock = threading.Lock()
+        self.last_edited = None        # latest edit date of any cached feature
+        self.loaded_at = None
+        self.refreshed_at = None
+        self.loads = 0
+        self.refreshes = 0
+        self.fetch_seconds = 0.0       # time to fetch & decode features on last load / refresh
+        self.build_seconds = 0.0       # time to build the STR-tree on last load / refresh
+
+    # Loading
+
+    def _fetch(self, queryset, keys=None):
+        """
+            Yield an SdeLayerFeature for each active feature in queryset with a shape
+            keys:  optional set - the key of every feature fetched is added, including those with no (or an empty) shape
+        """
+        edited = self.edited_field
+        fields = (self.key_field, ) + ((edited, ) if edited else ()) + self.fields + (self.WKB_ANNOTATION, )
+        qs = queryset.sde_shape_as_wkb(self.WKB_ANNOTATION, srid=self.srid)
+        for row in qs.sde_stream(rows='tuple', fields=fields):
+            key, shape = row[0], row[-1]
+            if keys is not None:
+                keys.add(key)
+            if shape is None:
+                continue
+            geom = wkb.decode_wkb(shape)
+            bbox = geometry.bounds(geom)
+            if bbox is None:
+                continue
+            values = dict(zip(self.fields, row[2 if edited else 1:-1]))
+            yield SdeLayerFeature(key, geom, bbox, values, row[1] if edited else None)
+
+    def _install(self, features):
+        """ Build the spatial index for the given {key: feature} dict and make it current. Caller must hold lock """
+        start = time.perf_counter()
+        items = sorted(features.values(), key=lambda feature: feature.key)  # deterministic result order
+        tree = STRtree([feature.bbox for feature in items], node_capacity=self.node_capacity)
+        self.build_seconds = time.perf_counter() - start
+        self._features = features
+        self._index = (tree, items)
+        edits = [feature.last_edited for feature in items if feature.last_edited is not None]
+        self.last_edited = max(edits) if edits else None
+
+    def load(self):
+        """ (Re-)load all features in the layer and build the spatial index """
+        with self._lock:
+            start = time.perf_counter()
+            features = {feature.key: feature for feature in self._fetch(self.queryset)}
+            self.fetch_seconds = time.perf_counter() - start
+            self._install(features)
+            self.loaded_at = self.refreshed_at = time.monotonic()
+            self.loads += 1
+            logger.debug('Loaded %d %s features into layer cache.', len(features), self.model.__name__)
+
+    def refresh(self):
+        """
+            Re-fetch only features edited since the last load / refresh, and drop deleted features.
+            Re-loads the whole layer if the model has no edit tracking.  Returns True iff the layer changed.
+        """
+        if self.loaded_at is None or not self.edited_field:
+            self.load()
+            return True
+        with self._lock:
+            start = time.perf_counter()
+            edited = self.queryset.filter(**{f'{self.edited_field}__gte': self.last_edited}) \
+                if self.last_edited else self.queryset
+            edited_keys = set()
+            changed = {feature.key: feature for feature in self._fetch(edited, edited_keys)}
+            current_keys = set(self.queryset.sde_active().values_list(self.key_field, flat=True))
+            # edited features that no longer have a shape are dropped, like deleted ones
+            dropped_keys = edited_keys - changed.keys()
+            features = {key: feature for key, feature in self._features.items()
+                        if key in current_keys and key not in dropped_keys}
+            is_changed = len(features) != len(self._features) or \
+                any(self._features.get(key) != feature for key, feature in changed.items())
+            features.update(changed)
+            self.fetch_seconds = time.perf_counter() - start
+            if is_changed:
+                self._install(features)
+                self.refreshes += 1
+            self.refreshed_at = time.monotonic()
+            return is_changed
+
+    def _refresh_if_stale(self):
+        if self.loaded_at is None:
+            self.load()
+        elif self.refresh_interval and time.monotonic() - self.refreshed_at > self.refresh_interval:
+            self.refresh()
+
+    # Queries
+
+    def features_at(self, x, y):
+        """ Return list of features whose shape contains the point (x, y), ordered by key """
+        self._refresh_if_stale()
+        tree, items = self._index
+        if tree is None:
+            return []
+        return [items[i] for i in sorted(tree.query_point(x, y)) if items[i].contains(x, y)]
+
+    def feature_at(self, x, y):
+        """ Return the feature that contains the point (x, y) - the one with the lowest key if several do - or None """
+        features = self.features_at(x, y)
+        return features[0] if features else None
+
+    def contains(self, x, y):
+        """ Return True iff some feature in the layer contains the point (x, y) """
+        return bool(self.features_at(x, y))
+
+    def features_in_bbox(self, bbox):
+        """ Return list of features whose bounding box overlaps bbox (minx, miny, maxx, maxy), ordered by key """
+        self._refresh_if_stale()
+        tree, items = self._index
+        return [items[i] for i in sorted(tree.query(bbox))] if tree is not None else []
+
+    def get(self, key):
+        """ Return the cached feature with the given key, or None """
+        self._refresh_if_stale()
+        return self._features.get(key)
+
+    def __len__(self):
+        return len(self._index[1])
+
+    # Diagnostics
+
+    def memory_footprint(self):
+        """ Return approximate memory used by cached features and spatial index, in bytes (walks all objects!) """
+        tree, items = self._index
+        seen = set()
+        size = _sizeof(self._features, seen) + _sizeof(items, seen)
+        if tree is not None:
+            size += _sizeof(tree.boxes, seen) + _sizeof(tree.root, seen)
+        return size
+
+    def stats(self):
+        """ Return a dict of cache statistics: size, memory footprint, load / build times, load & refresh counts """
+        tree, items = self._index
+        return dict(
+            features=len(items),
+            vertices=sum(geometry.vertex_count(feature.geometry) for feature in items),
+            memory_bytes=self.memory_footprint(),
+            tree_depth=tree.depth() if tree is not None else 0,
+            fetch_seconds=self.fetch_seconds,
+            build_seconds=self.build_seconds,
+            loads=self.loads,
+            refreshes=self.refreshes,
+            age_seconds=time.monotonic() - self.refreshed_at if self.refreshed_at is not None else None,
+        )
@@ -0,0 +1,109 @@
+"""
+    Streaming GeoJSON export of SDE feature layers
+
+    Features are fetched through a server-side cursor (ArcSdeQuerySet.sde_stream), with shapes as WKB in WGS84,
+        and serialized one at a time, so memory stays flat regardless of layer size.
+    Two formats:
+        geojson:  a single FeatureCollection document
+        ndjson:   newline-delimited GeoJSON Features, one per line (a.k.a. GeoJSONSeq)
+    Attribute datetimes are localized as for ArcSdeDateTimeField (see arcsde.models.records), then ISO formatted.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from arcsde import wkb
+from arcsde.models.records import SdeRecordIterable
+
+WGS84 = 4326
+FORMATS = {
+    'geojson': 'application/geo+json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _positions(coords, dims, precision):
+    """ Return list of [x, y] positions from a flat coordinate array """
+    xs, ys = coords[0::dims], coords[1::dims]
+    if precision is not None:
+        return [[round(x, precision), round(y, precision)] for x, y in zip(xs, ys)]
+    return [[x, y] for x, y in zip(xs, ys)]
+
+
+def geojson_geometry(geom, precision=None):
+    """ Return a GeoJSON geometry dict for the given WkbGeometry, with coordinates rounded to precision decimals """
+    geom_type, coords, dims = geom.geom_type, geom.coords, geom.dims
+    if geom_type == 'GeometryCollection':
+        return {'type': geom_type, 'geometries': [geojson_geometry(g, precision) for g in coords]}
+    if geom_type == 'Point':
+        coordinates = _positions(coords, dims, precision)[0]
+    elif geom_type == 'LineString':
+        coordinates = _positions(coords, dims, precision)
+    elif geom_type == 'MultiPoint':
+        coordinates = [_positions(point, dims, precision)[0] for point in coords]
+    elif geom_type in ('Polygon', 'MultiLineString'):
+        coordinates = [_positions(seq, dims, precision) for seq in coords]
+    else:  # MultiPolygon
+        coordinates = [[_positions(ring, dims, precision) for ring in polygon] for polygon in coords]
+    return {'type': geom_type, 'coordinates': coordinates}
+
+
+class GeoJsonExporter:
+    """
+        Serializes the active features in queryset as GeoJSON, streamed
+        fields:  names of attributes to export as feature properties - default (None): all fields except shape
+        srid:  spatial reference for exported shapes - GeoJSON is WGS84 (4326) by definition
+        precision:  round coordinates to this many decimal places (None: full precision)
+    """
+    WKB_ANNOTATION = 'arcsde_export_wkb'
+    encoder = DjangoJSONEncoder
+
+    def __init__(self, queryset, fields=None, srid=WGS84, precision=None, chunk_size=2000):
+        self.queryset = queryset
+        self.fields = tuple(queryset.sde_field_names()) if fields is None else tuple(fields)
+        self.srid = srid
+        self.precision = precision
+        self.chunk_size = chunk_size
+
+    def records(self):
+        """ Yield a read-only SdeRecord for each feature, with localized datetimes, from a server-side cursor """
+        pk = self.queryset.model._meta.pk.attname
+        names = (pk, ) + tuple(name for name in self.fields if name != pk) + (self.WKB_ANNOTATION, )
+        qs = self.queryset.sde_active().sde_shape_as_wkb(self.WKB_ANNOTATION, srid=self.srid).values_list(*names)
+        qs._iterable_class = SdeRecordIterable
+        return qs.iterator(chunk_size=self.chunk_size)
+
+    def features(self):
+        """ Yield a GeoJSON Feature dict for each feature """
+        pk = self.queryset.model._meta.pk.attname
+        for record in self.records():
+            shape = getattr(record, self.WKB_ANNOTATION)
+            yield {
+                'type': 'Feature',
+                'id': getattr(record, pk),
+                'geometry': geojson_geometry(wkb.decode_wkb(shape), self.precision) if shape is not None else None,
+                'properties': {name: getattr(record, name) for name in self.fields},
+            }
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=self.encoder, separators=(',', ':'))
+
+    def iter_geojson(self):
+        """ Yield the chunks of a GeoJSON FeatureCollection document """
+        yield '{"type":"FeatureCollection","features":['
+        separator = ''
+        for feature in self.features():
+            yield separator + self.dumps(feature)
+            separator = ',\n'
+        yield ']}\n'
+
+    def iter_ndjson(self):
+        """ Yield newline-delimited GeoJSON Features """
+        for feature in self.features():
+            yield self.dumps(feature) + '\n'
+
+    def iter_format(self, export_format):
+        """ Yield the chunks of the export in the given format, one of FORMATS """
+        if export_format not in FORMATS:
+            raise ValueError(f"Export format must be one of {', '.join(FORMATS)}, not {export_format!r}.")
+        return self.iter_geojson() if export_format == 'geojson' else self.iter_ndjson()
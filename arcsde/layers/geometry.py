@@ -0,0 +1,68 @@
+"""
+    Planar geometry operations on decoded WKB geometries (arcsde.wkb.WkbGeometry)
+
+    Just enough to answer point queries against a polygon layer locally - not a general geometry library.
+    Coordinates are in the layer's spatial reference; no projection is done here.
+"""
+from arcsde.wkb import WkbGeometry
+
+
+def _sequences(geom):
+    """ Yield (coordinate array, dims) for every flat coordinate sequence in the given WkbGeometry """
+    coords, dims = geom.coords, geom.dims
+    if geom.geom_type in ('Point', 'LineString'):
+        yield coords, dims
+    elif geom.geom_type in ('Polygon', 'MultiPoint', 'MultiLineString'):
+        yield from ((seq, dims) for seq in coords)
+    elif geom.geom_type == 'MultiPolygon':
+        yield from ((ring, dims) for polygon in coords for ring in polygon)
+    else:  # GeometryCollection
+        for member in coords:
+            yield from _sequences(member)
+
+
+def bounds(geom):
+    """ Return the (minx, miny, maxx, maxy) bounding box of the given WkbGeometry, or None if it is empty """
+    xs, ys = [], []
+    for seq, dims in _sequences(geom):
+        if len(seq):
+            xs.extend((min(seq[0::dims]), max(seq[0::dims])))
+            ys.extend((min(seq[1::dims]), max(seq[1::dims])))
+    return (min(xs), min(ys), max(xs), max(ys)) if xs else None
+
+
+def vertex_count(geom):
+    """ Return the number of vertices in the given WkbGeometry """
+    return sum(len(seq) // dims for seq, dims in _sequences(geom))
+
+
+def ring_contains(ring, dims, x, y):
+    """ Return True iff point (x, y) is inside the closed ring, a flat coordinate array (even-odd ray casting) """
+    inside = False
+    n = len(ring) // dims
+    if n < 3:
+        return False
+    x1, y1 = ring[(n - 1) * dims], ring[(n - 1) * dims + 1]
+    for i in range(0, n * dims, dims):
+        x2, y2 = ring[i], ring[i + 1]
+        if (y2 > y) != (y1 > y) and x < (x1 - x2) * (y - y2) / (y1 - y2) + x2:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def polygon_contains(rings, dims, x, y):
+    """ Return True iff point (x, y) is inside the exterior ring, and not in any hole, of a polygon's rings """
+    return bool(rings) and ring_contains(rings[0], dims, x, y) and \
+        not any(ring_contains(hole, dims, x, y) for hole in rings[1:])
+
+
+def contains_point(geom: WkbGeometry, x, y):
+    """ Return True iff the given polygonal WkbGeometry contains point (x, y) - always False for other geometries """
+    if geom.geom_type == 'Polygon':
+        return polygon_contains(geom.coords, geom.dims, x, y)
+    if geom.geom_type == 'MultiPolygon':
+        return any(polygon_contains(polygon, geom.dims, x, y) for polygon in geom.coords)
+    if geom.geom_type == 'GeometryCollection':
+        return any(contains_point(member, x, y) for member in geom.coords)
+    return False
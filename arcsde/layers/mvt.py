@@ -0,0 +1,208 @@
+"""
+    A compact, pure-Python encoder for Mapbox Vector Tiles (MVT 2.1), for decoded WKB geometries (arcsde.wkb)
+
+    Just the protobuf subset needed to write a vector tile - no protobuf library required.
+    Geometries must already be in the tile's spatial reference (e.g., Web Mercator);
+        they are scaled to integer tile coordinates, with repeated points and degenerate rings / lines dropped.
+    Spec: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import datetime
+import struct
+from decimal import Decimal
+
+EXTENT = 4096
+VERSION = 2
+
+# Feature geometry types
+POINT, LINESTRING, POLYGON = 1, 2, 3
+GEOM_TYPES = {
+    'Point': POINT, 'MultiPoint': POINT,
+    'LineString': LINESTRING, 'MultiLineString': LINESTRING,
+    'Polygon': POLYGON, 'MultiPolygon': POLYGON,
+}
+# Geometry commands
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+# protobuf wire types
+VARINT, FIXED64, BYTES = 0, 1, 2
+
+
+def varint(value):
+    """ Return value encoded as a protobuf base-128 varint """
+    value &= 0xffffffffffffffff  # negative int64 values are encoded as 10-byte two's complement
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, wire_type, payload):
+    """ Return an encoded protobuf field:  payload is an int for VARINT, else bytes """
+    key = varint((number << 3) | wire_type)
+    if wire_type == VARINT:
+        return key + varint(payload)
+    if wire_type == BYTES:
+        return key + varint(len(payload)) + payload
+    return key + payload
+
+
+def packed(number, values):
+    """ Return an encoded packed repeated uint32 field """
+    return field(number, BYTES, b''.join(varint(v) for v in values))
+
+
+def encode_value(value):
+    """ Return an encoded MVT Value message for a python attribute value """
+    if isinstance(value, bool):
+        return field(7, VARINT, int(value))
+    if isinstance(value, int):
+        return field(6, VARINT, zigzag(value)) if value < 0 else field(5, VARINT, value)
+    if isinstance(value, (float, Decimal)):
+        return field(3, FIXED64, struct.pack('<d', float(value)))
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    return field(1, BYTES, str(value).encode('utf-8'))
+
+
+class TileTransform:
+    """ Scales coordinates in the tile's spatial reference to integer tile coordinates (origin top-left, y down) """
+    def __init__(self, bounds, extent=EXTENT):
+        self.minx, self.miny, self.maxx, self.maxy = bounds
+        self.scale_x = extent / (self.maxx - self.minx)
+        self.scale_y = extent / (self.maxy - self.miny)
+
+    def points(self, coords, dims=2):
+        """ Return list of distinct consecutive (x, y) tile coordinates from a flat coordinate array """
+        points = []
+        minx, maxy, scale_x, scale_y = self.minx, self.maxy, self.scale_x, self.scale_y
+        for i in range(0, len(coords), dims):
+            point = (round((coords[i] - minx) * scale_x), round((maxy - coords[i + 1]) * scale_y))
+            if not points or point != points[-1]:
+                points.append(point)
+        return points
+
+
+def _area(ring):
+    """ Return twice the signed area of a ring of tile coordinates (surveyor's formula) """
+    return sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]))
+
+
+class GeometryEncoder:
+    """ Accumulates MVT geometry commands, with coordinates delta-encoded from the cursor position """
+    def __init__(self):
+        self.commands = []
+        self.cursor = (0, 0)
+
+    def _moves(self, points):
+        x0, y0 = self.cursor
+        for x, y in points:
+            self.commands.extend((zigzag(x - x0), zigzag(y - y0)))
+            x0, y0 = x, y
+        self.cursor = (x0, y0)
+
+    def points(self, points):
+        self.commands.append(MOVE_TO | (len(points) << 3))
+        self._moves(points)
+
+    def line(self, points):
+        self.points(points[:1])
+        self.commands.append(LINE_TO | ((len(points) - 1) << 3))
+        self._moves(points[1:])
+
+    def ring(self, points):
+        self.line(points)
+        self.commands.append(CLOSE_PATH | (1 << 3))
+
+
+def encode_geometry(geom, transform):
+    """ Return (geometry type, list of geometry commands) for a WkbGeometry, or (None, []) if it vanishes in the tile """
+    geom_type = GEOM_TYPES.get(geom.geom_type)
+    dims = geom.dims
+    encoder = GeometryEncoder()
+    if geom_type == POINT:
+        coords = [geom.coords] if geom.geom_type == 'Point' else geom.coords
+        points = [point for c in coords for point in transform.points(c, dims)]
+        if points:
+            encoder.points(points)
+    elif geom_type == LINESTRING:
+        for line in ([geom.coords] if geom.geom_type == 'LineString' else geom.coords):
+            points = transform.points(line, dims)
+            if len(points) >= 2:
+                encoder.line(points)
+    elif geom_type == POLYGON:
+        for polygon in ([geom.coords] if geom.geom_type == 'Polygon' else geom.coords):
+            for i, ring in enumerate(polygon):
+                points = transform.points(ring, dims)
+                if len(points) > 1 and points[0] == points[-1]:
+                    points.pop()  # MVT rings are implicitly closed
+                if len(points) < 3 or _area(points) == 0:
+                    if i == 0:
+                        break  # exterior vanished - drop the polygon, holes and all
+                    continue
+                # exterior rings must have positive area in tile coordinates, interior rings negative
+                if (_area(points) > 0) != (i == 0):
+                    points.reverse()
+                encoder.ring(points)
+    return (geom_type, encoder.commands) if encoder.commands else (None, [])
+
+
+class LayerEncoder:
+    """
+        Encodes one named MVT layer:  add features with add_feature(geometry, attributes, id), then encode()
+        bounds:  (minx, miny, maxx, maxy) of the tile, in the geometries' spatial reference
+    """
+    def __init__(self, name, bounds, extent=EXTENT):
+        self.name = name
+        self.extent = extent
+        self.transform = TileTransform(bounds, extent)
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def _index(self, table, item):
+        if item not in table:
+            table[item] = len(table)
+        return table[item]
+
+    def add_feature(self, geom, attributes=None, feature_id=None):
+        """ Add a WkbGeometry feature with a dict of attributes - returns False if geometry vanishes in the tile """
+        geom_type, commands = encode_geometry(geom, self.transform)
+        if geom_type is None:
+            return False
+        tags = []
+        for key, value in (attributes or {}).items():
+            if value is not None:
+                tags.extend((self._index(self.keys, key), self._index(self.values, encode_value(value))))
+        feature = b''
+        if feature_id is not None and feature_id >= 0:
+            feature += field(1, VARINT, feature_id)
+        if tags:
+            feature += packed(2, tags)
+        feature += field(3, VARINT, geom_type) + packed(4, commands)
+        self.features.append(feature)
+        return True
+
+    def __len__(self):
+        return len(self.features)
+
+    def encode(self):
+        """ Return the encoded Layer message """
+        return b''.join((
+            field(15, VARINT, VERSION),
+            field(1, BYTES, self.name.encode('utf-8')),
+            b''.join(field(2, BYTES, feature) for feature in self.features),
+            b''.join(field(3, BYTES, key.encode('utf-8')) for key in self.keys),
+            b''.join(field(4, BYTES, value) for value in self.values),
+            field(5, VARINT, self.extent),
+        ))
+
+
+def encode_tile(*layers):
+    """ Return an encoded vector tile with the given LayerEncoder layers (empty layers are omitted) """
+    return b''.join(field(3, BYTES, layer.encode()) for layer in layers if len(layer))
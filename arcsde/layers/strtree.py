@@ -0,0 +1,88 @@
+"""
+    A static, in-memory R-tree packed with the Sort-Tile-Recursive (STR) algorithm.
+
+    Indexes the bounding boxes of a fixed set of items for fast "which boxes contain / overlap this" queries.
+    Packed trees are not updated in place - re-build the tree when items change (it is cheap: O(n log n)).
+    Leutenegger, Edgington & Lopez, "STR: A Simple and Efficient Algorithm for R-Tree Packing" (1997)
+"""
+import math
+
+NODE_CAPACITY = 10
+
+
+def union(boxes):
+    """ Return the bounding box (minx, miny, maxx, maxy) of a non-empty sequence of boxes """
+    minx, miny, maxx, maxy = zip(*boxes)
+    return min(minx), min(miny), max(maxx), max(maxy)
+
+
+def overlaps(a, b):
+    """ Return True iff boxes a and b overlap (or touch) """
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+class STRtree:
+    """
+        STR-packed R-tree over boxes, a sequence of (minx, miny, maxx, maxy) tuples.
+        Queries yield the index of each matching box in the original sequence.
+        Nodes are (bbox, entries, is_leaf) tuples, where entries are item indexes in a leaf, or child nodes.
+    """
+    def __init__(self, boxes, node_capacity=NODE_CAPACITY):
+        self.boxes = list(boxes)
+        self.node_capacity = node_capacity
+        self.root = self._build() if self.boxes else None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _pack(self, entries):
+        """ Sort-Tile-Recursive: group (bbox, payload) entries into nodes of spatially adjacent entries """
+        capacity = self.node_capacity
+        n_slices = math.ceil(math.sqrt(math.ceil(len(entries) / capacity)))
+        slice_size = n_slices * capacity
+        entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])  # by x-centre
+        groups = []
+        for start in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[start:start + slice_size], key=lambda entry: entry[0][1] + entry[0][3])
+            groups.extend(vertical_slice[i:i + capacity] for i in range(0, len(vertical_slice), capacity))
+        return groups
+
+    def _build(self):
+        entries = [(box, i) for i, box in enumerate(self.boxes)]
+        is_leaf = True
+        while True:
+            nodes = [
+                (union([entry[0] for entry in group]), tuple(entry[1] for entry in group), is_leaf)
+                for group in self._pack(entries)
+            ]
+            if len(nodes) == 1:
+                return nodes[0]
+            entries = [(node[0], node) for node in nodes]
+            is_leaf = False
+
+    def query(self, box):
+        """ Yield the index of every item whose box overlaps the given (minx, miny, maxx, maxy) box """
+        if self.root is None:
+            return
+        stack = [self.root]
+        while stack:
+            node_box, entries, is_leaf = stack.pop()
+            if not overlaps(node_box, box):
+                continue
+            if is_leaf:
+                boxes = self.boxes
+                yield from (i for i in entries if overlaps(boxes[i], box))
+            else:
+                stack.extend(entries)
+
+    def query_point(self, x, y):
+        """ Yield the index of every item whose box contains the point (x, y) """
+        return self.query((x, y, x, y))
+
+    def depth(self):
+        """ Return the number of levels in the tree """
+        depth, node = 0, self.root
+        while node is not None:
+            depth += 1
+            node = None if node[2] else node[1][0]
+        return depth
@@ -0,0 +1,203 @@
+"""
+    Mapbox Vector Tiles for SDE feature layers
+
+    Web maps can render large SDE layers one z/x/y tile at a time, fetching only what is visible:
+        each tile selects features whose envelope intersects the tile (an index-friendly SDE predicate),
+        generalizes their shapes to the tile's pixel size at that zoom level (see zoom_tolerance),
+        transforms them to Web Mercator, and encodes them as a vector tile (arcsde.layers.mvt).
+    Encoded tiles are cached in memory (LRU) and invalidated when the layer changes, i.e., when the layer's
+        feature count or latest last_edited_date changes.
+    Usage:
+        layer = SdeTileLayer(District.objects.all(), fields=('name', ))
+        tile_bytes, version = layer.tile(z, x, y)
+    See arcsde.layers.views.SdeTileView for a generic tile view.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import models
+
+from arcsde import settings, wkb
+from arcsde.layers import mvt
+from arcsde.models import spatial
+from arcsde.models.functions import SdeEnvIntersects, SdeGeneralize, SdeGeometry, SdeTransform
+
+WEB_MERCATOR = 3857
+ORIGIN = 20037508.342789244   # Web Mercator half-width of the world, in m
+TILE_SIZE = 256               # nominal tile size in pixels, for generalization
+
+
+def tile_bounds(z, x, y):
+    """ Return the (minx, miny, maxx, maxy) Web Mercator bounds of tile z/x/y (XYZ tile scheme, origin top-left) """
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def is_valid_tile(z, x, y):
+    return z >= 0 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def pixel_size(z):
+    """ Return the size of one pixel at zoom level z, in Web Mercator m """
+    return 2 * ORIGIN / (TILE_SIZE * 2 ** z)
+
+
+def tile_latitude(z, y):
+    """ Return the latitude at the centre of tile row y at zoom level z, in degrees """
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / 2 ** z))))
+
+
+def zoom_tolerance(z, srid=None, latitude=0.0, pixels=1.0):
+    """
+        Return the generalization tolerance for maps at zoom level z, in units of srid (default: settings.SDE_SRID):
+            the size of the given number of pixels on the ground, at the given latitude (Web Mercator pixels shrink
+            towards the poles) - or in degrees of longitude for geographic srids (settings.SDE_GEOGRAPHIC_SRIDS).
+        Shapes generalized to within 1 pixel look the same at that zoom level, with far fewer vertices.
+    """
+    size = pixels * pixel_size(z)
+    if int(srid or settings.SDE_SRID) in settings.SDE_GEOGRAPHIC_SRIDS:
+        return size * 180 / ORIGIN
+    return size * math.cos(math.radians(latitude))
+
+
+def bbox_wkt(bounds):
+    minx, miny, maxx, maxy = bounds
+    return f'POLYGON (({minx} {miny}, {maxx} {miny}, {maxx} {maxy}, {minx} {maxy}, {minx} {miny}))'
+
+
+class TileCache:
+    """ A thread-safe, in-memory LRU cache of encoded tiles, bounded by their total size in bytes """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = settings.SDE_TILE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._tiles.move_to_end(key)
+            return tile
+
+    def set(self, key, tile):
+        if len(tile) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            self.size -= len(old) if old is not None else 0
+            self._tiles[key] = tile
+            self.size += len(tile)
+            while self.size > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def stats(self):
+        return dict(tiles=len(self._tiles), bytes=self.size, hits=self.hits, misses=self.misses)
+
+
+# The process-wide tile cache shared by all tile layers
+tile_cache = TileCache()
+
+
+class SdeTileLayer:
+    """
+        Renders vector tiles for the active features in queryset (or a model's active features)
+        name:  the layer name in the tiles - default: the model name
+        fields:  names of attributes to include with each feature (default: only the pk, as the feature id)
+        srid:  the spatial reference of the layer's shapes - default: model.sde_srid or settings.SDE_SRID
+        simplify:  True to generalize shapes to the pixel size at each zoom level (points are never generalized)
+    """
+    WKB_ANNOTATION = 'arcsde_tile_wkb'
+
+    def __init__(self, queryset, name=None, fields=(), srid=None, simplify=True,
+                 min_zoom=0, max_zoom=22, extent=mvt.EXTENT, cache=None, version_ttl=None):
+        if not isinstance(queryset, models.QuerySet):
+            from arcsde.models.managers import ArcSdeQuerySet
+            queryset = ArcSdeQuerySet(model=queryset).sde_active()
+        self.queryset = queryset
+        self.model = queryset.model
+        self.name = name or self.model._meta.model_name
+        self.fields = tuple(fields)
+        self.srid = srid or spatial.layer_srid(self.model)
+        self.simplify = simplify and not getattr(self.model, 'is_point', False)
+        self.min_zoom, self.max_zoom = min_zoom, max_zoom
+        self.extent = extent
+        self.cache = tile_cache if cache is None else cache
+        self.version_ttl = settings.SDE_TILE_VERSION_TTL if version_ttl is None else version_ttl
+        self._version = None
+        self._version_checked = None
+
+    def has_zoom(self, z):
+        return self.min_zoom <= z <= self.max_zoom
+
+    def version(self):
+        """ Return a short string that changes whenever the layer's features change - checked at most every TTL sec. """
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            edited = getattr(self.model, 'last_edited_date_field', None)
+            aggregates = dict(count=models.Count('pk'))
+            if edited:
+                aggregates['edited'] = models.Max(edited)
+            state = self.queryset.order_by().aggregate(**aggregates)
+            self._version = hashlib.md5(repr(sorted(state.items())).encode()).hexdigest()[:16]
+            self._version_checked = now
+        return self._version
+
+    def tile_shape(self, z, latitude=0.0):
+        """
+            Return an expression for the shape generalized for zoom level z, in the layer's spatial reference,
+                then transformed to Web Mercator - generalizing first leaves fewer vertices to transform.
+        """
+        shape = 'shape'
+        if self.simplify:
+            shape = SdeGeneralize(shape, zoom_tolerance(z, self.srid, latitude))
+        return SdeTransform(shape, WEB_MERCATOR)
+
+    def tile_queryset(self, z, x, y):
+        """ Return a queryset of the features in tile z/x/y, annotated with the tile shape as WKB """
+        envelope = SdeTransform(SdeGeometry(bbox_wkt(tile_bounds(z, x, y)), WEB_MERCATOR), self.srid)
+        return self.queryset.filter(SdeEnvIntersects('shape', envelope)).annotate(**{
+            self.WKB_ANNOTATION: models.Func(self.tile_shape(z, tile_latitude(z, y)), function='ST_AsBinary',
+                                             output_field=models.BinaryField())
+        })
+
+    def render(self, z, x, y):
+        """ Return the encoded vector tile z/x/y """
+        layer = mvt.LayerEncoder(self.name, tile_bounds(z, x, y), self.extent)
+        pk = self.model._meta.pk.attname
+        qs = self.tile_queryset(z, x, y)
+        for row in qs.sde_stream(rows='tuple', fields=(pk, ) + self.fields + (self.WKB_ANNOTATION, )):
+            if row[-1] is None:
+                continue
+            feature_id = row[0] if isinstance(row[0], int) else None
+            layer.add_feature(wkb.decode_wkb(row[-1]), dict(zip(self.fields, row[1:-1])), feature_id)
+        return mvt.encode_tile(layer)
+
+    def tile(self, z, x, y):
+        """ Return (encoded tile, layer version) for tile z/x/y, from the tile cache if possible """
+        version = self.version()
+        key = (self.model._meta.label, self.name, self.fields, version, z, x, y)
+        tile = self.cache.get(key)
+        if tile is None:
+            tile = self.render(z, x, y)
+            self.cache.set(key, tile)
+        return tile, version
@@ -0,0 +1,24 @@
+from django.urls import path
+
+import arcsde.layers.views
+
+app_name = "layers"
+
+# URL Arguments:
+# app_label, model_name:  identify the SDE feature model (with a shape mixin) for the layer
+# z, x, y:  tile zoom level and coordinates in the XYZ tile scheme
+# format:  export format - geojson or ndjson
+
+# Opt-in:  include these URLs separately, e.g., path('layers/', include('arcsde.layers.urls'))
+# Only models that declare the attributes they publish are served: sde_tile_fields for tiles, sde_export_fields for export
+# CAUTION: These views are only login-protected -- no other permissions checks applied -- see Design Notes
+urlpatterns = [
+    path('tiles/<slug:app_label>/<slug:model_name>/<int:z>/<int:x>/<int:y>.mvt',
+        view = arcsde.layers.views.SdeTileView.as_view(),
+        name = 'tile'
+    ),
+    path('export/<slug:app_label>/<slug:model_name>.<slug:format>',
+        view = arcsde.layers.views.SdeGeoJsonExportView.as_view(),
+        name = 'export'
+    ),
+]
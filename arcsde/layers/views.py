@@ -0,0 +1,112 @@
+"""
+    Views for SDE feature layers
+"""
+import functools
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.views import generic
+
+from arcsde.layers import export
+from arcsde.layers.tiles import SdeTileLayer, is_valid_tile
+
+# CAUTION: These views are only login-protected -- no other permissions checks applied -- see Design Notes
+
+
+@functools.lru_cache(maxsize=None)
+def get_tile_layer(model):
+    """ Return the shared SdeTileLayer for the given SDE feature model, with attributes named in model.sde_tile_fields """
+    return SdeTileLayer(model, fields=getattr(model, 'sde_tile_fields', ()))
+
+
+class SdeLayerModelMixin:
+    """
+        Lookup the SDE feature model (with a shape) named by 'app_label', 'model_name' in view kwargs
+        Only models that opt-in, by declaring the attributes they publish in layer_fields_attr, are found.
+    """
+    kwargs = None  # must be mixed in with view class that provides kwargs
+    layer_fields_attr = None
+
+    def get_layer_model(self):
+        try:
+            model = apps.get_model(self.kwargs['app_label'], self.kwargs['model_name'])
+        except (KeyError, LookupError):
+            raise Http404
+        if not getattr(model, 'has_shape', False) or not hasattr(model, self.layer_fields_attr):
+            raise Http404
+        return model
+
+
+class SdeTileView(SdeLayerModelMixin, generic.View):
+    """
+        Serve Mapbox Vector Tiles for an SDE feature layer:  the model named by 'app_label', 'model_name' URL kwargs,
+            or sub-classes may set tile_layer.  Models opt-in by declaring sde_tile_fields (may be empty).
+        Responses carry an ETag for the layer version, so unchanged tiles are revalidated with a 304.
+    """
+    tile_layer = None
+    layer_fields_attr = 'sde_tile_fields'
+    content_type = 'application/vnd.mapbox-vector-tile'
+
+    def get_tile_layer(self):
+        if self.tile_layer is not None:
+            return self.tile_layer
+        return get_tile_layer(self.get_layer_model())
+
+    def get(self, request, z, x, y, **kwargs):
+        layer = self.get_tile_layer()
+        if not is_valid_tile(z, x, y) or not layer.has_zoom(z):
+            raise Http404
+        etag = f'"{layer.version()}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponseNotModified(headers={'ETag': etag})
+        tile, version = layer.tile(z, x, y)
+        response = HttpResponse(tile, content_type=self.content_type)
+        response['ETag'] = f'"{version}"'
+        return response
+
+
+class SdeGeoJsonExportView(SdeLayerModelMixin, generic.View):
+    """
+        Stream a GeoJSON export of an SDE feature layer, in 'geojson' (FeatureCollection) or 'ndjson' format
+            given by the 'format' URL kwarg or ?format= query parameter.
+        Layer is the model named by 'app_label', 'model_name' URL kwargs, or sub-classes may set model or queryset.
+        Exported attributes are given by fields, or model.sde_export_fields - models named in the URL must declare it.
+        Attributes are never exported by default:  edit tracking fields (e.g., created_user) are rarely meant to be public.
+    """
+    layer_fields_attr = 'sde_export_fields'
+    model = None
+    queryset = None
+    fields = ()
+    export_format = 'geojson'
+    precision = None
+    chunk_size = 2000
+
+    def get_queryset(self):
+        if self.queryset is not None:
+            return self.queryset.all()
+        model = self.model or self.get_layer_model()
+        return model._default_manager.all()
+
+    def get_fields(self, queryset):
+        fields = self.fields or getattr(queryset.model, self.layer_fields_attr, None)
+        if fields is None:
+            raise ImproperlyConfigured(
+                f'{self.__class__.__name__} requires fields, or {queryset.model.__name__}.{self.layer_fields_attr}.'
+            )
+        return fields
+
+    def get_export_format(self):
+        return self.kwargs.get('format') or self.request.GET.get('format') or self.export_format
+
+    def get(self, request, *args, **kwargs):
+        export_format = self.get_export_format()
+        if export_format not in export.FORMATS:
+            raise Http404
+        queryset = self.get_queryset()
+        exporter = export.GeoJsonExporter(queryset, fields=self.get_fields(queryset),
+                                          precision=self.precision, chunk_size=self.chunk_size)
+        response = StreamingHttpResponse(exporter.iter_format(export_format),
+                                         content_type=export.FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{queryset.model._meta.model_name}.{export_format}"'
+        return response
@@ -0,0 +1,43 @@
+"""
+    Export an SDE feature layer as GeoJSON, streamed with flat memory use, e.g.:
+        ./manage.py sde_export myapp.District --format ndjson --fields name,area -o districts.ndjson
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from arcsde.layers import export
+
+
+class Command(BaseCommand):
+    help = 'Export the active features of an SDE feature model (with a shape) as GeoJSON or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='SDE feature model, as app_label.ModelName')
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='geojson', dest='export_format')
+        parser.add_argument('--fields', default='',
+                            help='Comma-separated attribute names to export - default: all fields except shape')
+        parser.add_argument('--srid', type=int, default=export.WGS84,
+                            help='Spatial reference for exported shapes - GeoJSON is WGS84 (4326) by definition')
+        parser.add_argument('--precision', type=int, default=None, help='Round coordinates to this many decimals')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows fetched at a time')
+        parser.add_argument('-o', '--output', default=None, help='Output file - default: stdout')
+
+    def handle(self, *args, model, export_format, fields, srid, precision, chunk_size, output, **options):
+        try:
+            model_class = apps.get_model(model)
+        except (LookupError, ValueError) as e:
+            raise CommandError(f'Unknown model {model}: {e}')
+        if not getattr(model_class, 'has_shape', False):
+            raise CommandError(f'{model} is not an SDE feature model with a shape.')
+
+        exporter = export.GeoJsonExporter(
+            model_class._default_manager.all(),
+            fields=[name.strip() for name in fields.split(',') if name.strip()] or None,
+            srid=srid, precision=precision, chunk_size=chunk_size,
+        )
+        if output:
+            with open(output, 'w', encoding='utf-8') as out:
+                out.writelines(exporter.iter_format(export_format))
+        else:
+            for chunk in exporter.iter_format(export_format):
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,44 @@
+"""
+    Generate missing thumbnails for the image attachments of an SDE feature model, in a pool of processes, e.g.:
+        ./manage.py sde_thumbnails myapp.Inspection --sizes small,medium --processes 4
+"""
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from arcsde import settings
+from arcsde.attachments import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Backfill the thumbnail cache for the image attachments of an SDE feature model (requires Pillow).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='SDE feature model with attachments, as app_label.ModelName')
+        parser.add_argument('--sizes', default='',
+                            help='Comma-separated thumbnail size names - default: all of SDE_THUMBNAIL_SIZES')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of worker processes - default: one per CPU, 0 to work in this process')
+        parser.add_argument('--batch-size', type=int, default=None, help='Number of images loaded at a time')
+
+    def handle(self, *args, model, sizes, processes, batch_size, **options):
+        try:
+            model_class = apps.get_model(model)
+        except (LookupError, ValueError) as e:
+            raise CommandError(f'Unknown model {model}: {e}')
+        attachments_model = model_class.sde_attachments if getattr(model_class, 'has_attachments', lambda: False)() \
+            else None
+        if attachments_model is None:
+            raise CommandError(f'{model} has no SDE attachments.')
+
+        sizes = tuple(name.strip() for name in sizes.split(',') if name.strip())
+        unknown = set(sizes) - set(settings.SDE_THUMBNAIL_SIZES)
+        if unknown:
+            raise CommandError(f"Unknown thumbnail sizes: {', '.join(sorted(unknown))}")
+
+        try:
+            count = thumbnails.backfill_thumbnails(attachments_model.objects.all(), sizes=sizes or None,
+                                                   processes=processes, batch_size=batch_size)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'Generated {count} thumbnails for {model} attachments.')
@@ -14,6 +14,9 @@ from arcsde.models.fields import (
     ArcSdeDateTimeField,
 )
 
+# registers the SDE spatial lookups (shape__sde_intersects, etc.) on the shape fields
+from arcsde.models import lookups
+
 from arcsde.models.managers import(
     ArcSdeQuerySet, ArcSdeManager, AnnotatedArcSdeManager, ArcSdeActiveArchiveManager,
 )
@@ -0,0 +1,130 @@
+"""
+SDE DB catalog metadata
+@author: powderflask
+
+SDE logic frequently needs to know about the DB relations behind a model: the table owner (for SDE key procs),
+    whether the base table and / or its EVW view exist, whether the feature has an __attach table.
+These catalog queries are not cheap, and the answers don't change while the app is running,
+    so the catalog for all tables and views is loaded in a single query on first use and cached for the process.
+Call sde_catalog.invalidate() after creating or dropping SDE tables (e.g., in test fixtures).
+"""
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from arcsde import settings
+
+
+@dataclass(frozen=True)
+class SdeTableInfo:
+    """ Catalog metadata for one SDE feature table, keyed by its base table name """
+    name: str
+    owner: Optional[str]
+    base_exists: bool
+    evw_exists: bool
+    attach_exists: bool
+
+
+class SdeCatalog:
+    """
+        A process-wide cache of the DB catalog: relation (table or view) names and their owners
+        Note: owners are only available for Postgre DB - other backends report owner None.
+    """
+    EVW_SUFFIX = '_evw'
+    ATTACH_SUFFIX = '__attach'
+
+    PG_RELATIONS_QUERY = """
+        select t.table_name, u.usename
+        from information_schema.tables t
+        join pg_catalog.pg_class c on (t.table_name = c.relname)
+        join pg_catalog.pg_user u on (c.relowner = u.usesysid);
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self._relations = None   # relation name : owner
+        self._tables = {}        # base table name : SdeTableInfo
+        self._missing = set()    # names not found, even after re-loading the catalog - until invalidated
+        self._lock = threading.Lock()
+
+    def _query_relations(self):
+        """ Return dict of all relation names with their owner, from a single catalog query """
+        connection = connections[self.using]
+        if connection.vendor != 'postgresql':
+            return {name: None for name in connection.introspection.table_names(include_views=True)}
+
+        relations = {}
+        with connection.cursor() as cursor:
+            cursor.execute(self.PG_RELATIONS_QUERY)
+            for name, owner in cursor.fetchall():
+                relations.setdefault(name, owner)
+        return relations
+
+    def load(self):
+        """ (Re-)load the catalog from the DB - may be called at startup to pre-load the cache """
+        relations = self._query_relations()
+        with self._lock:
+            self._relations = relations
+            self._tables = {}
+
+    def invalidate(self):
+        """ Discard cached catalog - it will be re-loaded on next use """
+        with self._lock:
+            self._relations = None
+            self._tables = {}
+            self._missing = set()
+
+    @property
+    def relations(self):
+        if self._relations is None:
+            self.load()
+        return self._relations
+
+    def exists(self, name):
+        """ Return True iff the given table or view exists in DB """
+        return name in self.relations
+
+    def owner(self, name):
+        """
+            Return the username of the given table's owner (None for backends without owners)
+            An unknown table re-loads the catalog, once - until invalidated, it is then known to be missing.
+            Raises LookupError if the table is missing, since SDE procs can't compute keys without its owner.
+        """
+        if name not in self.relations and name not in self._missing:
+            self.load()
+            if name not in self.relations:
+                with self._lock:
+                    self._missing.add(name)
+        if name not in self.relations:
+            raise LookupError(f'SDE table {name} not found in DB catalog - unable to determine its owner.')
+        return self.relations[name]
+
+    def base_table_name(self, name):
+        """ Return the base table name for the given table or EVW view name """
+        return name[:-len(self.EVW_SUFFIX)] if name.endswith(self.EVW_SUFFIX) else name
+
+    def table_info(self, name):
+        """ Return SdeTableInfo for the SDE table with given base table or EVW view name """
+        base = self.base_table_name(name)
+        info = self._tables.get(base)
+        if info is None:
+            relations = self.relations
+            evw = f'{base}{self.EVW_SUFFIX}'
+            attach = f'{base}{self.ATTACH_SUFFIX}'
+            info = SdeTableInfo(
+                name=base,
+                owner=relations.get(base, relations.get(evw)),
+                base_exists=base in relations,
+                evw_exists=evw in relations,
+                attach_exists=(f'{attach}{self.EVW_SUFFIX}' if settings.SDE_USE_EVW else attach) in relations,
+            )
+            with self._lock:
+                if self._relations is relations:  # don't cache info from a catalog re-loaded or invalidated meanwhile
+                    info = self._tables.setdefault(base, info)
+        return info
+
+
+# The process-wide catalog for the default DB
+sde_catalog = SdeCatalog()
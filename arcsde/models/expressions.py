@@ -1,30 +1,37 @@
 """
-    Usefule query expressions for working with SDE models.
+    Useful query expressions for working with SDE models.
 """
 from django.db import models
 from django.db.models.functions import Coalesce
 
 
-def sde_attachment_count(model):
+def attachment_relation(model):
+    """ Return the attachments model and its foreign key to model, for models with attachments """
+    fk = model._meta.get_field('attachment_set').field
+    return fk.model, fk
+
+
+def attachment_counts(model):
     """
-        Return a Query Expression providing a count of the number of attachments on each object
-        Roughly equivalent to: Count('attachment_set')
-         --> broken b/c aggregation on Views with non-primary-key relations broke in django 1.11 -- see https://code.djangoproject.com/ticket/28107
-        UPDATE: DEPRECATED -- the issue above is resoved, just use:  Count('attachment_set)
+        Return a queryset of the attachment counts for model, by related object:
+            SELECT rel_globalid, COUNT(*) AS attachment_count FROM attach GROUP BY rel_globalid
     """
-    if model.has_attachments() :
+    attach_model, fk = attachment_relation(model)
+    return attach_model._base_manager.order_by().values(fk.attname).annotate(attachment_count=models.Count('*'))
 
-        try:
-            attach_model = model.sde_attachments.attachments_model
-        except AttributeError:
-            from arcsde.attachments.models import get_attachment_model
-            attach_model = get_attachment_model(model)
 
-        join_on = 'related_object_id'
-        join = {join_on : models.OuterRef('globalid')}
-        attachments = attach_model.objects.filter(**join).order_by().values(join_on)
-        attachments_count = attachments.annotate(count=models.Count('*')).values('count')
-        return Coalesce(models.Subquery(attachments_count), models.Value(0))   # ensure we get a zero, not None
+def sde_attachment_count(model):
+    """
+        Return a Query Expression providing a count of the number of attachments on each object, as a correlated sub-query
+        Roughly equivalent to: Count('attachment_set'), but without aggregating (GROUP BY) the outer query.
+        See ArcSdeQuerySet.annotate_attachment_count for other strategies.
+    """
+    if model.has_attachments():
+        attach_model, fk = attachment_relation(model)
+        counts = attachment_counts(model).filter(**{fk.attname: models.OuterRef(fk.target_field.attname)})
+        return Coalesce(   # ensure we get a zero, not None
+            models.Subquery(counts.values('attachment_count'), output_field=models.IntegerField()), models.Value(0)
+        )
     else:
         return models.Value(0, output_field=models.IntegerField())
 
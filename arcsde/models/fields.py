@@ -50,7 +50,7 @@ class ArcSdeDateTimeField(models.DateTimeField):
         """ Take a naive UTC datetime from DB and convert to aware local TZ. """
         if value and (not settings.USE_TZ or timezone.is_naive(value)):
             # Localize the naive SDE datetime from UTC to settings.TIME_ZONE
-            value = tz.localize(value)
+            value = tz.fast_localize(value)
         return value
 
     def get_prep_value(self, value):
@@ -1,8 +1,13 @@
 """
     SDE DB Functions.
 """
+from typing import NamedTuple
+
 from django.db import models
 
+from arcsde import settings, wkb
+from arcsde.models import fields
+
 
 class SdeAreaHa(models.Func):
     """
@@ -19,19 +24,161 @@ class SdeAreaHa(models.Func):
         )
 
 
+class SdeGeometry(models.Func):
+    """
+        An Expression that constructs an SDE geometry from WKT text or WKB bytes in the given srid
+            - both are query parameters
+    """
+    function = 'st_geometry'
+    wkb_function = 'ST_GeomFromWKB'
+    output_field = fields.ArcSdeGeometryField()
+
+    def __init__(self, geom, srid):
+        if isinstance(geom, (bytes, bytearray, memoryview)):
+            super().__init__(models.Value(bytes(geom), output_field=models.BinaryField()), models.Value(int(srid)),
+                             function=self.wkb_function)
+        else:
+            super().__init__(models.Value(geom), models.Value(int(srid)))
+
+
+class SdeTransform(models.Func):
+    """
+        An Expression that transforms an SDE shape (field name or geometry expression) to the given srid
+    """
+    function = 'ST_Transform'
+    output_field = fields.ArcSdeGeometryField()
+
+    def __init__(self, expression, srid):
+        super().__init__(expression, models.Value(int(srid)))
+
+
+class SdeBuffer(models.Func):
+    """
+        An Expression that renders an SDE shape (field name or geometry expression) buffered by distance,
+            in units of the shape's spatial reference
+    """
+    function = 'ST_Buffer'
+    output_field = fields.ArcSdeGeometryField()
+
+    def __init__(self, expression, distance):
+        super().__init__(expression, models.Value(float(distance)))
+
+
+class SdeDistance(models.Func):
+    """
+        An Expression that renders the distance between two SDE shapes, in units of their spatial reference
+    """
+    function = 'ST_Distance'
+    output_field = models.FloatField()
+
+
+class SdeKnnDistance(models.Func):
+    """
+        An Expression for ordering by distance between two shapes with an index-assisted KNN (k-nearest neighbour)
+            distance operator, e.g., '<->' - default: settings.SDE_KNN_OPERATOR.  Only meaningful in order_by.
+    """
+    template = '(%(expressions)s)'
+    output_field = models.FloatField()
+
+    def __init__(self, lhs, rhs, operator=None):
+        operator = operator or settings.SDE_KNN_OPERATOR
+        assert operator, 'SdeKnnDistance requires a KNN distance operator - see settings.SDE_KNN_OPERATOR'
+        super().__init__(lhs, rhs, arg_joiner=f' {operator} ')
+
+
+class SdeTotalAreaHa(models.Sum):
+    """
+        An aggregate Expression that renders the total area, in HA, of SDE shapes, e.g., per district
+    """
+    def __init__(self, shape_field_name='shape', **extra):
+        super().__init__(SdeAreaHa(shape_field_name), output_field=models.FloatField(), **extra)
+
+
 class BaseSdeShapeFunc(models.Func):
     """
-         Base class for Query Expressions that work on an SDE shape field
+         Base class for Query Expressions that work on an SDE shape field (or shape expression),
+            optionally transformed to the given srid first (srid=None: as stored)
     """
     function = None   # Sub-classes must set this to a valide SDE shape function
-    def __init__(self, shape_field_name='shape', srid='4269') :
+    transform_template = '%(function)s(ST_Transform(%(expressions)s, %(srid)s))'
+
+    def __init__(self, shape_field_name='shape', srid='4269', **extra) :
         super().__init__(
-             models.F(shape_field_name),
-             function=self.function,
-             template='%(function)s(ST_Transform(%(expressions)s, %(srid)s))',
-             srid=srid
+             models.F(shape_field_name) if isinstance(shape_field_name, str) else shape_field_name,
+             template=self.transform_template if srid else self.template,
+             srid=srid,
+             **extra
+        )
+
+
+class SdeAsBinary(BaseSdeShapeFunc):
+    """
+        A simple Expression that renders an SDE shape field as OGC Well-Known Binary (WKB),
+        optionally transformed to the given srid.  Use arcsde.wkb.decode_wkb to decode the result.
+    """
+    function = 'ST_AsBinary'
+    output_field = models.BinaryField()
+
+    def __init__(self, shape_field_name='shape', srid=None) :
+        super().__init__(shape_field_name, srid=int(srid) if srid else None)
+
+
+class Coordinates(NamedTuple):
+    """ The (x, y) coordinates of a point - (long, lat) for a geographic spatial reference """
+    x: float
+    y: float
+
+    @property
+    def lat(self):
+        return self.y
+
+    @property
+    def long(self):
+        return self.x
+
+
+class CoordinatesField(models.Field):
+    """
+        Output field for SdeCoordinates:  decodes a WKB point into Coordinates, rounded to precision decimal places
+    """
+    def __init__(self, precision=None, **kwargs):
+        self.precision = precision
+        super().__init__(**kwargs)
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        point = wkb.decode_wkb(value)
+        if point.geom_type != 'Point':
+            raise wkb.WkbError(f'Expected a Point geometry for coordinates, not {point.geom_type}.')
+        x, y = point.coords[:2]
+        if self.precision is not None:
+            x, y = round(x, self.precision), round(y, self.precision)
+        return Coordinates(x, y)
+
+
+class SdeCoordinates(BaseSdeShapeFunc):
+    """
+        An Expression that renders both coordinates of an SDE point shape, transformed to the given srid,
+            as Coordinates(x, y) - with a single ST_Transform rather than one each for Latitude and Longitude.
+        Coordinates are rounded to precision decimal places.
+        Defaults: settings.SDE_COORDINATES_SRID, settings.SDE_COORDINATES_PRECISION
+    """
+    function = 'ST_AsBinary'
+
+    def __init__(self, shape_field_name='shape', srid=None, precision=None) :
+        super().__init__(
+             shape_field_name,
+             srid=int(settings.SDE_COORDINATES_SRID if srid is None else srid),
+             output_field=CoordinatesField(
+                 precision=settings.SDE_COORDINATES_PRECISION if precision is None else precision
+             ),
         )
 
+
 class Latitude(BaseSdeShapeFunc):
     """
         A simple Expression that renders the latitutde of an SDE shape field
@@ -43,3 +190,118 @@ class Longitude(BaseSdeShapeFunc):
         A simple Expression that renders the longitude of an SDE shape field
     """
     function = 'ST_X'
+
+
+class SdeGeneralize(models.Func):
+    """
+        An Expression that renders an SDE shape (field name or geometry expression) generalized (simplified)
+            to within tolerance, in units of the shape's spatial reference
+    """
+    function = 'ST_Generalize'
+    output_field = fields.ArcSdeGeometryField()
+
+    def __init__(self, expression, tolerance):
+        super().__init__(expression, models.Value(float(tolerance)))
+
+
+class SdeShapeGeneralized(BaseSdeShapeFunc):
+    """
+        An Expression that renders an SDE shape field generalized to within tolerance, in units of the shape's
+            spatial reference, as WKB (output='wkb', decode with arcsde.wkb.decode_wkb) or WKT (output='wkt'),
+            optionally transformed to the given srid - after generalization, so there are fewer vertices to transform.
+    """
+    OUTPUTS = {
+        'wkb': ('ST_AsBinary', models.BinaryField),
+        'wkt': ('ST_AsText', models.TextField),
+    }
+
+    def __init__(self, shape_field_name='shape', tolerance=0, output='wkb', srid=None):
+        assert output in self.OUTPUTS, f"Generalized shape output must be one of {', '.join(self.OUTPUTS)}"
+        function, output_field = self.OUTPUTS[output]
+        super().__init__(
+            SdeGeneralize(models.F(shape_field_name), tolerance),
+            srid=int(srid) if srid else None,
+            function=function,
+            output_field=output_field(),
+        )
+
+
+class SdeIntersects(models.Func):
+    """
+        A boolean Expression that is true where two SDE shapes intersect - may be used directly in filter()
+        Exact, and expensive - see arcsde.models.spatial.intersects for an envelope pre-filtered predicate.
+    """
+    function = 'ST_Intersects'
+    output_field = models.BooleanField()
+
+
+class SdeEnvIntersects(SdeIntersects):
+    """
+        A boolean Expression that is true where the envelopes (bounding boxes) of two SDE shapes intersect
+    """
+    function = 'ST_EnvIntersects'
+
+
+class BaseSdeEnvelopeFunc(models.Func):
+    """
+         Base class for Expressions that render one bound of an SDE shape's envelope
+    """
+    function = None   # Sub-classes must set this to a valid SDE envelope function
+    output_field = models.FloatField()
+
+
+class SdeMinX(BaseSdeEnvelopeFunc):
+    function = 'ST_MinX'
+
+class SdeMinY(BaseSdeEnvelopeFunc):
+    function = 'ST_MinY'
+
+class SdeMaxX(BaseSdeEnvelopeFunc):
+    function = 'ST_MaxX'
+
+class SdeMaxY(BaseSdeEnvelopeFunc):
+    function = 'ST_MaxY'
+
+
+class ExtentField(models.Field):
+    """ Output field for SdeExtent:  a (minx, miny, maxx, maxy) tuple of floats, or None for no shapes """
+    def get_internal_type(self):
+        return 'TextField'
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):  # as_sqlite renders a comma-separated string
+            value = value.split(',')
+        if value is None or None in value:
+            return None
+        return tuple(float(v) for v in value)
+
+
+class SdeExtent(models.Aggregate):
+    """
+        An aggregate Expression that renders the bounding box of SDE shapes as a (minx, miny, maxx, maxy) tuple,
+            e.g., to "fit bounds" on a map.  Coordinates are in the shapes' spatial reference.
+    """
+    name = 'SdeExtent'
+    output_field = ExtentField()
+    BOUNDS = ((models.Min, SdeMinX), (models.Min, SdeMinY), (models.Max, SdeMaxX), (models.Max, SdeMaxY))
+
+    def __init__(self, shape_field_name='shape', **extra):
+        super().__init__(models.F(shape_field_name), **extra)
+
+    def compile_bounds(self, compiler):
+        """ Return the 4 compiled bound aggregates as (list of sql, params) """
+        shape = self.get_source_expressions()[0]
+        sql, params = [], []
+        for aggregate, bound in self.BOUNDS:
+            bound_sql, bound_params = compiler.compile(aggregate(bound(shape), filter=self.filter))
+            sql.append(bound_sql)
+            params.extend(bound_params)
+        return sql, params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = self.compile_bounds(compiler)
+        return 'ARRAY[%s]' % ', '.join(sql), params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = self.compile_bounds(compiler)
+        return " || ',' || ".join(sql), params
@@ -0,0 +1,118 @@
+"""
+Joins to sub-queries, for set-based queries the django ORM can't express
+@author: powderflask
+
+Django joins tables through relations; these joins add a sub-query (derived table) to a query's FROM clause instead:
+    alias = query.join(SomeSubqueryJoin(...))
+    queryset.annotate(value=JoinedColumn(alias, 'column', output_field))
+The sub-query is compiled by django from a queryset, so all values are query parameters.
+See arcsde.models.spatial.SdeIntersectsJoin (a LATERAL join) and DerivedTableJoin, e.g., for grouped aggregates:
+    LEFT OUTER JOIN (SELECT rel_globalid, COUNT(*) AS attachment_count FROM attach GROUP BY rel_globalid) attach
+        ON (attach.rel_globalid = feature.globalid)
+"""
+import copy
+
+from django.db import models
+from django.db.models.sql.constants import INNER, LOUTER
+
+
+class JoinedColumn(models.Expression):
+    """
+        A reference to a column of a joined sub-query, by alias - relabeled along with the query, like a Col
+    """
+    def __init__(self, alias, column, output_field):
+        super().__init__(output_field=output_field)
+        self.alias = alias
+        self.column = column
+
+    def as_sql(self, compiler, connection):
+        return f'{compiler.quote_name_unless_alias(self.alias)}.{connection.ops.quote_name(self.column)}', []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias), self.column, self.output_field)
+
+    def get_group_by_cols(self, alias=None):
+        return [self]
+
+
+class BaseSubqueryJoin:
+    """
+        Base class for joins to a sub-query built from queryset, rather than to a table
+        Quacks like django.db.models.sql.datastructures.Join so it can live in the query's alias_map:
+            query.join(SubqueryJoin(...)) returns the alias to use for references to the sub-query's columns.
+        Sub-classes define as_sql and any additional identity_args that distinguish one join from another.
+    """
+    filtered_relation = None
+    join_field = None
+    nullable = True
+
+    def __init__(self, parent_model, parent_alias, queryset, table_alias=None, join_type=INNER):
+        self.parent_model = parent_model
+        self.parent_alias = parent_alias
+        self.queryset = queryset
+        self.table_name = queryset.model._meta.db_table
+        self.table_alias = table_alias
+        self.join_type = join_type
+
+    def as_sql(self, compiler, connection):
+        raise NotImplementedError('Sub-classes must define the SQL for a sub-query join.')
+
+    def identity_args(self):
+        return ()
+
+    def relabeled_clone(self, change_map):
+        new = copy.copy(self)
+        new.parent_alias = change_map.get(self.parent_alias, self.parent_alias)
+        new.table_alias = change_map.get(self.table_alias, self.table_alias)
+        return new
+
+    @property
+    def identity(self):
+        return (self.__class__, self.table_name, self.parent_alias, self.queryset.query) + tuple(self.identity_args())
+
+    def __eq__(self, other):
+        if not isinstance(other, BaseSubqueryJoin):
+            return NotImplemented
+        return self.identity == other.identity
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def equals(self, other):
+        return self == other
+
+    def demote(self):
+        new = self.relabeled_clone({})
+        new.join_type = INNER
+        return new
+
+    def promote(self):
+        new = self.relabeled_clone({})
+        new.join_type = LOUTER
+        return new
+
+
+class DerivedTableJoin(BaseSubqueryJoin):
+    """
+        A join to the rows of queryset, as a derived table, on equal values in pairs of columns:
+            on:  sequence of (sub-query column, parent model field name) pairs
+        The sub-query is not correlated with the parent query, so the DB can evaluate it once for the whole query.
+    """
+    def __init__(self, parent_model, parent_alias, queryset, on, table_alias=None, join_type=INNER):
+        super().__init__(parent_model, parent_alias, queryset, table_alias=table_alias, join_type=join_type)
+        self.on = tuple(on)
+
+    def identity_args(self):
+        return (self.on, )
+
+    def as_sql(self, compiler, connection):
+        # compile a clone - compiling must not alter the queryset's query
+        sql, params = self.queryset.query.clone().get_compiler(connection=connection).as_sql()
+        alias = compiler.quote_name_unless_alias(self.table_alias)
+        parent_alias = compiler.quote_name_unless_alias(self.parent_alias)
+        condition = ' AND '.join(
+            f'{alias}.{connection.ops.quote_name(column)} = '
+            f'{parent_alias}.{connection.ops.quote_name(self.parent_model._meta.get_field(name).column)}'
+            for column, name in self.on
+        )
+        return f'{self.join_type} ({sql}) {alias} ON ({condition})', params
@@ -0,0 +1,247 @@
+"""
+SDE feature key allocation
+@author: powderflask
+
+SDE computes keys for new features with DB procs (e.g., next_rowid(owner, table)) -- one call per feature.
+When many features are created, those calls dominate, so objectids and globalids can be reserved in blocks
+and handed out from an in-process pool instead.
+
+Safe across worker processes:  each key in a block is drawn from SDE's own key generator, and blocks are reserved
+    on a dedicated connection that commits independently of any transaction in progress on the caller's connection,
+    so no two processes can ever hold the same key.  Pools are discarded in a forked child process.
+Reserved keys that are never used (e.g., when a process exits) are simply skipped - SDE keys need not be contiguous.
+"""
+import logging
+import os
+import threading
+from collections import deque
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from arcsde import settings
+
+logger = logging.getLogger('arcsde')
+
+
+def run_on_own_connection(fn, *args, using=DEFAULT_DB_ALIAS):
+    """
+        Run fn(cursor, *args) on a dedicated DB connection, in its own thread, and return its result.
+        Django connections are thread-local, so the work is committed (autocommit) independently of the caller's
+        connection, even if the caller is inside an atomic block that later rolls back.
+    """
+    result = {}
+
+    def target():
+        try:
+            with connections[using].cursor() as cursor:
+                result['value'] = fn(cursor, *args)
+        except Exception as e:
+            result['error'] = e
+        finally:
+            connections[using].close()
+
+    thread = threading.Thread(target=target, name='arcsde-keys', daemon=True)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+class KeyPool:
+    """
+        A pool of keys reserved from one key source (e.g., one SDE table), with usage counters
+        reserve_fn(n) must return a list of n freshly reserved keys.
+    """
+    def __init__(self, reserve_fn, block_size, low_water=0, background=False):
+        self.reserve_fn = reserve_fn
+        self.block_size = block_size
+        self.low_water = low_water
+        self.background = background
+        self.keys = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+
+    def _refill(self, n=None):
+        """ Reserve a new block of keys and add them to the pool """
+        keys = self.reserve_fn(n or self.block_size)
+        with self.lock:
+            self.keys.extend(keys)
+            self.refills += 1
+
+    def _background_refill(self):
+        try:
+            self._refill()
+        except Exception:
+            logger.exception('SDE key pool background refill failed.')
+        finally:
+            self.refilling = False
+            # connections opened by reserve_fn in this thread are thread-local: close them, no request cleanup will
+            connections.close_all()
+
+    def _maybe_start_refill(self):
+        """ Start a background refill if pool is running low. Caller must hold the lock. """
+        if self.background and not self.refilling and len(self.keys) <= self.low_water:
+            self.refilling = True
+            threading.Thread(target=self._background_refill, name='arcsde-key-refill', daemon=True).start()
+
+    def get(self):
+        """ Return the next key from the pool, refilling synchronously if it is empty """
+        missed = False
+        while True:
+            with self.lock:
+                if self.keys:
+                    if missed:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    key = self.keys.popleft()
+                    self._maybe_start_refill()
+                    return key
+            missed = True
+            self._refill()  # another thread may drain the new block before we get to it, hence the loop.
+
+    def take(self, n):
+        """ Return a list of n keys, drawing from the pool first, then reserving any shortfall in one go """
+        with self.lock:
+            keys = [self.keys.popleft() for _ in range(min(n, len(self.keys)))]
+            self.hits += len(keys)
+            shortfall = n - len(keys)
+            self.misses += shortfall
+        if shortfall:
+            keys.extend(self.reserve_fn(shortfall))
+        with self.lock:
+            self._maybe_start_refill()
+        return keys
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, refills=self.refills, available=len(self.keys))
+
+
+class KeyAllocator:
+    """
+        Abstract base for process-wide allocators that hand out keys from pools, one pool per key source.
+        Sub-classes must implement reserve_block to reserve a block of keys from the DB.
+    """
+    def __init__(self, block_size, low_water, background, using=DEFAULT_DB_ALIAS):
+        self.block_size = block_size
+        self.low_water = low_water
+        self.background = background
+        self.using = using
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _get_pool(self, key, reserve_fn_factory):
+        """ Return the KeyPool for the given key, creating it with reserve_fn_factory() if needed """
+        with self._lock:
+            if self._pid != os.getpid():  # forked: parent's reserved keys must never be used by the child
+                self._pools = {}
+                self._pid = os.getpid()
+            if key not in self._pools:
+                self._pools[key] = KeyPool(
+                    reserve_fn_factory(),
+                    block_size=self.block_size, low_water=self.low_water, background=self.background,
+                )
+            return self._pools[key]
+
+    def stats(self):
+        """ Return pool hit / miss counters, keyed by key source """
+        return {key[0]: pool.stats() for key, pool in self._pools.items()}
+
+    def reset(self):
+        """ Discard all pooled keys """
+        with self._lock:
+            self._pools = {}
+
+
+class ObjectidAllocator(KeyAllocator):
+    """
+        Hands out SDE objectids from per-table pools, each reserved in blocks from the SDE next_rowid proc.
+        Usage:  objectid_allocator.next_objectid(table)
+    """
+    NEXT_OBJECTID = 'next_rowid'
+
+    def __init__(self, block_size=None, low_water=None, background=None, using=DEFAULT_DB_ALIAS):
+        super().__init__(
+            block_size=block_size or settings.SDE_OBJECTID_BLOCK_SIZE,
+            low_water=settings.SDE_OBJECTID_LOW_WATER if low_water is None else low_water,
+            background=settings.SDE_OBJECTID_BACKGROUND_REFILL if background is None else background,
+            using=using,
+        )
+
+    def reserve_block(self, owner, table, n, proc=NEXT_OBJECTID):
+        """ Reserve n new objectids for the given table in a single round trip, committed on its own connection """
+        def reserve(cursor):
+            cursor.execute(f"SELECT {proc}(%s, %s) FROM generate_series(1, %s)", (owner, table, n))
+            return [row[0] for row in cursor.fetchall()]
+        return run_on_own_connection(reserve, using=self.using)
+
+    @staticmethod
+    def table_owner(table):
+        """ Return the owner of the given table, required by SDE key procs """
+        from arcsde.models.models import pg_table_owner
+        return pg_table_owner(table)
+
+    def get_pool(self, table, owner=None, proc=NEXT_OBJECTID):
+        """ Return the KeyPool for the given table - table owner is looked up only once, when pool is created. """
+        def reserve_fn_factory():
+            table_owner = owner or self.table_owner(table)
+            return lambda n: self.reserve_block(table_owner, table, n, proc)
+        return self._get_pool((table, proc), reserve_fn_factory)
+
+    def next_objectid(self, table, owner=None, proc=NEXT_OBJECTID):
+        """ Return the next available objectid for given table """
+        return self.get_pool(table, owner, proc).get()
+
+    def take(self, table, n, owner=None, proc=NEXT_OBJECTID):
+        """ Return a list of n available objectids for the given table """
+        return self.get_pool(table, owner, proc).take(n)
+
+
+def fetch_globalids(cursor, n, proc='next_globalid'):
+    """ Fetch n new SDE globalids in a single statement """
+    cursor.execute(f"SELECT {proc}() FROM generate_series(1, %s)", (n, ))
+    return [row[0] for row in cursor.fetchall()]
+
+
+class GlobalidAllocator(KeyAllocator):
+    """
+        Hands out SDE globalids from a queue pre-fetched in blocks from the SDE next_globalid proc.
+        globalids are not table-specific, so one pool per proc serves all SDE models.
+        Usage:  globalid_allocator.next_globalid()
+    """
+    NEXT_GLOBALID = 'next_globalid'
+
+    def __init__(self, block_size=None, low_water=None, background=None, using=DEFAULT_DB_ALIAS):
+        super().__init__(
+            block_size=block_size or settings.SDE_GLOBALID_BLOCK_SIZE,
+            low_water=settings.SDE_GLOBALID_LOW_WATER if low_water is None else low_water,
+            background=settings.SDE_GLOBALID_BACKGROUND_REFILL if background is None else background,
+            using=using,
+        )
+
+    def reserve_block(self, n, proc=NEXT_GLOBALID):
+        """ Fetch n new globalids in a single round trip """
+        with connections[self.using].cursor() as cursor:
+            return fetch_globalids(cursor, n, proc)
+
+    def get_pool(self, proc=NEXT_GLOBALID):
+        """ Return the KeyPool for the given globalid proc """
+        return self._get_pool((proc, ), lambda: (lambda n: self.reserve_block(n, proc)))
+
+    def next_globalid(self, proc=NEXT_GLOBALID):
+        """ Return the next available globalid """
+        return self.get_pool(proc).get()
+
+    def take(self, n, proc=NEXT_GLOBALID):
+        """ Return a list of n available globalids """
+        return self.get_pool(proc).take(n)
+
+
+# Process-wide allocators shared by all SDE feature models
+objectid_allocator = ObjectidAllocator()
+globalid_allocator = GlobalidAllocator()
@@ -0,0 +1,112 @@
+"""
+Spatial lookups for SDE shape fields
+@author: powderflask
+
+Filter features by their spatial relation to a geometry given as WKT text or WKB bytes, with an explicit srid:
+    District.objects.filter(shape__sde_intersects=(wkt, 4326))
+    District.objects.filter(shape__sde_bbox=(wkb, 3005))              # envelopes (bounding boxes) overlap
+    Hydrant.objects.filter(shape__sde_dwithin=(wkt, 4326, 250))       # distance in units of the layer's srid
+The geometry is constructed once, from query parameters, and transformed to the layer's spatial reference
+    (see spatial.layer_srid) only if it differs - the shape column is compared as-is, never converted to text,
+    so the DB can use the st_geometry spatial index.
+An SDE geometry expression, already in the layer's spatial reference, may be given in place of (geom, srid), e.g.,
+    shape__sde_intersects=SdeGeometry(wkt, 3005) or shape__sde_dwithin=(SdeGeometry(wkt, 3005), 250)
+Exact predicates are preceded by an envelope test (see settings.SDE_SPATIAL_ENVELOPE_PREFILTER), which uses
+    plain comparisons on precomputed envelope columns for models that name them in sde_envelope_fields.
+"""
+from django.db import models
+from django.db.models.expressions import Col
+from django.db.models.lookups import LessThanOrEqual
+
+from arcsde import settings
+from arcsde.models import fields, spatial
+from arcsde.models.functions import SdeBuffer, SdeDistance, SdeIntersects
+
+
+class BaseSdeSpatialLookup(models.Lookup):
+    """
+        Base class for lookups that relate an SDE shape to a geometry:  (geom, srid, *args) or (expression, *args)
+        Sub-classes define predicates(), a list of boolean expressions that must all be true.
+    """
+    args = ()   # names of the extra arguments that follow the geometry in the lookup value
+    prepare_rhs = False
+
+    def get_prep_lookup(self):
+        """ Return the geometry expression, in the layer's spatial reference, and save any extra arguments """
+        value = self.rhs if isinstance(self.rhs, (tuple, list)) else (self.rhs, )
+        if value and hasattr(value[0], 'resolve_expression'):
+            geometry, args = value[0], value[1:]
+        elif len(value) >= 2:
+            (geom, srid), args = value[:2], value[2:]
+            geometry = spatial.geometry(self.lhs_model(), geom, srid)
+        else:
+            args = None
+        if args is None or len(args) != len(self.args):
+            arguments = ', '.join(('geom', 'srid') + self.args)
+            raise ValueError(f'{self.lookup_name} lookup requires ({arguments}), not {self.rhs!r}.')
+        self.lookup_args = tuple(args)
+        return geometry
+
+    def lhs_model(self):
+        """ Return the model with the shape field, if the lhs is a plain reference to it, else None """
+        return self.lhs.target.model if isinstance(self.lhs, Col) and self.lhs.target.name == 'shape' else None
+
+    def lhs_ref(self, field_name):
+        """ Return an expression for the named field of the lhs model (see spatial.envelope) """
+        if field_name == 'shape':
+            return self.lhs
+        return Col(self.lhs.alias, self.lhs_model()._meta.get_field(field_name))
+
+    def envelope_overlaps(self, rhs):
+        """ Return boolean expressions that test whether the envelopes of the shape and rhs shape expression overlap """
+        return spatial.envelope_overlaps(self.lhs_model(), self.lhs_ref, None, lambda field_name: rhs)
+
+    def predicates(self):
+        raise NotImplementedError('Sub-classes must define the predicates for an SDE spatial lookup.')
+
+    def as_sql(self, compiler, connection):
+        sql, params = [], []
+        for predicate in self.predicates():
+            predicate_sql, predicate_params = compiler.compile(predicate)
+            sql.append(predicate_sql)
+            params.extend(predicate_params)
+        return '(%s)' % ' AND '.join(sql), params
+
+
+class SdeBBoxLookup(BaseSdeSpatialLookup):
+    """ True where the envelope of the shape overlaps the envelope of the geometry """
+    lookup_name = 'sde_bbox'
+
+    def predicates(self):
+        return self.envelope_overlaps(self.rhs)
+
+
+class SdeIntersectsLookup(BaseSdeSpatialLookup):
+    """ True where the shape intersects the geometry """
+    lookup_name = 'sde_intersects'
+
+    def predicates(self):
+        exact = SdeIntersects(self.lhs, self.rhs)
+        if not settings.SDE_SPATIAL_ENVELOPE_PREFILTER:
+            return [exact]
+        return self.envelope_overlaps(self.rhs) + [exact]
+
+
+class SdeDWithinLookup(BaseSdeSpatialLookup):
+    """ True where the shape is within distance of the geometry, in units of the layer's spatial reference """
+    lookup_name = 'sde_dwithin'
+    args = ('distance', )
+
+    def predicates(self):
+        distance, = self.lookup_args
+        # The envelope of the buffered geometry bounds every shape within distance, so the index can narrow the search
+        return self.envelope_overlaps(SdeBuffer(self.rhs, distance)) + [
+            LessThanOrEqual(SdeDistance(self.lhs, self.rhs), models.Value(float(distance)))
+        ]
+
+
+SDE_SPATIAL_LOOKUPS = (SdeBBoxLookup, SdeIntersectsLookup, SdeDWithinLookup)
+
+for shape_field in (fields.ArcSdeGeometryField, fields.ArcSdeLineField, fields.ArcSdePointField):
+    for lookup in SDE_SPATIAL_LOOKUPS:
+        shape_field.register_lookup(lookup)
@@ -10,8 +10,16 @@ Provides access to WKT text representation and some simple spatial queries.
 """
 import datetime
 from django.db import models
+from django.db.models.functions import Coalesce
+from django.db.models.sql.constants import LOUTER
+from django.utils import timezone
 from arcsde import settings, util
-from arcsde.models.functions import Latitude, Longitude, SdeAreaHa
+from arcsde.models import expressions, joins, spatial
+from arcsde.models.functions import (
+    Latitude, Longitude, SdeAreaHa, SdeAsBinary, SdeCoordinates, SdeDistance, SdeExtent, SdeKnnDistance,
+    SdeShapeGeneralized, SdeTotalAreaHa,
+)
+from arcsde.models.records import SdeRecordIterable
 
 
 class ArcSdeQuerySet(models.QuerySet):
@@ -20,6 +28,9 @@ class ArcSdeQuerySet(models.QuerySet):
     """
     SDE_EDITED_BY_ANNOTATION = 'arcsde_last_edited_user'
 
+    # Unique keys that may be used for keyset pagination, in order of preference
+    SDE_KEYSET_FIELDS = ('objectid', 'globalid')
+
     ACTIVE_GDB_TO_DATE = datetime.datetime(
         9999, 12, 31, 23, 59, 59, tzinfo=datetime.timezone.utc
     )
@@ -31,6 +42,50 @@ class ArcSdeQuerySet(models.QuerySet):
         """
         return self.annotate(**{self.SDE_EDITED_BY_ANNOTATION: models.Value(username)})
 
+    def sde_bulk_create(self, objs, username=None, batch_size=500):
+        """
+            Create new SDE features in bulk - for models with ArcSdeFeatureCreationMixin
+            For each batch: globalid / objectid keys are assigned in one round trip each,
+                edit tracking fields are stamped once (as for user-created features),
+                and rows are inserted with a multi-row INSERT into model's db_table (EVW view or base table).
+            Like bulk_create, model save() logic is skipped.  Returns the list of created objects.
+        """
+        assert hasattr(self.model, 'assign_keys'),\
+                "Attempt to bulk create SDE features on a model without ArcSdeFeatureCreationMixin."
+
+        objs = list(objs)
+        track_edits = settings.SDE_EDIT_TRACKING and hasattr(self.model, 'bulk_update_edit_tracking')
+        set_active = not settings.SDE_USE_EVW and hasattr(self.model, 'gdb_to_date')
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            if track_edits:
+                self.model.bulk_update_edit_tracking(batch, username, created=True)
+            if set_active:  # base table rows must be marked active, EVW view does this for us.
+                for obj in batch:
+                    obj.gdb_to_date = obj.gdb_to_date or self.ACTIVE_GDB_TO_DATE
+            self.model.assign_keys(batch)
+            self.bulk_create(batch, batch_size=batch_size)
+        return objs
+
+    def update_tracked(self, username=None, **fields):
+        """
+            Update the given fields on all features in this queryset in a single UPDATE statement, including
+                edit tracking fields (last_edited_user / date) - for models with ArcSdeRevisionFieldsMixin.
+            Like update_edit_tracking, only the BASE fields are updated - DB trigger determines if the associated
+                last_edited_*_field overrides get updated.
+            username defaults to the one passed to set_edited_by(username) on this queryset.
+            Like update(), model save() logic is skipped.  Returns the number of rows updated.
+        """
+        model = self.model
+        if settings.SDE_EDIT_TRACKING and hasattr(model, 'edit_tracking_username'):
+            edited_by = self.query.annotations.get(self.SDE_EDITED_BY_ANNOTATION)
+            username = model.edit_tracking_username(
+                username or getattr(edited_by, 'value', None), feature=f'{model.__name__} queryset update'
+            )
+            now = timezone.now()
+            fields = {model.LAST_EDITED_USER_BASE: username, model.LAST_EDITED_DATE_BASE: now, **fields}
+        return self.update(**fields)
+
     def sde_shape_as_text(self):
         """
           Return sde shape field geometry as a text (WKT) annotation.
@@ -38,6 +93,23 @@ class ArcSdeQuerySet(models.QuerySet):
        """
         return self.annotate(shape_text=models.Func(models.F('shape'), function='ST_ASTEXT'))
 
+    def sde_shape_as_wkb(self, annotation_name='shape_wkb', srid=None):
+        """
+          Return sde shape field geometry as a binary (WKB) annotation, optionally transformed to srid.
+          Much more compact than WKT - decode with arcsde.wkb.decode_wkb
+          Assumes self.model.has_shape
+       """
+        return self.annotate(**{annotation_name: SdeAsBinary('shape', srid=srid)})
+
+    def sde_shape_generalized(self, tolerance, annotation_name='shape_generalized', output='wkb', srid=None):
+        """
+          Return sde shape field geometry generalized (simplified) to within tolerance, as a WKB (or WKT) annotation,
+            optionally transformed to srid.  Tolerance is in units of the layer's spatial reference -
+            see arcsde.layers.tiles.zoom_tolerance for the tolerance that suits a web-map zoom level.
+          Assumes self.model.has_shape - points gain nothing from generalization.
+       """
+        return self.annotate(**{annotation_name: SdeShapeGeneralized('shape', tolerance, output=output, srid=srid)})
+
     #
     #  IF there is a need to support geo-django and django.contrib.gis models,
     #  this would retrieve geo-django spatial fields from the WKT above (will consider if use-case arises)
@@ -59,10 +131,33 @@ class ArcSdeQuerySet(models.QuerySet):
         annotation = {annotation_name: SdeAreaHa('shape')}
         return self.annotate(**annotation)
 
+    def sde_area_summary(self, group_by=(), area_name='area_ha', count_name='count'):
+        """
+          Return total area of sde shapes, in ha, and feature count, computed in the DB.
+          group_by:  field name or sequence of field names to summarize by, e.g., 'district'
+            -> a values queryset with one dict per group:  {district: ..., area_ha: ..., count: ...}
+            -> with no group_by, a single dict:  {area_ha: ..., count: ...}
+          Assumes self.model.has_shape
+        """
+        aggregates = {area_name: SdeTotalAreaHa('shape'), count_name: models.Count('pk')}
+        if not group_by:
+            return self.order_by().aggregate(**aggregates)
+        group_by = (group_by, ) if isinstance(group_by, str) else tuple(group_by)
+        return self.order_by().values(*group_by).annotate(**aggregates).order_by(*group_by)
+
+    def sde_extent(self):
+        """
+          Return the bounding box of all sde shapes in this queryset, as a (minx, miny, maxx, maxy) tuple,
+            computed in the DB, or None if there are no shapes.
+          Assumes self.model.has_shape
+        """
+        return self.order_by().aggregate(extent=SdeExtent('shape'))['extent']
+
     def sde_latlong_from_shape(self):
         """
           Return sde point geometries in shape field as an (lat,long) text field annotation.
           ST_X(ST_Transform(shape, 4269)) as long,  ST_Y(ST_Transform(shape, 4269)) as lat
+          Note: transforms each shape twice - sde_coordinates_from_shape transforms once for both coordinates.
         """
         assert getattr(self.model, 'is_point', False),\
                 "Attempt to annotate Lat/Long on a model without a Point shape field."
@@ -70,18 +165,45 @@ class ArcSdeQuerySet(models.QuerySet):
         return self.annotate(lat=Latitude('shape')) \
                    .annotate(long=Longitude('shape'))
 
+    def sde_coordinates_from_shape(self, annotation_name='coordinates', srid=None, precision=None):
+        """
+          Return sde point geometries in shape field as a Coordinates (x, y) annotation - i.e., (long, lat),
+            transformed to srid with a single ST_Transform per row, and rounded to precision decimal places.
+          Defaults: settings.SDE_COORDINATES_SRID, settings.SDE_COORDINATES_PRECISION
+        """
+        assert getattr(self.model, 'is_point', False),\
+                "Attempt to annotate coordinates on a model without a Point shape field."
+
+        return self.annotate(**{annotation_name: SdeCoordinates('shape', srid=srid, precision=precision)})
+
     # Spatial queries are expensive, best done by a DB view or trigger that can be optimized in some way.
-    # But it is possible to perform intersections and other spatial operations...
-    #
-    # def sde_intersects_geom(self, geom_text):
-    #     """
-    #         Add a where clause for the intersection of the given geometry (in WKT) and the shape field
-    #         Assumes self.model.has_shape
-    #     """
-    #     srid = '3005'
-    #     # use of extra is discouraged in the django docs:  https://docs.djangoproject.com/en/dev/ref/models/querysets/#extra
-    #     return self.extra(where = ['ST_Intersects(ST_SetSrid(ST_GeomFromText(%s), %s), ST_SetSrid(ST_GeomFromText(st_astext("shape")::character varying), %s))'],
-    #                       params= [geom_text, srid, srid])
+    # But it is possible to perform intersections and other spatial operations, e.g., with the spatial lookups
+    # registered on shape fields (see arcsde.models.lookups):  shape__sde_intersects, shape__sde_bbox, shape__sde_dwithin
+
+    def sde_intersects_geom(self, geom, srid):
+        """
+            Filter for features whose shape intersects the given geometry (WKT text or WKB bytes) in the given srid
+            Assumes self.model.has_shape
+        """
+        return self.filter(shape__sde_intersects=(geom, srid))
+
+    def sde_nearest(self, point_wkt, k=1, srid=None, max_distance=None, distance_name='distance'):
+        """
+            Return the k features nearest the given point (WKT text or WKB bytes, in srid - default: the layer's),
+                nearest first, annotated with their distance in units of the layer's spatial reference.
+            Ordered in the DB by settings.SDE_KNN_OPERATOR, where available, so a spatial index can find
+                the nearest features without measuring the distance to every one - otherwise by exact ST_Distance.
+            max_distance:  optional search radius that lets the spatial index narrow the candidates (see sde_dwithin)
+            Assumes self.model.has_shape.  The result is sliced, so apply any other filters first.
+        """
+        srid = srid or spatial.layer_srid(self.model)
+        point = spatial.geometry(self.model, point_wkt, srid)
+        qs = self.filter(shape__sde_dwithin=(point_wkt, srid, max_distance)) if max_distance is not None else self
+        qs = qs.annotate(**{distance_name: SdeDistance('shape', point)})
+        if settings.SDE_KNN_OPERATOR:
+            # order by the operator alone, so the index scan can deliver rows in order
+            return qs.order_by(SdeKnnDistance('shape', point))[:k]
+        return qs.order_by(distance_name, 'pk')[:k]
 
     def sde_annotate_from_intersect(self, sde_model, field_name, where_constraint_field=None):
         """
@@ -89,28 +211,70 @@ class ArcSdeQuerySet(models.QuerySet):
             Assumes self.model.has_shape and sde_model.has_shape
             Limit 1 for cases where query yields > 1 intersection
             where_constraint_field optinoally provides field name available on both models and constrains
-                intersection to only objects that share same value in this field.  TODO: improve this API!
+                intersection to only objects that share same value in this field.
+            Prefer sde_annotate_from_intersects, which fetches several fields in one pass with a deterministic tie-break
+            Envelopes are compared before the exact intersection - see settings.SDE_SPATIAL_ENVELOPE_PREFILTER
         """
         # noinspection PyProtectedMember
         extra_constraint = 'and lhs.{field} = {rhs}.{field}'.format(field=where_constraint_field,
                                                                     rhs=self.model._meta.db_table) \
             if where_constraint_field else ''
 
+        # noinspection PyProtectedMember
+        envelope_prefilter, params = self._sde_raw_envelope_prefilter(self.model._meta.db_table, sde_model, 'lhs') \
+            if settings.SDE_SPATIAL_ENVELOPE_PREFILTER else ('', [])
+
         # noinspection PyProtectedMember
         raw_query= """
           SELECT lhs.{field} FROM {lhs} AS lhs
-            WHERE (ST_Intersects({rhs}.shape, lhs.shape) {extra_constraint})
+            WHERE ({envelope_prefilter} ST_Intersects({rhs}.shape, lhs.shape) {extra_constraint})
             LIMIT 1
         """.format(
             field = field_name,
             rhs = self.model._meta.db_table,
             lhs = sde_model._meta.db_table,
+            envelope_prefilter = envelope_prefilter,
             extra_constraint = extra_constraint
         )
 
-        annotation = {field_name: models.expressions.RawSQL(raw_query, [])}
+        annotation = {field_name: models.expressions.RawSQL(raw_query, params)}
         return self.annotate(**annotation)
 
+    def _sde_raw_envelope_prefilter(self, table, sde_model, sde_alias):
+        """
+            Return SQL, and params, for raw queries that compare the envelopes of table (this model) and sde_model shapes
+            Built from spatial.envelope_overlaps, so precomputed sde_envelope_fields are used where models name them.
+        """
+        def ref(alias, model):
+            return lambda name: spatial.ParentColumn(alias, model._meta.get_field(name).column, model._meta.get_field(name))
+
+        compiler = self.query.get_compiler(using=self.db)
+        sql, params = [], []
+        for predicate in spatial.envelope_overlaps(self.model, ref(table, self.model), sde_model, ref(sde_alias, sde_model)):
+            predicate_sql, predicate_params = compiler.compile(predicate)
+            sql.append(predicate_sql)
+            params.extend(predicate_params)
+        return ' AND '.join(sql) + ' AND', params
+
+    def sde_annotate_from_intersects(self, sde_model, *field_names, prefix='', where_constraint_field=None,
+                                     order_by=None, queryset=None):
+        """
+            Add the given field_names from sde_model as annotations, from the sde_model feature that intersects each
+                feature, fetched in a single LATERAL join rather than a correlated sub-query per field.
+            Assumes self.model.has_shape and sde_model.has_shape
+            prefix is prepended to the annotation names, e.g., to avoid clashes with this model's field names
+            where_constraint_field (name or sequence of names) constrains intersection to features that share the
+                same value in these fields, available on both models.
+            order_by field names decide which feature is used where several intersect - sde_model pk breaks ties.
+            queryset optionally restricts the candidate sde_model features (default: active features)
+            Features with no intersection are annotated with None.  Requires Postgre (LATERAL join)
+            Envelopes are compared before the exact intersection - see settings.SDE_SPATIAL_ENVELOPE_PREFILTER
+        """
+        return spatial.annotate_from_intersects(
+            self, sde_model, field_names, prefix=prefix, where_constraint_field=where_constraint_field,
+            order_by=order_by, sde_queryset=queryset,
+        )
+
     def sde_defer_shape(self):
         assert(getattr(self.model, 'has_shape', False))
         return self.defer('shape')
@@ -131,6 +295,56 @@ class ArcSdeQuerySet(models.QuerySet):
 
         return qs
 
+    def sde_keyset_field(self):
+        """ Return name of the unique, ordered key for keyset pagination: objectid or, e.g., for attach tables, globalid """
+        names = {f.name for f in self.model._meta.concrete_fields}
+        return next(key for key in self.SDE_KEYSET_FIELDS if key in names)
+
+    def sde_keyset_page(self, after=None, page_size=100, key=None):
+        """
+            Return the page of page_size features following the one with key value after (or the first page).
+            Unlike offset pagination, the DB needn't scan up to the offset, so every page costs about the same.
+        """
+        key = key or self.sde_keyset_field()
+        qs = self.order_by(key)
+        if after is not None:
+            qs = qs.filter(**{f'{key}__gt': after})
+        return qs[:page_size]
+
+    def sde_field_names(self):
+        """ Return names of all fields and annotations that can be read from this queryset, i.e., excluding shape """
+        return [
+            f.attname for f in self.model._meta.concrete_fields if f.name != 'shape'
+        ] + list(self.query.annotations)
+
+    def sde_stream(self, chunk_size=2000, rows=None, fields=()):
+        """
+            Iterate over the active features in this queryset in bounded memory - results are not cached.
+            Uses a server-side cursor on backends that support it (Postgre), fetching chunk_size rows at a time.
+            rows = 'tuple' or 'dict' yields plain rows rather than model instances, skipping model construction,
+                with the given fields - default: all fields and annotations except shape
+            Note: server-side cursors are not compatible with transaction pooling (pgbouncer) -
+                  see django DATABASES setting DISABLE_SERVER_SIDE_CURSORS
+        """
+        qs = self.sde_active()
+        if rows == 'tuple':
+            qs = qs.values_list(*(fields or self.sde_field_names()))
+        elif rows == 'dict':
+            qs = qs.values(*(fields or self.sde_field_names()))
+        elif rows is not None:
+            raise ValueError(f"sde_stream rows must be one of None, 'tuple', or 'dict', not {rows!r}.")
+        return qs.iterator(chunk_size=chunk_size)
+
+    def as_records(self, *fields):
+        """
+            Yield compact, read-only SdeRecord objects with the given fields rather than model instances.
+            Records carry localized datetimes and the model's revision helpers (e.g., get_last_edited_user)
+            Default fields: all fields and annotations except shape.  See arcsde.models.records
+        """
+        qs = self.values_list(*(fields or self.sde_field_names()))
+        qs._iterable_class = SdeRecordIterable
+        return qs
+
     def with_attachments(self):
         """
             Prefetch attachments with the model instances
@@ -140,14 +354,36 @@ class ArcSdeQuerySet(models.QuerySet):
         """
         return self.prefetch_related('attachment_set')
 
-    def annotate_attachment_count(self):
+    ATTACHMENT_COUNT_STRATEGIES = ('join', 'grouped', 'subquery')
+
+    def annotate_attachment_count(self, strategy=None):
         """
         Add an attachment_count annotation to the model with the number of SDE attachments
+        strategy:  how attachments are counted, default: settings.SDE_ATTACHMENT_COUNT_STRATEGY
+            'join':  Count('attachment_set') - GROUP BY every selected column, slow for wide feature views
+            'grouped':  LEFT JOIN to the attach table aggregated once by related object - no GROUP BY on the features
+            'subquery':  a correlated COUNT sub-query per feature (see expressions.sde_attachment_count)
         Warning: this method accesses model class variable - don't call it until models are loaded!
         """
-        # return self.annotate(attachment_count=sde_attachment_count(self.model))
-        annotation =  models.Count('attachment_set') if self.model.has_attachments() else models.Value(0)
-        return self.annotate(attachment_count=annotation)
+        strategy = strategy or settings.SDE_ATTACHMENT_COUNT_STRATEGY
+        assert strategy in self.ATTACHMENT_COUNT_STRATEGIES, \
+            f"Attachment count strategy must be one of {', '.join(self.ATTACHMENT_COUNT_STRATEGIES)}, not {strategy}"
+        if not self.model.has_attachments():
+            return self.annotate(attachment_count=models.Value(0, output_field=models.IntegerField()))
+        if strategy == 'join':
+            return self.annotate(attachment_count=models.Count('attachment_set'))
+        if strategy == 'subquery':
+            return self.annotate(attachment_count=expressions.sde_attachment_count(self.model))
+        # grouped:  the counts are aggregated in a derived table, joined to each feature by the attachments foreign key
+        _, fk = expressions.attachment_relation(self.model)
+        qs = self.all()
+        query = qs.query
+        alias = query.join(joins.DerivedTableJoin(
+            self.model, query.get_initial_alias(), expressions.attachment_counts(self.model),
+            on=((fk.column, fk.target_field.name), ), join_type=LOUTER,
+        ))
+        count = joins.JoinedColumn(alias, 'attachment_count', models.IntegerField())
+        return qs.annotate(attachment_count=Coalesce(count, models.Value(0)))
 
     @staticmethod
     def recent_period_start(period_in_hours):
@@ -178,10 +414,17 @@ class ArcSdeManager(models.Manager.from_queryset(ArcSdeQuerySet)):
 
 
 class AnnotatedArcSdeManager(ArcSdeManager) :
-    """ An ArcSdeManager that annotates and loads commonly needed related data onto report """
+    """
+        An ArcSdeManager that annotates and loads commonly needed related data onto report
+        attachment_count_strategy:  see ArcSdeQuerySet.annotate_attachment_count, default from settings
+    """
+    def __init__(self, attachment_count_strategy=None):
+        super().__init__()
+        self.attachment_count_strategy = attachment_count_strategy
+
     def get_queryset(self):
         # SDE report queries often need SDE attachment_count
-        return super().get_queryset().annotate_attachment_count()
+        return super().get_queryset().annotate_attachment_count(self.attachment_count_strategy)
 
 
 class ArcSdeActiveArchiveManager(ArcSdeManager):
@@ -15,7 +15,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db import models, connection
 from django.utils import timezone
 from arcsde import settings, tz
-from arcsde.models import managers, fields
+from arcsde.models import managers, fields, keys, catalog
 
 logger = logging.getLogger('arcsde')
 
@@ -48,17 +48,9 @@ def pg_table_owner(table_name):
     """
     Return the  username of the table owner, required by some SDE functions
     Note: this is for Postgre DB only, and should really be integrated into a DB backend  ** sigh **
+    Owners are read from the process-wide catalog cache - see arcsde.models.catalog
     """
-    QUERY = """
-        select u.usename
-        from information_schema.tables t
-        join pg_catalog.pg_class c on (t.table_name = c.relname)
-        join pg_catalog.pg_user u on (c.relowner = u.usesysid)
-        where t.table_name=%s;
-    """
-    with connection.cursor() as cursor:
-        cursor.execute(QUERY, [table_name, ])
-        return cursor.fetchone()[0]
+    return catalog.sde_catalog.owner(table_name)
 
 
 class AbstractArcSdeBase(models.Model):
@@ -108,15 +100,21 @@ class ArcSdeFeatureCreationMixin(models.Model):
     NEXT_GLOBALID = 'next_globalid'
     NEXT_OBJECTID = 'next_rowid'
 
+    # Draw keys from the process-wide pools of keys reserved in blocks (see arcsde.models.keys)
+    use_globalid_pool = settings.SDE_GLOBALID_POOL
+    use_objectid_pool = settings.SDE_OBJECTID_POOL
+
     class Meta:
         abstract = True
 
     def save(self,*args, **kwargs):
         """ Set values for globalid and objectid keys before saving new records """
         if hasattr(self, 'globalid') and not self.globalid:
-            self.globalid = models.expressions.RawSQL(f'{self.NEXT_GLOBALID}()', params=())
+            self.globalid = self.get_pooled_globalid() if self.use_globalid_pool else \
+                            models.expressions.RawSQL(f'{self.NEXT_GLOBALID}()', params=())
         if hasattr(self, 'objectid') and not self.objectid:
-            self.objectid = models.expressions.RawSQL(*self.next_objectid_call())
+            self.objectid = self.get_pooled_objectid() if self.use_objectid_pool else \
+                            models.expressions.RawSQL(*self.next_objectid_call())
         return super().save(*args, **kwargs)
 
     @classmethod
@@ -126,10 +124,36 @@ class ArcSdeFeatureCreationMixin(models.Model):
             cursor.execute(f"SELECT * FROM {cls.NEXT_GLOBALID}()", [])
             return cursor.fetchone()[0]
 
+    @classmethod
+    def get_next_globalids(cls, n):
+        """ Get a list of n new SDE globalids, fetched in a single statement """
+        with connection.cursor() as cursor:
+            return keys.fetch_globalids(cursor, n, cls.NEXT_GLOBALID)
+
+    @classmethod
+    def get_pooled_globalid(cls):
+        """ Get the next SDE globalid from the per-process queue of pre-fetched globalids """
+        return keys.globalid_allocator.next_globalid(proc=cls.NEXT_GLOBALID)
+
+    @classmethod
+    def get_pooled_globalids(cls, n):
+        """ Get a list of n SDE globalids from the per-process queue of pre-fetched globalids """
+        return keys.globalid_allocator.take(n, proc=cls.NEXT_GLOBALID)
+
+    @classmethod
+    def sde_key_table(cls):
+        """
+            Return the name of the SDE table that issues objectids for this model.
+            Keys are issued by the registered base table, even when the model is backed by its EVW view.
+        """
+        table = cls._meta.db_table
+        info = catalog.sde_catalog.table_info(table)
+        return info.name if info.base_exists else table
+
     @classmethod
     def next_objectid_call(cls, owner=None, table=None):
         """ Return the dB proc call, as a string, and parameter list, to get the next SDE objectid for given table """
-        table = table or cls._meta.db_table
+        table = table or cls.sde_key_table()
         owner = owner or pg_table_owner(table)  # why does Arc need the table owner to compute next ID?  why Arc, why?
         return f"{cls.NEXT_OBJECTID}(%s, %s)", (owner, table)
 
@@ -141,6 +165,45 @@ class ArcSdeFeatureCreationMixin(models.Model):
             cursor.execute(f"SELECT * FROM {fn_call}", params)
             return cursor.fetchone()[0]
 
+    @classmethod
+    def get_next_objectids(cls, n, owner=None, table=None):
+        """ Get a list of n new SDE objectids for given table, reserved in a single round trip """
+        table = table or cls.sde_key_table()
+        owner = owner or pg_table_owner(table)
+        return keys.objectid_allocator.reserve_block(owner, table, n, proc=cls.NEXT_OBJECTID)
+
+    @classmethod
+    def get_pooled_objectid(cls, owner=None, table=None):
+        """ Get the next SDE objectid for given table from the pool of reserved objectids """
+        table = table or cls.sde_key_table()
+        return keys.objectid_allocator.next_objectid(table, owner, proc=cls.NEXT_OBJECTID)
+
+    @classmethod
+    def get_pooled_objectids(cls, n, owner=None, table=None):
+        """ Get a list of n SDE objectids for given table from the pool of reserved objectids """
+        table = table or cls.sde_key_table()
+        return keys.objectid_allocator.take(table, n, owner, proc=cls.NEXT_OBJECTID)
+
+    @classmethod
+    def assign_keys(cls, instances):
+        """
+            Assign globalid and objectid keys to all new instances lacking them, using one round trip per key.
+            Used to create features in bulk, where save() logic is skipped.
+        """
+        new = [i for i in instances if not i.globalid] if hasattr(cls, 'globalid') else []
+        if new:
+            globalids = cls.get_pooled_globalids(len(new)) if cls.use_globalid_pool else \
+                        cls.get_next_globalids(len(new))
+            for instance, globalid in zip(new, globalids):
+                instance.globalid = globalid
+
+        new = [i for i in instances if not i.objectid] if hasattr(cls, 'objectid') else []
+        if new:
+            objectids = cls.get_pooled_objectids(len(new)) if cls.use_objectid_pool else \
+                        cls.get_next_objectids(len(new))
+            for instance, objectid in zip(new, objectids):
+                instance.objectid = objectid
+
 
 class SdeVersionField(fields.ArcSdeDateTimeField):
     def formfield(self, **kwargs):
@@ -202,9 +265,27 @@ class ArcSdeRevisionFieldsMixin(models.Model):
 
             In DEBUG, may raise ImproperlyConfigured if no username is provided or annotated on instance for edit tracking.
         """
-        username = username or getattr(self, self.SDE_EDITED_BY_ANNOTATION, None)
+        username = self.edit_tracking_username(
+            username or getattr(self, self.SDE_EDITED_BY_ANNOTATION, None), feature=repr(self)
+        )
+
+        # retain username explicitly set by client code for a potential save later - stateful programming - yuck
+        setattr(self, self.SDE_EDITED_BY_ANNOTATION, username)
+
+        now = timezone.now()
+        if not self.pk and isinstance(self, ArcSdeFeatureCreationMixin):
+            self._set_creation_fields(username, now)
+        setattr(self, self.LAST_EDITED_USER_BASE, username)
+        setattr(self, self.LAST_EDITED_DATE_BASE, now)
+
+    @classmethod
+    def edit_tracking_username(cls, username, feature=None):
+        """
+            Return the username to record in edit tracking fields - the default username if none was provided.
+            In DEBUG, may raise ImproperlyConfigured if no username is provided for edit tracking.
+        """
         if not username:
-            msg = self.EDIT_TRACKING_ERROR.format(feature=repr(self))
+            msg = cls.EDIT_TRACKING_ERROR.format(feature=feature or cls.__name__)
             if settings.SDE_EDIT_TRACKING_ENFORCE:
                 if settings.settings.DEBUG and not settings.UNIT_TESTING:
                     raise ImproperlyConfigured(msg)
@@ -213,21 +294,30 @@ class ArcSdeRevisionFieldsMixin(models.Model):
             else:
                 logger.debug(msg)
             username = settings.SDE_EDIT_TRACKING_DEFAULT_USERNAME
+        return username
 
-        # retain username explicitly set by client code for a potential save later - stateful programming - yuck
-        setattr(self, self.SDE_EDITED_BY_ANNOTATION, username)
-
-        if not self.pk and isinstance(self, ArcSdeFeatureCreationMixin):
-            self._set_creation_fields(username)
-        setattr(self, self.LAST_EDITED_USER_BASE, username)
-        setattr(self, self.LAST_EDITED_DATE_BASE, timezone.now())
-
-    def _set_creation_fields(self, username):
+    @classmethod
+    def bulk_update_edit_tracking(cls, instances, username=None, created=False):
+        """
+            Update the edit tracking fields on a batch of instances, with a single timestamp for the whole batch.
+            Used for bulk operations, where save() logic is skipped.  created=True to also set the creation fields.
+        """
+        username = cls.edit_tracking_username(username, feature=f'{cls.__name__} bulk operation')
+        now = timezone.now()
+        for instance in instances:
+            setattr(instance, cls.SDE_EDITED_BY_ANNOTATION, username)
+            if created:
+                instance.created_user = username
+                instance.created_date = now
+            setattr(instance, cls.LAST_EDITED_USER_BASE, username)
+            setattr(instance, cls.LAST_EDITED_DATE_BASE, now)
+
+    def _set_creation_fields(self, username, now=None):
         """ For rare occassions when SDE features are created.  See ArcSdeFeatureCreationMixin for warnings. """
         if self.pk or not isinstance(self, ArcSdeFeatureCreationMixin):
             return
         self.created_user = username
-        self.created_date = timezone.now()
+        self.created_date = now or timezone.now()
 
     def get_report_version_info(self):
         return {
@@ -269,6 +359,8 @@ class ArcSdeGeometryMixin(models.Model):
         Conceptually add an arcsde.st_geometry field to the model.  Use only with models based on AbstractArcSdeFeature
         Unfortunately, geo-django can't interpret this data, and we don't want to tamper with it - so use carefully.
         The SdeManager() can annotate the model with shape_text (WKT) and shape_geos (WKB) fields derived from shape.
+        Tables with precomputed envelope columns for the shape can name them in sde_envelope_fields,
+            in order (minx, miny, maxx, maxy), for use by the envelope pre-filter on spatial predicates.
     """
     shape = fields.ArcSdeGeometryField(blank=True, null=True, editable=False)
 
@@ -277,6 +369,7 @@ class ArcSdeGeometryMixin(models.Model):
 
     has_shape = True
     is_point = False
+    sde_envelope_fields = None
 
 
 class ArcSdeLineMixin(models.Model):
@@ -291,6 +384,7 @@ class ArcSdeLineMixin(models.Model):
 
     has_shape = True
     is_point = False
+    sde_envelope_fields = None
 
 
 class ArcSdePointMixin(models.Model):
@@ -305,6 +399,7 @@ class ArcSdePointMixin(models.Model):
 
     has_shape = True
     is_point = True
+    sde_envelope_fields = None
 
 
 class ArcSdeArchiveMixin(models.Model):
@@ -0,0 +1,84 @@
+"""
+Lightweight read-only records for SDE feature listings
+@author: powderflask
+
+Listings and dashboards often need only a few attributes from thousands of features.
+Rather than instantiate a full model for each row, ArcSdeQuerySet.as_records(*fields) yields compact
+    __slots__ record objects, with localized datetimes and the model's revision helpers
+    (get_last_edited_user, was_created_by, get_report_version_info, etc.)
+Records are read-only snapshots:  they cannot be saved, and have only the attributes that were selected.
+"""
+import functools
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query import BaseIterable, ValuesListIterable
+
+from arcsde import tz
+from arcsde.models import fields
+
+# ArcSdeRevisionFieldsMixin business logic shared by records of SDE feature models
+REVISION_METHODS = (
+    'get_last_edited_date', 'get_last_edited_user', 'get_report_version_info', 'was_created_by', 'was_last_edited_by',
+)
+REVISION_ATTRS = ('LAST_EDITED_DATE_BASE', 'LAST_EDITED_USER_BASE', 'last_edited_date_field', 'last_edited_user_field')
+REVISION_FIELDS = ('created_user', 'created_date', 'last_edited_user', 'last_edited_date')
+
+
+class SdeRecord:
+    """ Base class for slotted records - use record_class() to build a record class for a model and field names """
+    __slots__ = ()
+    model = None
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f'<{type(self).__name__}: {self.as_dict()}>'
+
+
+@functools.lru_cache(maxsize=None)
+def record_class(model, names):
+    """ Return a SdeRecord sub-class for the given model class, with slots for the given tuple of field names """
+    attrs = {'__slots__': names, 'model': model}
+    if hasattr(model, 'get_report_version_info'):  # an ArcSdeRevisionFieldsMixin model
+        attrs.update({name: getattr(model, name) for name in REVISION_METHODS + REVISION_ATTRS})
+        attrs.update({name: None for name in REVISION_FIELDS if name not in names})
+    pk_name = model._meta.pk.attname
+    if pk_name in names and 'pk' not in names:
+        attrs['pk'] = property(lambda self: getattr(self, pk_name))
+    return type(f'{model.__name__}Record', (SdeRecord, ), attrs)
+
+
+def _datetime_columns(model, names):
+    """ Return indexes of names that refer to SDE datetime fields, which need to be localized """
+    indexes = []
+    for i, name in enumerate(names):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:  # an annotation or a related field lookup
+            continue
+        if isinstance(field, fields.ArcSdeDateTimeField):
+            indexes.append(i)
+    return indexes
+
+
+class SdeRecordIterable(BaseIterable):
+    """ Iterable for ArcSdeQuerySet.as_records() - yields one SdeRecord per row of a values_list queryset """
+    def __iter__(self):
+        queryset = self.queryset
+        names = tuple(queryset._fields)
+        record = record_class(queryset.model, names)
+        localize = tz.fast_localize
+        # without USE_TZ, ArcSdeDateTimeField has already localized the datetimes
+        datetime_columns = _datetime_columns(queryset.model, names) if settings.USE_TZ else ()
+        for row in ValuesListIterable(queryset, self.chunked_fetch, self.chunk_size):
+            if datetime_columns:
+                row = list(row)
+                for i in datetime_columns:
+                    row[i] = localize(row[i])
+            yield record(*row)
@@ -0,0 +1,168 @@
+"""
+Set-based spatial joins for SDE feature querysets
+@author: powderflask
+
+ArcSdeQuerySet.sde_annotate_from_intersect() adds a correlated sub-query per annotated field, each of which
+    runs its own spatial scan for every row in the result.
+The LATERAL join here fetches any number of fields from the (first) intersecting feature of another layer in a
+    single pass per row, with a deterministic tie-break when several features intersect:
+        LEFT OUTER JOIN LATERAL (
+            SELECT U0.field1, U0.field2 FROM other_layer U0
+            WHERE ST_Intersects(layer.shape, U0.shape) ...
+            ORDER BY U0.objectid LIMIT 1
+        ) other_layer ON TRUE
+The lateral sub-query is compiled by django from a queryset on the other layer, so all values are query parameters.
+Requires a DB that supports LATERAL joins (Postgre).
+
+Spatial predicates are evaluated in two stages (see settings.SDE_SPATIAL_ENVELOPE_PREFILTER):
+    a cheap test for overlapping envelopes (bounding boxes), then the exact predicate on only the survivors.
+    The envelope stage uses ST_EnvIntersects, or for models that name precomputed envelope columns in
+    sde_envelope_fields, plain (indexable) comparisons on those columns.
+"""
+from django.db import models
+from django.db.models.expressions import Col
+from django.db.models.lookups import GreaterThanOrEqual, LessThanOrEqual
+from django.db.models.sql.constants import INNER
+
+from arcsde import settings
+from arcsde.models import joins
+from arcsde.models.functions import (
+    SdeGeometry, SdeIntersects, SdeEnvIntersects, SdeMinX, SdeMinY, SdeMaxX, SdeMaxY, SdeTransform,
+)
+
+
+def envelope(model, ref):
+    """
+        Return expressions for the (minx, miny, maxx, maxy) envelope of the given model's shape
+        ref(field_name) must return an expression that refers to the named field of the model.
+    """
+    names = getattr(model, 'sde_envelope_fields', None)
+    if names:
+        return tuple(ref(name) for name in names)
+    shape = ref('shape')
+    return SdeMinX(shape), SdeMinY(shape), SdeMaxX(shape), SdeMaxY(shape)
+
+
+def layer_srid(model):
+    """ Return the spatial reference (srid) of the given model's shapes:  model.sde_srid or settings.SDE_SRID """
+    return getattr(model, 'sde_srid', None) or settings.SDE_SRID
+
+
+def geometry(model, geom, srid):
+    """
+        Return an SDE geometry expression for geom (WKT text or WKB bytes) in the given srid,
+            transformed to the spatial reference of the model's shapes (see layer_srid) if it differs.
+        The geometry is built once, from query parameters, so shapes can be compared to it without conversion.
+    """
+    shape = SdeGeometry(geom, srid)
+    srid, model_srid = int(srid), layer_srid(model)
+    return shape if srid == model_srid else SdeTransform(shape, model_srid)
+
+
+def envelope_overlaps(lhs_model, lhs_ref, rhs_model, rhs_ref):
+    """
+        Return a list of boolean expressions that together test whether the envelopes of two models' shapes overlap
+        lhs_ref / rhs_ref(field_name) must return an expression that refers to the named field of each model.
+        A model may be None where the ref is to some other shape expression (e.g., a geometry parameter).
+    """
+    if getattr(lhs_model, 'sde_envelope_fields', None) or getattr(rhs_model, 'sde_envelope_fields', None):
+        (lhs_minx, lhs_miny, lhs_maxx, lhs_maxy) = envelope(lhs_model, lhs_ref)
+        (rhs_minx, rhs_miny, rhs_maxx, rhs_maxy) = envelope(rhs_model, rhs_ref)
+        return [
+            LessThanOrEqual(lhs_minx, rhs_maxx), GreaterThanOrEqual(lhs_maxx, rhs_minx),
+            LessThanOrEqual(lhs_miny, rhs_maxy), GreaterThanOrEqual(lhs_maxy, rhs_miny),
+        ]
+    return [SdeEnvIntersects(lhs_ref('shape'), rhs_ref('shape'))]
+
+
+def intersects(lhs_model, lhs_ref, rhs_model, rhs_ref, prefilter=None):
+    """
+        Return a filter condition (Q) for the intersection of the shapes of two models
+        lhs_ref / rhs_ref(field_name) must return an expression that refers to the named field of each model.
+        prefilter:  True to test envelopes before the exact predicate, default: settings.SDE_SPATIAL_ENVELOPE_PREFILTER
+    """
+    exact = models.Q(SdeIntersects(lhs_ref('shape'), rhs_ref('shape')))
+    prefilter = settings.SDE_SPATIAL_ENVELOPE_PREFILTER if prefilter is None else prefilter
+    if not prefilter:
+        return exact
+    return models.Q(*envelope_overlaps(lhs_model, lhs_ref, rhs_model, rhs_ref)) & exact
+
+
+class ParentColumn(models.Expression):
+    """
+        A reference to a column of the parent table of a LATERAL join, from inside the lateral sub-query.
+        The parent alias is rendered by the outer query's compiler, which knows how it must be quoted.
+    """
+    def __init__(self, alias_sql, column, output_field):
+        super().__init__(output_field=output_field)
+        self.alias_sql = alias_sql
+        self.column = column
+
+    def as_sql(self, compiler, connection):
+        return f'{self.alias_sql}.{connection.ops.quote_name(self.column)}', []
+
+
+class SdeIntersectsJoin(joins.BaseSubqueryJoin):
+    """
+        A LATERAL join to the first feature from queryset that intersects the parent row's shape.
+            query.join(SdeIntersectsJoin(...)) returns the alias to use for Col references to the joined fields.
+        constraint_fields:  field names on both models - joined features must share the parent's value in these fields
+        order_by:  field names that determine which feature is joined when several intersect
+    """
+    def __init__(self, parent_model, parent_alias, queryset, field_names,
+                 constraint_fields=(), order_by=(), table_alias=None, join_type=INNER):
+        super().__init__(parent_model, parent_alias, queryset, table_alias=table_alias, join_type=join_type)
+        self.field_names = tuple(field_names)
+        self.constraint_fields = tuple(constraint_fields)
+        self.order_by = tuple(order_by)
+
+    def parent_column(self, compiler, field_name):
+        field = self.parent_model._meta.get_field(field_name)
+        return ParentColumn(compiler.quote_name_unless_alias(self.parent_alias), field.column, field)
+
+    def lateral_query(self, compiler):
+        """ Return the lateral sub-query, correlated with the parent alias in the outer query """
+        parent_ref = lambda name: self.parent_column(compiler, name)
+        qs = self.queryset.filter(intersects(self.parent_model, parent_ref, self.queryset.model, models.F))
+        if self.constraint_fields:
+            qs = qs.filter(**{name: self.parent_column(compiler, name) for name in self.constraint_fields})
+        query = qs.order_by(*self.order_by).values(*self.field_names)[:1].query
+        # lateral sub-query aliases must not shadow the parent alias - bump on a clone, compiling must not alter query
+        query.bump_prefix(compiler.query.clone())
+        return query
+
+    def as_sql(self, compiler, connection):
+        sql, params = self.lateral_query(compiler).get_compiler(connection=connection).as_sql()
+        alias = compiler.quote_name_unless_alias(self.table_alias)
+        return f'{self.join_type} LATERAL ({sql}) {alias} ON TRUE', params
+
+    def identity_args(self):
+        return self.field_names, self.constraint_fields, self.order_by
+
+
+def annotate_from_intersects(queryset, sde_model, field_names, prefix='',
+                             where_constraint_field=None, order_by=None, sde_queryset=None):
+    """
+        Return queryset annotated with the given fields from the first sde_model feature that intersects each feature.
+        See ArcSdeQuerySet.sde_annotate_from_intersects
+    """
+    from arcsde.models.managers import ArcSdeQuerySet
+
+    sde_queryset = ArcSdeQuerySet(model=sde_model).sde_active() if sde_queryset is None else sde_queryset
+    if isinstance(where_constraint_field, str):
+        where_constraint_field = (where_constraint_field, )
+    tie_break = sde_model._meta.pk.name
+    order_by = tuple(order_by or ())
+    if tie_break not in order_by:
+        order_by += (tie_break, )  # ensure the joined feature is deterministic
+
+    qs = queryset.all()
+    query = qs.query
+    alias = query.join(SdeIntersectsJoin(
+        queryset.model, query.get_initial_alias(), sde_queryset, field_names,
+        constraint_fields=where_constraint_field or (), order_by=order_by,
+    ))
+    opts = sde_model._meta
+    return qs.annotate(**{
+        f'{prefix}{name}': Col(alias, opts.get_field(name)) for name in field_names
+    })
@@ -0,0 +1,115 @@
+"""
+    Keyset pagination for SDE feature querysets
+    @author: powderflask
+
+    Offset pagination (LIMIT / OFFSET) gets slower with every page because the DB must scan (e.g., the EVW view)
+    up to the offset.  Keyset pagination orders by a unique key (objectid, or globalid for attach tables) and
+    fetches the page following the last key seen:  WHERE objectid > last_seen ORDER BY objectid LIMIT per_page
+    so deep pages cost the same as the first one.
+"""
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Paginator, Page
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+
+class SdeKeysetPage(Page):
+    """
+        A page of SDE features, with the key values needed to fetch the previous / next pages
+        Pages fetched by key (page_after) don't know their page number:  number, start_index, etc. are computed
+            on demand from a key-only count of the items preceding the page, so templates written for the
+            Paginator interface still work - link to ?after=<next_after> to keep every page constant cost.
+    """
+    def __init__(self, object_list, number, paginator, after=None, next_after=None):
+        super().__init__(object_list, number, paginator)
+        self.after = after            # key value preceding this page, None for first page
+        self.next_after = next_after  # key value to fetch the next page, None for last page
+
+    @property
+    def number(self):
+        if self._number is None:
+            per_page = self.paginator.per_page
+            self._number = (self.items_before + per_page - 1) // per_page + 1
+        return self._number
+
+    @number.setter
+    def number(self, value):
+        self._number = value
+
+    @cached_property
+    def items_before(self):
+        """ Return the number of items preceding this page """
+        if self.after is None:
+            return 0
+        if self._number is not None:
+            return (self._number - 1) * self.paginator.per_page
+        return self.paginator.object_list.filter(**{f'{self.paginator.key}__lte': self.after}).count()
+
+    def has_next(self):
+        return self.next_after is not None
+
+    def has_previous(self):
+        return self.after is not None
+
+    def next_page_number(self):
+        if not self.has_next():
+            raise EmptyPage(_('That page contains no results'))
+        return self.number + 1
+
+    def previous_page_number(self):
+        if not self.has_previous():
+            raise EmptyPage(_('That page number is less than 1'))
+        return self.number - 1
+
+    def start_index(self):
+        """ Return the 1-based index of the first item on this page, 0 for an empty page """
+        return self.items_before + 1 if self.object_list else 0
+
+    def end_index(self):
+        """ Return the 1-based index of the last item on this page """
+        return self.items_before + len(self.object_list)
+
+
+class SdeKeysetPaginator(Paginator):
+    """
+        A Paginator for ArcSdeQuerySet that fetches pages by keyset rather than by offset
+        page_after(key) fetches any page at constant cost - use it for "next page" links and APIs.
+        page(number) is supported for compatibility with the Paginator interface (e.g., django ListView):
+            it locates the page's first key with a key-only offset query, then fetches the page by keyset.
+        object_list may yield model instances or dicts (values()), and is always ordered by key.
+        orphans are not supported: keyset pages are never merged.
+    """
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, key=None):
+        self.key = key or object_list.sde_keyset_field()
+        super().__init__(object_list.order_by(self.key), per_page, allow_empty_first_page=allow_empty_first_page)
+
+    def _key_value(self, item):
+        return item[self.key] if isinstance(item, dict) else getattr(item, self.key)
+
+    def page_after(self, after=None, number=None):
+        """
+            Return the SdeKeysetPage following the item with key value after, or the first page
+            Raises InvalidPage if after is not a valid value for the key field (e.g., from a tampered ?after= link)
+        """
+        after = self.to_key(after)
+        qs = self.object_list if after is None else self.object_list.filter(**{f'{self.key}__gt': after})
+        items = list(qs[:self.per_page + 1])  # fetch one extra item to determine if there is a next page
+        next_after = self._key_value(items[self.per_page - 1]) if len(items) > self.per_page else None
+        return SdeKeysetPage(items[:self.per_page], number, self, after=after, next_after=next_after)
+
+    def to_key(self, value):
+        """ Return value converted to the key field's type, None for no value - raises InvalidPage for invalid values """
+        if value in (None, ''):
+            return None
+        try:
+            return self.object_list.model._meta.get_field(self.key).to_python(value)
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidPage(_('Invalid key value: %(value)s') % {'value': value})
+
+    def page(self, number):
+        """ Return the SdeKeysetPage for the given 1-based page number """
+        number = self.validate_number(number)
+        offset = (number - 1) * self.per_page
+        after = None if number == 1 else \
+            list(self.object_list.values_list(self.key, flat=True)[offset - 1:offset])[0]
+        return self.page_after(after, number)
@@ -28,4 +28,70 @@ SDE_EDIT_TRACKING_ENFORCE = getattr(settings, 'SDE_EDIT_TRACKING_ENFORCE', False
 # Set to False to disable concurrency detection.
 SDE_CONCURRENCY_LOCK = getattr(settings, 'SDE_CONCURRENCY_LOCK', True)
 
+# New SDE features may draw objectids from an in-process pool of keys reserved in blocks, rather than calling
+# the SDE next_rowid proc for every INSERT.  Reserved but unused objectids are simply skipped (gaps are harmless).
+# Models may opt-in / out individually by overriding ArcSdeFeatureCreationMixin.use_objectid_pool
+SDE_OBJECTID_POOL = getattr(settings, 'SDE_OBJECTID_POOL', False)
+SDE_OBJECTID_BLOCK_SIZE = getattr(settings, 'SDE_OBJECTID_BLOCK_SIZE', 100)
+# Pool is re-filled in a background thread when the number of available keys drops below this level.
+SDE_OBJECTID_LOW_WATER = getattr(settings, 'SDE_OBJECTID_LOW_WATER', SDE_OBJECTID_BLOCK_SIZE // 4)
+SDE_OBJECTID_BACKGROUND_REFILL = getattr(settings, 'SDE_OBJECTID_BACKGROUND_REFILL', True)
+
+# Likewise, new SDE features may draw globalids from a per-process queue pre-fetched from the SDE next_globalid proc.
+# Models may opt-in / out individually by overriding ArcSdeFeatureCreationMixin.use_globalid_pool
+SDE_GLOBALID_POOL = getattr(settings, 'SDE_GLOBALID_POOL', False)
+SDE_GLOBALID_BLOCK_SIZE = getattr(settings, 'SDE_GLOBALID_BLOCK_SIZE', 100)
+SDE_GLOBALID_LOW_WATER = getattr(settings, 'SDE_GLOBALID_LOW_WATER', SDE_GLOBALID_BLOCK_SIZE // 4)
+SDE_GLOBALID_BACKGROUND_REFILL = getattr(settings, 'SDE_GLOBALID_BACKGROUND_REFILL', True)
+
+# Spatial predicates (e.g., intersection annotations) first test whether the shapes' envelopes (bounding boxes) overlap,
+# so the exact, expensive predicate runs only on the survivors.  Models with precomputed envelope columns can
+# use them for this stage instead - see sde_envelope_fields on the SDE shape mixins.
+SDE_SPATIAL_ENVELOPE_PREFILTER = getattr(settings, 'SDE_SPATIAL_ENVELOPE_PREFILTER', True)
+
+# Default spatial reference and precision (decimal places, None: no rounding) for SDE point coordinate annotations
+SDE_COORDINATES_SRID = getattr(settings, 'SDE_COORDINATES_SRID', 4269)
+SDE_COORDINATES_PRECISION = getattr(settings, 'SDE_COORDINATES_PRECISION', None)
+
+# An SdeLayerCache refreshes features edited since its last refresh when queried, after this many seconds.
+# 0 disables automatic refresh - call refresh() explicitly, e.g., from a periodic task.
+SDE_LAYER_CACHE_REFRESH_INTERVAL = getattr(settings, 'SDE_LAYER_CACHE_REFRESH_INTERVAL', 300)
+
+# Spatial reference (srid) of SDE feature shapes, for queries that construct geometries to compare with them.
+# Models with shapes in some other spatial reference may override this with an sde_srid class attribute.
+SDE_SRID = getattr(settings, 'SDE_SRID', 3005)
+# Spatial references in geographic units (degrees), for converting map scales to tolerances - others are assumed metric.
+SDE_GEOGRAPHIC_SRIDS = getattr(settings, 'SDE_GEOGRAPHIC_SRIDS', (4326, 4269, 4267, 4617))
+
+# Nearest-neighbour queries order by an index-assisted KNN distance operator (e.g., '<->') where the DB provides one.
+# Esri st_geometry has none:  with None, nearest features are ordered by exact ST_Distance.
+SDE_KNN_OPERATOR = getattr(settings, 'SDE_KNN_OPERATOR', None)
+
+# Vector tiles:  encoded tiles are cached in memory, LRU, up to this many bytes per process.
+# Cached tiles are invalidated when their layer changes - checked at most once every SDE_TILE_VERSION_TTL seconds.
+SDE_TILE_CACHE_MAX_BYTES = getattr(settings, 'SDE_TILE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+SDE_TILE_VERSION_TTL = getattr(settings, 'SDE_TILE_VERSION_TTL', 10)
+
+# Attachment downloads stream data from the DB in chunks of this many bytes, rather than loading the whole blob,
+# and may be cached privately by browsers for SDE_ATTACHMENT_CACHE_MAX_AGE seconds (attachment data is immutable).
+SDE_ATTACHMENT_CHUNK_SIZE = getattr(settings, 'SDE_ATTACHMENT_CHUNK_SIZE', 256 * 1024)
+SDE_ATTACHMENT_CACHE_MAX_AGE = getattr(settings, 'SDE_ATTACHMENT_CACHE_MAX_AGE', 24 * 60 * 60)
+# Attached images are rendered inline, as base64 data URIs ('inline'), or referenced by a per-attachment image URL ('url'),
+# loaded lazily and cached individually by the browser, so image lists carry only the attachment metadata.
+SDE_ATTACHMENT_IMAGE_MODE = getattr(settings, 'SDE_ATTACHMENT_IMAGE_MODE', 'inline')
+# Attachment counts (annotate_attachment_count, AnnotatedArcSdeManager) are computed by one of these strategies:
+#   'join':  COUNT over a join to the attach table - the DB must GROUP BY every selected column of the feature
+#   'grouped':  a join to the attach table, aggregated once by rel_globalid - no GROUP BY on the feature columns
+#   'subquery':  a correlated COUNT sub-query, evaluated per feature - cheap for small pages of features
+SDE_ATTACHMENT_COUNT_STRATEGY = getattr(settings, 'SDE_ATTACHMENT_COUNT_STRATEGY', 'join')
+
+# Thumbnails of image attachments (requires Pillow):  named sizes, in pixels (max. width / height), image format
+# ('JPEG' or 'WEBP') and quality.  Thumbnails are cached on disk, LRU, up to SDE_THUMBNAIL_CACHE_MAX_BYTES, in
+# SDE_THUMBNAIL_CACHE_DIR (default: a directory in the system temp dir) - see arcsde.attachments.thumbnails
+SDE_THUMBNAIL_SIZES = getattr(settings, 'SDE_THUMBNAIL_SIZES', {'small': 160, 'medium': 480, 'large': 1024})
+SDE_THUMBNAIL_FORMAT = getattr(settings, 'SDE_THUMBNAIL_FORMAT', 'JPEG')
+SDE_THUMBNAIL_QUALITY = getattr(settings, 'SDE_THUMBNAIL_QUALITY', 80)
+SDE_THUMBNAIL_CACHE_DIR = getattr(settings, 'SDE_THUMBNAIL_CACHE_DIR', None)
+SDE_THUMBNAIL_CACHE_MAX_BYTES = getattr(settings, 'SDE_THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
 UNIT_TESTING = 'test' in sys.argv
@@ -30,3 +30,13 @@ def attachment_caption(attachment):
         'form_id': 'CaptionEditForm-{id}'.format(id=attachment.pk),
         'attachment': attachment,
     }
+
+
+@register.inclusion_tag('arcsde/attachments/as_thumbnail_tag.html')
+def attachment_thumbnail(attachment, size='small'):
+    """ Render a lazy-loaded thumbnail of an image attachment, linked to the full-size image """
+    return {
+        'attachment': attachment,
+        'thumbnail_url': attachment.thumbnail_url(size),
+        'size': size,
+    }
@@ -0,0 +1,108 @@
+"""
+    Benchmarks for performance-sensitive arcsde code paths - not part of the test suite.
+    Run with:  python -m arcsde.tests.benchmarks  (or: make bench)
+"""
+import datetime
+import random
+import timeit
+
+
+def report(name, results):
+    """ Print timing results: a dict of {label: seconds}, relative to the first entry """
+    baseline = next(iter(results.values()))
+    print(f'\n{name}')
+    for label, seconds in results.items():
+        print(f'    {label:<40} {seconds:8.4f}s   x{baseline / seconds:.2f}')
+
+
+def benchmark_localize(n=100000, repeat=3):
+    """ Compare tz.localize with the cached-offset fast path, for a sorted and a shuffled column of UTC datetimes """
+    from arcsde import tz
+
+    start = datetime.datetime(2015, 1, 1)
+    column = [start + datetime.timedelta(minutes=17 * i) for i in range(n)]
+    shuffled = random.sample(column, len(column))
+    tz.localize_many(column)  # warm the offset cache, as it would be in a running process
+
+    for label, values in (('sorted', column), ('shuffled', shuffled)):
+        report(f'Localize {n} naive UTC datetimes ({label}):', {
+            'tz.localize (per value)': min(timeit.repeat(lambda: [tz.localize(v) for v in values], number=1, repeat=repeat)),
+            'tz.fast_localize (per value)': min(timeit.repeat(lambda: [tz.fast_localize(v) for v in values], number=1, repeat=repeat)),
+            'tz.localize_many (column)': min(timeit.repeat(lambda: tz.localize_many(values), number=1, repeat=repeat)),
+        })
+
+
+def benchmark_strtree(n=20000, lookups=2000, repeat=3):
+    """ Compare point lookups on an STR-tree with a linear scan over n bounding boxes """
+    from arcsde.layers import STRtree
+    from arcsde.layers.strtree import overlaps
+
+    rnd = random.Random(1)
+    boxes = []
+    for _ in range(n):
+        x, y = rnd.uniform(0, 10000), rnd.uniform(0, 10000)
+        boxes.append((x, y, x + rnd.uniform(10, 100), y + rnd.uniform(10, 100)))
+    points = [(rnd.uniform(0, 10000), rnd.uniform(0, 10000)) for _ in range(lookups)]
+    build = min(timeit.repeat(lambda: STRtree(boxes), number=1, repeat=repeat))
+    tree = STRtree(boxes)
+
+    report(f'Point lookups: {lookups} points in {n} boxes (tree build: {build:.4f}s):', {
+        'linear scan': min(timeit.repeat(
+            lambda: [[i for i, b in enumerate(boxes) if overlaps(b, (x, y, x, y))] for x, y in points],
+            number=1, repeat=repeat)),
+        'STRtree.query_point': min(timeit.repeat(
+            lambda: [list(tree.query_point(x, y)) for x, y in points], number=1, repeat=repeat)),
+    })
+
+
+def benchmark_attachment_counts(n=20000, max_attachments=4, page=50, repeat=3):
+    """
+        Compare annotate_attachment_count strategies on n features, with 0 - max_attachments attachments each,
+            for the whole layer and for a page of features, in a throw-away test DB.
+        SQLite plans aggregates differently than Postgres, so compare the strategies on the production DB too.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from arcsde.attachments.models import get_attachment_model
+    from arcsde.models import ArcSdeQuerySet
+    from arcsde.tests.models import SdeFeatureModel, mock_globalid
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        rnd = random.Random(1)
+        attach_model = get_attachment_model(SdeFeatureModel)
+        features = SdeFeatureModel.objects.bulk_create(
+            SdeFeatureModel(globalid=mock_globalid(), some_attr=f'feature {i}') for i in range(n)
+        )
+        attach_model.objects.bulk_create(
+            attach_model(related_object_id=feature.globalid, globalid=mock_globalid(), att_name=f'photo {i}.png',
+                         content_type='image/png', data=b'', data_size=0)
+            for feature in features for i in range(rnd.randint(0, max_attachments))
+        )
+        strategies = ArcSdeQuerySet.ATTACHMENT_COUNT_STRATEGIES
+        qs = lambda strategy: SdeFeatureModel.objects.annotate_attachment_count(strategy).order_by('pk')
+
+        for label, limit in ((f'{n} features', None), (f'a page of {page} features', page)):
+            report(f'Attachment counts for {label}:', {
+                f'annotate_attachment_count({strategy!r})': min(timeit.repeat(
+                    lambda: list(qs(strategy)[:limit]), number=1, repeat=repeat))
+                for strategy in strategies
+            })
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def run_benchmarks():
+    benchmark_localize()
+    benchmark_strtree()
+    benchmark_attachment_counts()
+
+
+if __name__ == '__main__':
+    import django
+    from arcsde.tests import setup_django_settings
+    setup_django_settings()
+    django.setup()
+    run_benchmarks()
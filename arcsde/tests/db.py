@@ -4,9 +4,17 @@
     This can be done AFTER the test DB is create, but BEFORE and tests are actually run:
       the pre-migrate or post-migrate signals provide a reasonable hook.
 """
+import re
+import struct
+import threading
+import uuid
+
 from django.apps import apps
 from django.db import connection
+from arcsde import wkb
 from arcsde.attachments import descriptors
+from arcsde.layers import geometry
+from arcsde.models.catalog import sde_catalog
 from arcsde.util import all_members
 
 CREATE = (
@@ -44,17 +52,45 @@ def create_sde_attach_tables(descriptor='sde_attachments', verbosity=0):
                     )
                 for sql in (statement.format(attach_table=table, globalid=mock_globalid()) for statement in CREATE):
                     cursor.execute(sql)
+    sde_catalog.invalidate()  # new tables were created
 
 
 def create_sde_attach_tables_receiver(sender, descriptor='sde_attachments', **kwargs):
     """ Signal receiver for create_sde_attach_tables """
     create_sde_attach_tables(descriptor, kwargs.get('verbosity', 0))
 
+# Mock SDE key generators:  objectids issued per table, from MOCK_OBJECTID_START, never re-issued (like a sequence)
+MOCK_OBJECTID_START = 1000000
+mock_objectids = {}
+mock_key_calls = []  # (proc, thread ident, caller in atomic block) for each key issued
+_mock_keys_lock = threading.Lock()
+
+# SQLite has no generate_series table function:  rewrite it as an equivalent recursive CTE
+GENERATE_SERIES = re.compile(r'FROM generate_series\(1, %s\)')
+GENERATE_SERIES_CTE = 'FROM (WITH RECURSIVE series(value) AS ' \
+                      '(SELECT 1 UNION ALL SELECT value + 1 FROM series WHERE value < %s) SELECT value FROM series)'
+
+
+def mock_generate_series(execute, sql, params, many, context):
+    """ A DB execute wrapper that runs SQL using generate_series(1, n) on SQLite """
+    return execute(GENERATE_SERIES.sub(GENERATE_SERIES_CTE, sql), params, many, context)
+
+
 def mock_sde_functions(conn):
     """ Add suite of mock functions to SQLite DB so SDE stored proc. calls don't crash -- dummy results!! """
+    # Mock SDE key generators used by arcsde.models.ArcSdeFeatureCreationMixin and arcsde.models.keys
+    def next_rowid(owner, table):
+        with _mock_keys_lock:
+            objectid = mock_objectids[table] = mock_objectids.get(table, MOCK_OBJECTID_START) + 1
+            mock_key_calls.append(('next_rowid', threading.get_ident(), conn.in_atomic_block))
+        return objectid
+    def next_globalid():
+        with _mock_keys_lock:
+            mock_key_calls.append(('next_globalid', threading.get_ident(), conn.in_atomic_block))
+        return '{%s}' % str(uuid.uuid4()).upper()
     # Mock SDE functions defined in arcsde.models.functions:
     def ST_Transform(expr, srid):
-        return 42.0
+        return expr if isinstance(expr, str) else 42.0  # shapes stored as hex WKB are "transformed" as-is
     def ST_X(shape):
         return 123
     def ST_Y(shape):
@@ -63,10 +99,45 @@ def mock_sde_functions(conn):
         return 31400
     def ST_Intersects(shape1, shape2):
         return False
-    functions = ((ST_Transform, 2), (ST_X, 1), (ST_Y, 1), (ST_Area, 1), (ST_Intersects, 2) )
+    def ST_EnvIntersects(shape1, shape2):
+        return True  # every envelope is a candidate, exact ST_Intersects excludes them all
+    def st_geometry(wkt, srid):
+        return wkt
+    def ST_GeomFromWKB(wkb_bytes, srid):
+        return bytes(wkb_bytes).hex()
+    def ST_Buffer(shape, distance):
+        return shape
+    def ST_Distance(shape1, shape2):
+        return 100.0
+    def ST_Generalize(shape, tolerance):
+        return shape
+    def ST_AsText(shape):
+        return shape
+    def ST_AsBinary(shape):
+        if shape is None:
+            return None
+        if isinstance(shape, str):  # test fixtures may store shapes as hex WKB
+            return bytes.fromhex(shape)
+        return struct.pack('<BIdd', 1, 1, 123, 987)  # WKB Point(123 987)
+    def bounds(shape, i):
+        return geometry.bounds(wkb.decode_wkb(ST_AsBinary(shape)))[i] if shape else None
+    def ST_MinX(shape):
+        return bounds(shape, 0)
+    def ST_MinY(shape):
+        return bounds(shape, 1)
+    def ST_MaxX(shape):
+        return bounds(shape, 2)
+    def ST_MaxY(shape):
+        return bounds(shape, 3)
+    functions = ((ST_Transform, 2), (ST_X, 1), (ST_Y, 1), (ST_Area, 1), (ST_Intersects, 2), (ST_EnvIntersects, 2),
+                 (ST_AsBinary, 1), (ST_MinX, 1), (ST_MinY, 1), (ST_MaxX, 1), (ST_MaxY, 1),
+                 (st_geometry, 2), (ST_GeomFromWKB, 2), (ST_Buffer, 2), (ST_Distance, 2), (ST_Generalize, 2),
+                 (ST_AsText, 1), (next_rowid, 2), (next_globalid, 0) )
 
     for fn, n_arg in functions:
         conn.connection.create_function(fn.__name__, n_arg, fn)
+    if mock_generate_series not in conn.execute_wrappers:
+        conn.execute_wrappers.append(mock_generate_series)
 
 
 def create_tables_for_unmanaged_test_models(conn):
@@ -91,6 +91,33 @@ class SdePointFeature(MockSdeIdsMixin, models.ArcSdePointMixin, models.AbstractA
 
 
 class SdeGeomFeature(MockSdeIdsMixin, models.ArcSdeGeometryMixin, models.AbstractArcSdeFeature):
+    # published by the layer views - see arcsde.layers.urls
+    sde_tile_fields = ('created_user', )
+    sde_export_fields = ('created_user', )
+
     class Meta:
         app_label = 'arcsde_tests'
         db_table = 'sde_geom_feature'
+
+
+class SdeEnvelopeFeature(MockSdeIdsMixin, models.ArcSdeGeometryMixin, models.AbstractArcSdeFeature):
+    """ A feature table with precomputed envelope columns """
+    minx = django.db.models.FloatField(null=True)
+    miny = django.db.models.FloatField(null=True)
+    maxx = django.db.models.FloatField(null=True)
+    maxy = django.db.models.FloatField(null=True)
+
+    sde_envelope_fields = ('minx', 'miny', 'maxx', 'maxy')
+
+    class Meta:
+        app_label = 'arcsde_tests'
+        db_table = 'sde_envelope_feature'
+
+
+class SdeCreationFeature(models.ArcSdeFeatureCreationMixin, models.AbstractArcSdeFeature):
+    """ A feature that uses SDE key generation - SDE key procs are mocked on SQLite, see tests.db """
+    some_attr = django.db.models.CharField(verbose_name='some_attr',  blank=True, default='', max_length=50)
+
+    class Meta:
+        app_label = 'arcsde_tests'
+        db_table = 'sde_creation_feature'
@@ -1,9 +1,15 @@
 """
     Test suite for SDE attachment models -- models for the __attach tables associated with some models
 """
+from unittest import mock
+
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from arcsde import settings
 from arcsde.attachments import models, forms
-from .models import SdeFeatureModel
+from .models import SdeFeatureModel, mock_globalid
 
 @override_settings(ROOT_URLCONF='arcsde.tests.urls')
 class BaseAttachmentModelTests(TestCase):
@@ -113,3 +119,104 @@ class AttachmentCaptionFormTests(BaseAttachmentModelTests):
         form = forms.CaptionForm(data={'att_name': new_caption}, instance=self.attachment)
         self.assertTrue(form.is_valid())
         self.assertEqual(form.cleaned_data['att_name'], new_caption)
+
+
+class AttachmentMetadataTests(BaseAttachmentModelTests):
+    def setUp(self):
+        super().setUp()
+        self.attachment = self.get_attachment_model().get_test_object()
+        self.attachment.related_object = self.feature
+        self.attachment.globalid = mock_globalid()
+        self.attachment.save()
+
+    def test_metadata_manager(self):
+        attachment = self.get_attachment_model().metadata.get(pk=self.attachment.pk)
+        self.assertEqual(attachment.get_deferred_fields(), {'data'})
+        self.assertEqual(attachment.data_size, self.attachment.data_size)
+
+    def test_with_data(self):
+        attachment = self.get_attachment_model().metadata.sde_with_data().get(pk=self.attachment.pk)
+        self.assertEqual(attachment.get_deferred_fields(), set())
+        self.assertEqual(bytes(attachment.data), bytes(self.attachment.data))
+
+    def test_default_manager_loads_data(self):
+        attachment = self.get_attachment_model().objects.get(pk=self.attachment.pk)
+        self.assertEqual(attachment.get_deferred_fields(), set())
+
+    def test_api_metadata(self):
+        (attachment, ) = self.feature.sde_attachments.metadata
+        self.assertEqual(attachment.get_deferred_fields(), {'data'})
+
+    def test_caption_form_save_metadata_only(self):
+        attachment = self.get_attachment_model().metadata.get(pk=self.attachment.pk)
+        form = forms.CaptionForm(data={'att_name': 'New Caption'}, instance=attachment)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.save())
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"data"', queries[0]['sql'])
+        self.assertEqual(self.get_attachment_model().objects.get(pk=self.attachment.pk).att_name, 'New Caption')
+
+
+class AttachmentCountTests(BaseAttachmentModelTests):
+    STRATEGIES = ('join', 'grouped', 'subquery')
+
+    def setUp(self):
+        super().setUp()
+        self.empty = SdeFeatureModel.objects.create()
+        self.many = SdeFeatureModel.objects.create(some_attr='many')
+        self.add_attachments(self.feature, 1)
+        self.add_attachments(self.many, 3)
+        self.expected = {self.feature.pk: 1, self.empty.pk: 0, self.many.pk: 3}
+
+    def add_attachments(self, feature, n):
+        for i in range(n):
+            attachment = self.get_attachment_model().get_test_object()
+            attachment.related_object = feature
+            attachment.globalid = mock_globalid()
+            attachment.save()
+
+    def counts(self, qs):
+        return dict(qs.values_list('pk', 'attachment_count'))
+
+    def test_strategies(self):
+        for strategy in self.STRATEGIES:
+            with self.subTest(strategy=strategy):
+                qs = SdeFeatureModel.objects.annotate_attachment_count(strategy)
+                self.assertEqual(self.counts(qs), self.expected)
+                self.assertEqual({f.pk: f.attachment_count for f in qs}, self.expected)
+
+    def test_strategy_sql(self):
+        sql = {strategy: str(SdeFeatureModel.objects.annotate_attachment_count(strategy).query)
+               for strategy in self.STRATEGIES}
+        self.assertIn('GROUP BY', sql['join'])
+        self.assertIn('LEFT OUTER JOIN (SELECT', sql['grouped'])
+        self.assertEqual(sql['grouped'].count('GROUP BY'), 1)  # only in the derived table
+        self.assertNotIn('JOIN', sql['subquery'])
+        self.assertIn('COUNT(*)', sql['subquery'])
+
+    def test_grouped_combines(self):
+        qs = SdeFeatureModel.objects.annotate_attachment_count('grouped')
+        self.assertEqual(self.counts(qs.filter(some_attr='many')), {self.many.pk: 3})
+        self.assertEqual(self.counts(qs.filter(attachment_count__gt=0)), {self.feature.pk: 1, self.many.pk: 3})
+        self.assertEqual(qs.count(), 3)
+        self.assertEqual(self.counts(qs.order_by('-attachment_count')[:1]), {self.many.pk: 3})
+        self.assertEqual(qs.aggregate(total=Sum('attachment_count'))['total'], 4)
+
+    def test_default_strategy_setting(self):
+        for strategy in self.STRATEGIES:
+            with self.subTest(strategy=strategy), \
+                    mock.patch.object(settings, 'SDE_ATTACHMENT_COUNT_STRATEGY', strategy):
+                qs = SdeFeatureModel.annotated.all()
+                self.assertEqual(self.counts(qs), self.expected)
+                self.assertEqual('LEFT OUTER JOIN (SELECT' in str(qs.query), strategy == 'grouped')
+
+    def test_manager_strategy(self):
+        from arcsde.models import AnnotatedArcSdeManager
+        manager = AnnotatedArcSdeManager(attachment_count_strategy='grouped')
+        manager.model = SdeFeatureModel
+        self.assertIn('LEFT OUTER JOIN (SELECT', str(manager.all().query))
+        self.assertEqual(self.counts(manager.all()), self.expected)
+
+    def test_invalid_strategy(self):
+        with self.assertRaises(AssertionError):
+            SdeFeatureModel.objects.annotate_attachment_count('bogus')
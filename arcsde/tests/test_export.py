@@ -0,0 +1,101 @@
+"""
+    Test suite for streaming GeoJSON export of SDE feature layers
+"""
+import datetime
+import io
+import json
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command, CommandError
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from arcsde import tz, wkb
+from arcsde.layers import export
+from arcsde.layers.views import SdeGeoJsonExportView
+from .models import SdeGeomFeature, SdePointFeature
+from .test_wkb import wkb_polygon, SQUARE, HOLE
+
+
+class GeoJsonGeometryTests(TestCase):
+
+    def test_polygon(self):
+        geometry = export.geojson_geometry(wkb.decode_wkb(wkb_polygon([SQUARE, HOLE])))
+        self.assertEqual(geometry['type'], 'Polygon')
+        self.assertEqual(geometry['coordinates'][0], [list(p) for p in SQUARE])
+        self.assertEqual(len(geometry['coordinates']), 2)
+
+    def test_point_precision(self):
+        point = wkb.WkbGeometry('Point', [-123.456789, 49.123456])
+        self.assertEqual(export.geojson_geometry(point, precision=3), {'type': 'Point', 'coordinates': [-123.457, 49.123]})
+
+
+class GeoJsonExportTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.features = [
+            SdeGeomFeature.objects.create(shape=wkb_polygon([SQUARE]).hex(), created_user=user,
+                                          created_date=timezone.now().replace(microsecond=0))
+            for user in ('a', 'b')
+        ]
+
+    def test_feature_collection(self):
+        exporter = export.GeoJsonExporter(SdeGeomFeature.objects.all(), fields=('created_user', 'created_date'))
+        collection = json.loads(''.join(exporter.iter_geojson()))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(len(collection['features']), 2)
+        feature = collection['features'][0]
+        self.assertEqual(feature['id'], self.features[0].pk)
+        self.assertEqual(feature['geometry']['type'], 'Polygon')
+        self.assertEqual(feature['properties']['created_user'], 'a')
+        created = datetime.datetime.fromisoformat(feature['properties']['created_date'])
+        self.assertEqual(created, self.features[0].created_date)
+        self.assertEqual(created.utcoffset(), tz.LOCAL_TIME_ZONE.utcoffset(created.replace(tzinfo=None)))
+
+    def test_ndjson(self):
+        exporter = export.GeoJsonExporter(SdeGeomFeature.objects.all(), fields=('created_user', ))
+        lines = list(exporter.iter_ndjson())
+        self.assertEqual(len(lines), 2)
+        self.assertEqual([json.loads(line)['properties'] for line in lines], [{'created_user': 'a'}, {'created_user': 'b'}])
+
+    def test_default_fields(self):
+        exporter = export.GeoJsonExporter(SdeGeomFeature.objects.all())
+        self.assertNotIn('shape', exporter.fields)
+        self.assertIn('globalid', exporter.fields)
+
+    def test_bad_format(self):
+        with self.assertRaises(ValueError):
+            export.GeoJsonExporter(SdeGeomFeature.objects.all()).iter_format('kml')
+
+    def test_export_view(self):
+        url = reverse('layers:export', kwargs=dict(app_label='arcsde_tests', model_name='sdegeomfeature',
+                                                           format='ndjson'))
+        response = self.client.get(url)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['properties'], {'created_user': 'a'})  # only the sde_export_fields
+
+    def test_export_view_not_found(self):
+        for kwargs in (dict(model_name='sdegeomfeature', format='kml'), dict(model_name='sdefeaturemodel', format='geojson'),
+                       dict(model_name='sdepointfeature', format='geojson')):  # no sde_export_fields: not published
+            url = reverse('layers:export', kwargs=dict(app_label='arcsde_tests', **kwargs))
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_export_view_requires_fields(self):
+        view = SdeGeoJsonExportView(model=SdePointFeature)
+        with self.assertRaises(ImproperlyConfigured):
+            view.get_fields(view.get_queryset())
+        view = SdeGeoJsonExportView(model=SdePointFeature, fields=('created_user', ))
+        self.assertEqual(view.get_fields(view.get_queryset()), ('created_user', ))
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('sde_export', 'arcsde_tests.SdeGeomFeature', '--fields', 'created_user', stdout=out)
+        collection = json.loads(out.getvalue())
+        self.assertEqual([f['properties'] for f in collection['features']], [{'created_user': 'a'}, {'created_user': 'b'}])
+        with self.assertRaises(CommandError):
+            call_command('sde_export', 'arcsde_tests.SdeFeatureModel')
@@ -0,0 +1,322 @@
+"""
+    Test suite for SDE feature layers: in-process layer caches, spatial index, and vector tiles
+"""
+import random
+import struct
+from array import array
+from django.test import TestCase
+from django.urls import reverse
+
+from arcsde import wkb
+from arcsde.layers import STRtree, SdeLayerCache, SdeTileLayer, TileCache, geometry, mvt, tiles
+from .models import SdeGeomFeature, SdePointFeature
+from .test_wkb import wkb_polygon, SQUARE, HOLE
+
+
+def square(x, y, size=10):
+    return [(x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)]
+
+
+def multipolygon(*polygons):
+    return struct.pack('<BII', 1, 6, len(polygons)) + b''.join(wkb_polygon(rings) for rings in polygons)
+
+
+class STRtreeTests(TestCase):
+
+    def test_query_matches_brute_force(self):
+        rnd = random.Random(42)
+        boxes = []
+        for _ in range(500):
+            x, y = rnd.uniform(0, 1000), rnd.uniform(0, 1000)
+            boxes.append((x, y, x + rnd.uniform(0, 50), y + rnd.uniform(0, 50)))
+        tree = STRtree(boxes, node_capacity=4)
+        self.assertEqual(len(tree), 500)
+        self.assertGreater(tree.depth(), 2)
+        for _ in range(50):
+            x, y = rnd.uniform(0, 1000), rnd.uniform(0, 1000)
+            query = (x, y, x + 100, y + 100)
+            expected = {i for i, box in enumerate(boxes)
+                        if box[0] <= query[2] and box[2] >= query[0] and box[1] <= query[3] and box[3] >= query[1]}
+            self.assertEqual(set(tree.query(query)), expected)
+
+    def test_query_point(self):
+        tree = STRtree([(0, 0, 10, 10), (5, 5, 15, 15), (20, 20, 30, 30)])
+        self.assertEqual(sorted(tree.query_point(7, 7)), [0, 1])
+        self.assertEqual(list(tree.query_point(18, 18)), [])
+
+    def test_empty(self):
+        tree = STRtree([])
+        self.assertEqual(list(tree.query_point(0, 0)), [])
+        self.assertEqual(tree.depth(), 0)
+
+
+class GeometryTests(TestCase):
+
+    def test_polygon_with_hole(self):
+        polygon = wkb.decode_wkb(wkb_polygon([SQUARE, HOLE]))
+        self.assertEqual(geometry.bounds(polygon), (0, 0, 10, 10))
+        self.assertEqual(geometry.vertex_count(polygon), 9)
+        self.assertTrue(geometry.contains_point(polygon, 5, 5))
+        self.assertFalse(geometry.contains_point(polygon, 3.5, 2.5))  # in the hole
+        self.assertFalse(geometry.contains_point(polygon, 11, 5))
+
+    def test_multipolygon(self):
+        geom = wkb.decode_wkb(multipolygon([SQUARE], [square(20, 20)]))
+        self.assertEqual(geometry.bounds(geom), (0, 0, 30, 30))
+        self.assertTrue(geometry.contains_point(geom, 25, 25))
+        self.assertFalse(geometry.contains_point(geom, 15, 15))
+
+    def test_point(self):
+        point = wkb.WkbGeometry('Point', array('d', [1, 2]))
+        self.assertEqual(geometry.bounds(point), (1, 2, 1, 2))
+        self.assertFalse(geometry.contains_point(point, 1, 2))
+
+
+class SdeLayerCacheTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.west = SdeGeomFeature.objects.create(shape=wkb_polygon([square(0, 0)]).hex(), created_user='west')
+        self.east = SdeGeomFeature.objects.create(shape=wkb_polygon([square(10, 0)]).hex(), created_user='east')
+        SdeGeomFeature.objects.create(shape=None)  # features without a shape are not cached
+        self.layer = SdeLayerCache(SdeGeomFeature.objects.all(), fields=('created_user', ), refresh_interval=0)
+
+    def test_load(self):
+        self.assertEqual(self.layer.feature_at(5, 5).key, self.west.pk)
+        self.assertEqual(self.layer.feature_at(15, 5).values, {'created_user': 'east'})
+        self.assertIsNone(self.layer.feature_at(25, 5))
+        self.assertEqual(len(self.layer), 2)
+        self.assertEqual(self.layer.loads, 1)
+
+    def test_features_at_shared_edge(self):
+        features = self.layer.features_in_bbox((9, 5, 11, 5))
+        self.assertEqual([f.key for f in features], [self.west.pk, self.east.pk])
+        self.assertTrue(self.layer.contains(10.5, 5))
+
+    def test_incremental_refresh(self):
+        self.layer.load()
+        self.assertFalse(self.layer.refresh())  # nothing changed
+        self.assertEqual(self.layer.refreshes, 0)
+
+        self.east.shape = wkb_polygon([square(100, 100)]).hex()
+        self.east.save()
+        north = SdeGeomFeature.objects.create(shape=wkb_polygon([square(0, 10)]).hex())
+        self.west.delete()
+        self.assertTrue(self.layer.refresh())
+        self.assertEqual(self.layer.loads, 1)
+        self.assertEqual(self.layer.refreshes, 1)
+        self.assertIsNone(self.layer.feature_at(5, 5))
+        self.assertIsNone(self.layer.feature_at(15, 5))
+        self.assertEqual(self.layer.feature_at(105, 105).key, self.east.pk)
+        self.assertEqual(self.layer.feature_at(5, 15).key, north.pk)
+
+    def test_refresh_null_shape(self):
+        self.layer.load()
+        self.west.shape = None
+        self.west.save()
+        self.assertTrue(self.layer.refresh())
+        self.assertIsNone(self.layer.feature_at(5, 5))
+        self.assertIsNone(self.layer.get(self.west.pk))
+        self.assertEqual(self.layer.feature_at(15, 5).key, self.east.pk)
+        self.assertEqual(len(self.layer), 1)
+
+    def test_auto_refresh(self):
+        layer = SdeLayerCache(SdeGeomFeature, refresh_interval=0.000001)
+        layer.feature_at(5, 5)
+        SdeGeomFeature.objects.create(shape=wkb_polygon([square(50, 50)]).hex())
+        self.assertIsNotNone(layer.feature_at(55, 55))
+        self.assertEqual(layer.loads, 1)
+
+    def test_stats(self):
+        self.layer.load()
+        stats = self.layer.stats()
+        self.assertEqual(stats['features'], 2)
+        self.assertEqual(stats['vertices'], 10)
+        self.assertGreater(stats['memory_bytes'], 2 * 5 * 2 * 8)
+        self.assertEqual(stats['tree_depth'], 1)
+        self.assertGreaterEqual(stats['build_seconds'], 0)
+
+
+def read_varint(buf, i):
+    value = shift = 0
+    while True:
+        byte = buf[i]
+        value |= (byte & 0x7f) << shift
+        i, shift = i + 1, shift + 7
+        if not byte & 0x80:
+            return value, i
+
+
+def read_message(buf):
+    """ Decode a protobuf message into a list of (field number, int or bytes) - just enough to check tiles """
+    fields, i = [], 0
+    while i < len(buf):
+        key, i = read_varint(buf, i)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == mvt.VARINT:
+            value, i = read_varint(buf, i)
+        elif wire_type == mvt.FIXED64:
+            value, i = buf[i:i + 8], i + 8
+        else:
+            length, i = read_varint(buf, i)
+            value, i = buf[i:i + length], i + length
+        fields.append((number, value))
+    return fields
+
+
+def read_packed(buf):
+    values, i = [], 0
+    while i < len(buf):
+        value, i = read_varint(buf, i)
+        values.append(value)
+    return values
+
+
+def read_layers(tile):
+    return [dict(read_message(layer), features=[read_message(f) for n, f in read_message(layer) if n == 2],
+                 keys=[bytes(k).decode() for n, k in read_message(layer) if n == 3])
+            for n, layer in read_message(tile) if n == 3]
+
+
+def decode_rings(commands):
+    """ Decode MVT polygon geometry commands into a list of rings of tile coordinates """
+    unzigzag = lambda v: (v >> 1) ^ -(v & 1)
+    rings, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == mvt.MOVE_TO:
+            rings.append([])
+        if command != mvt.CLOSE_PATH:
+            for _ in range(count):
+                x, y = x + unzigzag(commands[i]), y + unzigzag(commands[i + 1])
+                rings[-1].append((x, y))
+                i += 2
+    return rings
+
+
+class MvtEncoderTests(TestCase):
+
+    def test_polygon_commands(self):
+        layer = mvt.LayerEncoder('test', (0, 0, 4096, 4096))
+        # counter-clockwise square in map coordinates, with a repeated vertex
+        polygon = wkb.decode_wkb(wkb_polygon([[(0, 0), (10, 0), (10, 0), (10, 10), (0, 10), (0, 0)]]))
+        self.assertTrue(layer.add_feature(polygon, {'name': 'a', 'size': 3, 'none': None}, feature_id=7))
+        (features, ), = [l['features'] for l in read_layers(mvt.encode_tile(layer))]
+        feature = dict(features)
+        self.assertEqual(feature[1], 7)
+        self.assertEqual(feature[3], mvt.POLYGON)
+        commands = read_packed(feature[4])
+        self.assertEqual(commands[0], mvt.MOVE_TO | 1 << 3)
+        self.assertEqual(commands[3], mvt.LINE_TO | 3 << 3)
+        self.assertEqual(commands[-1], mvt.CLOSE_PATH | 1 << 3)
+        self.assertEqual(len(read_packed(feature[2])), 4)  # 2 tags, None is omitted
+
+    def test_winding_order(self):
+        transform = mvt.TileTransform((0, 0, 4096, 4096))
+        for rings in ([SQUARE], [SQUARE[::-1]], [SQUARE, HOLE], [SQUARE, HOLE[::-1]]):
+            geom_type, commands = mvt.encode_geometry(wkb.decode_wkb(wkb_polygon(rings)), transform)
+            exterior, *holes = decode_rings(commands)
+            self.assertEqual(len(exterior), 4)
+            self.assertGreater(mvt._area(exterior), 0)
+            self.assertTrue(all(mvt._area(hole) < 0 for hole in holes))
+
+    def test_degenerate_geometry(self):
+        transform = mvt.TileTransform((0, 0, 4096000, 4096000))
+        geom = wkb.decode_wkb(wkb_polygon([SQUARE]))  # smaller than 1 tile unit
+        self.assertEqual(mvt.encode_geometry(geom, transform), (None, []))
+        layer = mvt.LayerEncoder('test', (0, 0, 4096000, 4096000))
+        self.assertFalse(layer.add_feature(geom))
+        self.assertEqual(mvt.encode_tile(layer), b'')
+
+    def test_values(self):
+        self.assertEqual(mvt.encode_value(-1), mvt.field(6, mvt.VARINT, 1))
+        self.assertEqual(mvt.encode_value(True), mvt.field(7, mvt.VARINT, 1))
+        self.assertEqual(mvt.varint(300), bytes([0xac, 0x02]))
+
+
+class TileMathTests(TestCase):
+
+    def test_tile_bounds(self):
+        self.assertEqual(tiles.tile_bounds(0, 0, 0), (-tiles.ORIGIN, -tiles.ORIGIN, tiles.ORIGIN, tiles.ORIGIN))
+        minx, miny, maxx, maxy = tiles.tile_bounds(1, 1, 0)
+        self.assertEqual((minx, miny, maxx, maxy), (0, 0, tiles.ORIGIN, tiles.ORIGIN))
+        self.assertFalse(tiles.is_valid_tile(1, 2, 0))
+
+    def test_zoom_tolerance(self):
+        self.assertAlmostEqual(tiles.zoom_tolerance(0, 3005), 156543.03, places=2)  # metres per pixel at zoom 0
+        self.assertAlmostEqual(tiles.zoom_tolerance(1, 3005), tiles.zoom_tolerance(0, 3005) / 2)
+        self.assertAlmostEqual(tiles.zoom_tolerance(10, 3005, latitude=60), tiles.zoom_tolerance(10, 3005) / 2)
+        self.assertAlmostEqual(tiles.zoom_tolerance(0, 4326), 360 / tiles.TILE_SIZE)  # degrees per pixel
+        self.assertAlmostEqual(tiles.zoom_tolerance(0, 4326, latitude=60, pixels=2), 2 * 360 / tiles.TILE_SIZE)
+
+    def test_tile_latitude(self):
+        self.assertAlmostEqual(tiles.tile_latitude(1, 0) + tiles.tile_latitude(1, 1), 0)
+        self.assertAlmostEqual(tiles.tile_latitude(2, 1), 40.98, places=2)
+
+    def test_tile_cache_lru(self):
+        cache = TileCache(max_bytes=10)
+        cache.set('a', b'12345')
+        cache.set('b', b'12345')
+        cache.get('a')
+        cache.set('c', b'12345')  # evicts b, the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'12345')
+        self.assertEqual(cache.stats(), dict(tiles=2, bytes=10, hits=2, misses=1))
+
+
+class SdeTileLayerTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tiles.tile_cache.clear()
+        SdeGeomFeature.objects.create(shape=wkb_polygon([square(0, 0, 100000)]).hex(), created_user='west')
+        SdeGeomFeature.objects.create(shape=wkb_polygon([square(-200000, 0, 100000)]).hex(), created_user='east')
+
+    def test_tile_sql(self):
+        layer = SdeTileLayer(SdeGeomFeature, fields=('created_user', ))
+        sql, params = layer.tile_queryset(4, 8, 7).query.sql_with_params()
+        self.assertIn('ST_EnvIntersects("sde_geom_feature"."shape", ST_Transform(st_geometry(%s, %s), %s))', sql)
+        self.assertEqual(params[-3:], (tiles.bbox_wkt(tiles.tile_bounds(4, 8, 7)), 3857, 3005))
+        self.assertIn('ST_AsBinary(ST_Transform(ST_Generalize("sde_geom_feature"."shape", %s), %s))', sql)
+        self.assertEqual(params[:2], (tiles.zoom_tolerance(4, 3005, tiles.tile_latitude(4, 7)), 3857))
+
+    def test_point_tile_sql(self):
+        layer = SdeTileLayer(SdePointFeature)
+        sql, params = layer.tile_queryset(4, 8, 7).query.sql_with_params()
+        self.assertIn('ST_AsBinary(ST_Transform("sde_point_feature"."shape", %s))', sql)
+
+    def test_render(self):
+        layer = SdeTileLayer(SdeGeomFeature, name='geoms', fields=('created_user', ))
+        tile, version = layer.tile(0, 0, 0)
+        (decoded, ) = read_layers(tile)
+        self.assertEqual(bytes(decoded[1]), b'geoms')
+        self.assertEqual(decoded[5], mvt.EXTENT)
+        self.assertEqual(len(decoded['features']), 2)
+        self.assertEqual(decoded['keys'], ['created_user'])
+
+    def test_cache_invalidated_by_edit(self):
+        layer = SdeTileLayer(SdeGeomFeature, version_ttl=0)
+        tile, version = layer.tile(0, 0, 0)
+        self.assertEqual(layer.tile(0, 0, 0), (tile, version))
+        self.assertEqual(tiles.tile_cache.hits, 1)
+        SdeGeomFeature.objects.create(shape=wkb_polygon([square(0, -200000, 100000)]).hex())
+        new_tile, new_version = layer.tile(0, 0, 0)
+        self.assertNotEqual(version, new_version)
+        self.assertEqual(len(read_layers(new_tile)[0]['features']), 3)
+
+    def test_tile_view(self):
+        url = reverse('layers:tile', kwargs=dict(app_label='arcsde_tests', model_name='sdegeomfeature',
+                                                         z=0, x=0, y=0))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertEqual(len(read_layers(response.content)[0]['features']), 2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_tile_view_not_found(self):
+        for kwargs in (dict(model_name='sdegeomfeature', z=1, x=2, y=0), dict(model_name='sdefeaturemodel', z=0, x=0, y=0),
+                       dict(model_name='sdepointfeature', z=0, x=0, y=0)):  # no sde_tile_fields: not published
+            url = reverse('layers:tile', kwargs=dict(app_label='arcsde_tests', **kwargs))
+            self.assertEqual(self.client.get(url).status_code, 404)
@@ -2,16 +2,22 @@
     Test suite for SDE base models / business logic
 """
 import datetime
+import threading
+from unittest import mock
+from django.db import connection, connections, transaction
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django import forms
 from django.utils import timezone
 
-from arcsde import models
+from arcsde import models, settings, tz
+from arcsde.models import keys, catalog
+from . import db
 from .models import (
     SdeFeatureModel,
-    SdeGeomFeature, SdePointFeature,
+    SdeGeomFeature, SdePointFeature, SdeCreationFeature,
     SdeFeatureForm, SdeFeatureFormWithObjectid,
+    mock_globalid, create_sde_feature,
 )
 
 
@@ -189,3 +195,411 @@ class ArcSdeShapeMixinTests(BaseModelsTests):
         sde_feature = SdeGeomFeature()
         self.assertTrue(sde_feature.has_shape)
         self.assertFalse(sde_feature.is_point)
+
+
+class ObjectidAllocatorTests(TestCase):
+    """ Key reservation requires SDE procs - mock the DB reservation to test the pool logic """
+
+    def setUp(self):
+        self.next_id = 0
+        self.reserved = []
+
+    def reserve_block(self, owner, table, n, proc=None):
+        self.reserved.append((owner, table, n))
+        block = list(range(self.next_id + 1, self.next_id + n + 1))
+        self.next_id += n
+        return block
+
+    def get_allocator(self, **kwargs):
+        allocator = keys.ObjectidAllocator(block_size=10, low_water=0, background=False, **kwargs)
+        allocator.reserve_block = self.reserve_block
+        allocator.table_owner = lambda table: 'sde_owner'
+        return allocator
+
+    def test_block_reserved_once(self):
+        allocator = self.get_allocator()
+        ids = [allocator.next_objectid('some_table') for _ in range(10)]
+        self.assertEqual(ids, list(range(1, 11)))
+        self.assertEqual(self.reserved, [('sde_owner', 'some_table', 10)])
+        self.assertEqual(allocator.stats()['some_table'], dict(hits=9, misses=1, refills=1, available=0))
+
+    def test_pools_per_table(self):
+        allocator = self.get_allocator()
+        a = allocator.next_objectid('table_a')
+        b = allocator.next_objectid('table_b', owner='other_owner')
+        self.assertNotEqual(a, b)
+        self.assertEqual(self.reserved, [('sde_owner', 'table_a', 10), ('other_owner', 'table_b', 10)])
+
+    def test_take(self):
+        allocator = self.get_allocator()
+        allocator.next_objectid('some_table')
+        ids = allocator.take('some_table', 15)
+        self.assertEqual(ids, list(range(2, 17)))
+        self.assertEqual(len(set(ids)), 15)
+        self.assertEqual(allocator.stats()['some_table']['available'], 0)
+
+    def test_background_refill(self):
+        allocator = self.get_allocator()
+        pool = allocator.get_pool('some_table')
+        pool.background, pool.low_water = True, 5
+        for _ in range(6):
+            allocator.next_objectid('some_table')
+        for thread in threading.enumerate():
+            if thread.name == 'arcsde-key-refill':
+                thread.join()
+        self.assertEqual(pool.stats()['refills'], 2)
+        self.assertEqual(pool.stats()['available'], 14)
+
+    def test_reset(self):
+        allocator = self.get_allocator()
+        allocator.next_objectid('some_table')
+        allocator.reset()
+        self.assertEqual(allocator.next_objectid('some_table'), 11)
+
+
+class SdeKeyProcTestsMixin:
+    """ Create SdeCreationFeatures with keys from the SDE key procs, mocked on SQLite - see tests.db """
+
+    def new_feature(self, **kwargs):
+        feature = SdeCreationFeature(**kwargs)
+        setattr(feature, SdeCreationFeature.SDE_EDITED_BY_ANNOTATION, 'key_tester')
+        return feature
+
+    def key_calls(self, proc):
+        """ Return the mock key proc calls made since setUp, as (thread ident, caller in atomic block) """
+        return [(thread, in_atomic) for name, thread, in_atomic in db.mock_key_calls[self.calls_start:] if name == proc]
+
+
+class ObjectidPoolDbTests(SdeKeyProcTestsMixin, TestCase):
+    """ Objectid pools reserving blocks from the (mock) next_rowid proc, on their own connection """
+
+    def setUp(self):
+        self.calls_start = len(db.mock_key_calls)
+        allocator = keys.ObjectidAllocator(block_size=5, low_water=0, background=False)
+        patcher = mock.patch.object(keys, 'objectid_allocator', allocator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.allocator = allocator
+
+    def test_save_draws_from_pool(self):
+        start = db.mock_objectids.get('sde_creation_feature', db.MOCK_OBJECTID_START)
+        with mock.patch.object(SdeCreationFeature, 'use_objectid_pool', True):
+            features = [self.new_feature(some_attr=str(i)) for i in range(3)]
+            for feature in features:
+                feature.save()
+        self.assertEqual([f.pk for f in features], [start + 1, start + 2, start + 3])
+        self.assertEqual(set(SdeCreationFeature.objects.values_list('pk', flat=True)), {f.pk for f in features})
+        self.assertEqual(self.allocator.stats()['sde_creation_feature'],
+                         dict(hits=2, misses=1, refills=1, available=2))
+        calls = self.key_calls('next_rowid')
+        self.assertEqual(len(calls), 5)  # one block, reserved in a single statement
+        self.assertTrue(all(thread != threading.get_ident() for thread, _ in calls))  # on its own connection
+
+    def test_reservation_survives_rollback(self):
+        with mock.patch.object(SdeCreationFeature, 'use_objectid_pool', True):
+            feature = self.new_feature()
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    feature.save()
+                    raise RuntimeError('roll back the insert')
+            self.assertFalse(SdeCreationFeature.objects.filter(pk=feature.pk).exists())
+            # the block was reserved on a connection in autocommit mode - committed, whatever the caller's transaction
+            calls = self.key_calls('next_rowid')
+            self.assertEqual(len(calls), 5)
+            self.assertEqual({in_atomic for _, in_atomic in calls}, {False})
+            # rolled-back keys are never re-issued:  objectids need not be contiguous
+            another = self.new_feature()
+            another.save()
+        self.assertEqual(another.pk, feature.pk + 1)
+
+    def test_run_on_own_connection(self):
+        in_atomic = lambda cursor: connections['default'].in_atomic_block
+        with transaction.atomic():
+            self.assertIs(keys.run_on_own_connection(in_atomic), False)
+        with self.assertRaises(ZeroDivisionError):
+            keys.run_on_own_connection(lambda cursor: 1 / 0)
+
+
+class GlobalidAllocatorTests(TestCase):
+
+    def get_allocator(self):
+        allocator = keys.GlobalidAllocator(block_size=5, low_water=0, background=False)
+        allocator.reserve_block = lambda n, proc=None: [mock_globalid() for _ in range(n)]
+        return allocator
+
+    def test_queue(self):
+        allocator = self.get_allocator()
+        ids = [allocator.next_globalid() for _ in range(7)]
+        self.assertEqual(len(set(ids)), 7)
+        self.assertEqual(allocator.stats()['next_globalid'], dict(hits=5, misses=2, refills=2, available=3))
+
+    def test_take(self):
+        allocator = self.get_allocator()
+        ids = allocator.take(12)
+        self.assertEqual(len(set(ids)), 12)
+        self.assertEqual(allocator.stats()['next_globalid']['misses'], 12)
+
+    def test_background_refill_closes_connection(self):
+        refill_connections = []
+
+        def reserve_block(n, proc=None):
+            conn = connections[allocator.using]
+            with conn.cursor() as cursor:  # open the refill thread's own connection, as a real reservation does
+                cursor.execute('SELECT 1')
+            conn.close = mock.Mock(wraps=conn.close)
+            refill_connections.append(conn)
+            return [mock_globalid() for _ in range(n)]
+
+        allocator = keys.GlobalidAllocator(block_size=5, low_water=5, background=True)
+        allocator.reserve_block = reserve_block
+        pool = allocator.get_pool()
+        pool.keys.extend(mock_globalid() for _ in range(6))
+        allocator.next_globalid()  # pool at low water: refills in the background
+        for thread in threading.enumerate():
+            if thread.name == 'arcsde-key-refill':
+                thread.join()
+        self.assertEqual(pool.stats()['refills'], 1)
+        (refill_connection, ) = refill_connections
+        self.assertIsNot(refill_connection, connection)
+        refill_connection.close.assert_called_once()
+
+
+class GlobalidPoolDbTests(SdeKeyProcTestsMixin, TestCase):
+    """ Globalid queues pre-fetched in blocks from the (mock) next_globalid proc """
+
+    def setUp(self):
+        self.calls_start = len(db.mock_key_calls)
+        allocator = keys.GlobalidAllocator(block_size=4, low_water=0, background=False)
+        patcher = mock.patch.object(keys, 'globalid_allocator', allocator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.allocator = allocator
+
+    def test_get_next_globalids(self):
+        globalids = SdeCreationFeature.get_next_globalids(3)
+        self.assertEqual(len(set(globalids)), 3)
+        self.assertEqual(len(self.key_calls('next_globalid')), 3)  # one statement, one proc call per row
+
+    def test_save_draws_from_pool(self):
+        with mock.patch.object(SdeCreationFeature, 'use_globalid_pool', True):
+            features = [self.new_feature(some_attr=str(i)) for i in range(2)]
+            for feature in features:
+                feature.save()
+        globalids = [f.globalid for f in features]
+        self.assertEqual(len(set(globalids)), 2)
+        self.assertEqual(set(SdeCreationFeature.objects.values_list('globalid', flat=True)), set(globalids))
+        self.assertEqual(self.allocator.stats()['next_globalid'], dict(hits=1, misses=1, refills=1, available=2))
+        self.assertEqual(len(self.key_calls('next_globalid')), 4)  # one block for both features
+
+
+class SdeBulkCreateTests(TestCase):
+    """ Key generation requires SDE procs - mock them to test bulk creation logic """
+
+    def setUp(self):
+        self.objectids = iter(range(1, 1000))
+        self.key_calls = []
+
+    def next_globalids(self, n):
+        self.key_calls.append(('globalid', n))
+        return [mock_globalid() for _ in range(n)]
+
+    def next_objectids(self, n):
+        self.key_calls.append(('objectid', n))
+        return [next(self.objectids) for _ in range(n)]
+
+    def bulk_create(self, objs, **kwargs):
+        with mock.patch.object(SdeCreationFeature, 'get_next_globalids', side_effect=self.next_globalids), \
+             mock.patch.object(SdeCreationFeature, 'get_next_objectids', side_effect=self.next_objectids):
+            return SdeCreationFeature.objects.sde_bulk_create(objs, **kwargs)
+
+    def test_bulk_create(self):
+        objs = self.bulk_create([SdeCreationFeature(some_attr=str(i)) for i in range(25)],
+                                username='bulk_user', batch_size=10)
+        self.assertEqual(SdeCreationFeature.objects.count(), 25)
+        self.assertEqual(self.key_calls, [('globalid', 10), ('objectid', 10),
+                                          ('globalid', 10), ('objectid', 10),
+                                          ('globalid', 5), ('objectid', 5)])
+        self.assertEqual([o.pk for o in objs], list(range(1, 26)))
+        feature = SdeCreationFeature.objects.get(pk=objs[0].pk)
+        self.assertEqual(feature.globalid, objs[0].globalid)
+        self.assertEqual(feature.created_user, 'bulk_user')
+        self.assertEqual(feature.last_edited_user, 'bulk_user')
+        self.assertEqual(feature.created_date, feature.last_edited_date)
+
+    def test_batch_timestamp(self):
+        objs = self.bulk_create([SdeCreationFeature() for i in range(5)], username='bulk_user')
+        self.assertEqual(len({o.last_edited_date for o in objs}), 1)
+
+    def test_existing_keys(self):
+        objs = self.bulk_create([SdeCreationFeature(objectid=500, globalid=mock_globalid()), SdeCreationFeature()])
+        self.assertEqual(self.key_calls, [('globalid', 1), ('objectid', 1)])
+        self.assertEqual(objs[0].pk, 500)
+        self.assertEqual(objs[1].last_edited_user, settings.SDE_EDIT_TRACKING_DEFAULT_USERNAME)
+
+    def test_key_table(self):
+        with mock.patch.object(SdeCreationFeature._meta, 'db_table', 'sde_creation_feature_evw'):
+            self.assertEqual(SdeCreationFeature.sde_key_table(), 'sde_creation_feature')  # base table exists
+        with mock.patch.object(SdeCreationFeature._meta, 'db_table', 'no_such_feature_evw'):
+            self.assertEqual(SdeCreationFeature.sde_key_table(), 'no_such_feature_evw')
+
+
+class SdeCatalogTests(TestCase):
+
+    def setUp(self):
+        self.catalog = catalog.SdeCatalog()
+
+    def test_exists(self):
+        self.assertTrue(self.catalog.exists('sde_feature'))
+        self.assertFalse(self.catalog.exists('no_such_table'))
+
+    def test_table_info(self):
+        with connection.cursor() as cursor:
+            for table in ('sde_catalog_feat', 'sde_catalog_feat__attach', 'sde_catalog_feat__attach_evw'):
+                cursor.execute(f'CREATE TABLE "{table}" ("objectid" integer PRIMARY KEY)')
+            cursor.execute('CREATE VIEW "sde_catalog_feat_evw" AS SELECT * FROM "sde_catalog_feat"')
+        info = self.catalog.table_info('sde_catalog_feat')
+        self.assertEqual(info.name, 'sde_catalog_feat')
+        self.assertTrue(info.base_exists)
+        self.assertTrue(info.evw_exists)
+        self.assertTrue(info.attach_exists)
+        self.assertIs(self.catalog.table_info('sde_catalog_feat_evw'), info)
+        self.assertFalse(self.catalog.table_info('sde_feature').evw_exists)
+
+    def test_invalidate(self):
+        self.assertFalse(self.catalog.exists('sde_catalog_test'))
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE "sde_catalog_test" ("objectid" integer PRIMARY KEY)')
+        self.assertFalse(self.catalog.exists('sde_catalog_test'))  # cached
+        self.catalog.invalidate()
+        self.assertTrue(self.catalog.exists('sde_catalog_test'))
+
+    def test_owner_unknown_table_reloads(self):
+        self.catalog.relations  # load the cache
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE "sde_catalog_test2" ("objectid" integer PRIMARY KEY)')
+        self.assertIsNone(self.catalog.owner('sde_catalog_test2'))  # no owners in SQLite
+        self.assertTrue(self.catalog.exists('sde_catalog_test2'))
+
+    def test_attachment_model_table_info(self):
+        from arcsde.attachments.models import get_attachment_model
+        with mock.patch.object(catalog.sde_catalog, 'table_info', wraps=catalog.sde_catalog.table_info) as table_info:
+            self.assertIsNone(get_attachment_model(SdeGeomFeature))  # no attach table
+        table_info.assert_called_once_with('sde_geom_feature')
+
+    def test_owner_missing_table(self):
+        self.catalog.relations  # load the cache
+        with mock.patch.object(self.catalog, '_query_relations', wraps=self.catalog._query_relations) as query:
+            for _ in range(3):
+                with self.assertRaises(LookupError):
+                    self.catalog.owner('no_such_table')
+            self.assertEqual(query.call_count, 1)  # re-loaded once, then known to be missing
+            self.catalog.invalidate()
+            with self.assertRaises(LookupError):
+                self.catalog.owner('no_such_table')
+            self.assertEqual(query.call_count, 3)  # invalidated:  loaded, then re-loaded once more
+
+    def test_table_info_not_cached_after_invalidate(self):
+        relations = self.catalog.relations
+        self.catalog.invalidate()
+        # a table_info call that read relations just before the invalidate must not cache its stale info
+        with mock.patch.object(type(self.catalog), 'relations', new_callable=mock.PropertyMock, return_value=relations):
+            self.catalog.table_info('sde_feature')
+        self.assertEqual(self.catalog._tables, {})
+
+
+class UpdateTrackedTests(TestCase):
+
+    def setUp(self):
+        self.features = [create_sde_feature(SdeFeatureModel, some_attr='before') for _ in range(3)]
+
+    def test_update_tracked(self):
+        then = timezone.now()
+        n = SdeFeatureModel.objects.filter(pk__in=[f.pk for f in self.features[:2]]) \
+                                   .update_tracked('bulk_user', some_attr='after')
+        self.assertEqual(n, 2)
+        updated = SdeFeatureModel.objects.filter(some_attr='after')
+        self.assertEqual(updated.count(), 2)
+        for feature in updated:
+            self.assertEqual(feature.last_edited_user, 'bulk_user')
+            self.assertGreaterEqual(feature.last_edited_date, then)
+        self.assertEqual(SdeFeatureModel.objects.get(pk=self.features[2].pk).last_edited_user, 'arcsde_test_fixture')
+
+    def test_override_fields_left_to_db(self):
+        """ Like save(), only the base edit tracking fields are updated - DB triggers manage any override fields """
+        created = dict(SdeFeatureModel.objects.values_list('pk', 'created_user'))
+        with mock.patch.object(SdeFeatureModel, 'last_edited_user_field', 'created_user'), \
+             mock.patch.object(SdeFeatureModel, 'last_edited_date_field', 'created_date'):
+            SdeFeatureModel.objects.update_tracked('bulk_user', some_attr='after')
+        self.assertEqual(dict(SdeFeatureModel.objects.values_list('pk', 'created_user')), created)
+        self.assertEqual(set(SdeFeatureModel.objects.values_list('last_edited_user', flat=True)), {'bulk_user'})
+
+    def test_set_edited_by(self):
+        SdeFeatureModel.objects.set_edited_by('annotated_user').update_tracked(some_attr='after')
+        self.assertEqual(set(SdeFeatureModel.objects.values_list('last_edited_user', flat=True)), {'annotated_user'})
+
+    def test_default_username(self):
+        SdeFeatureModel.objects.update_tracked(some_attr='after')
+        self.assertEqual(set(SdeFeatureModel.objects.values_list('last_edited_user', flat=True)),
+                         {settings.SDE_EDIT_TRACKING_DEFAULT_USERNAME})
+
+
+class SdeStreamTests(TestCase):
+
+    def setUp(self):
+        self.features = [create_sde_feature(SdeFeatureModel, some_attr=str(i)) for i in range(5)]
+
+    def test_stream_instances(self):
+        streamed = SdeFeatureModel.objects.order_by('pk').sde_stream(chunk_size=2)
+        self.assertEqual([f.pk for f in streamed], [f.pk for f in self.features])
+
+    def test_stream_tuples(self):
+        rows = list(SdeFeatureModel.objects.order_by('pk').sde_stream(rows='tuple', fields=('pk', 'some_attr')))
+        self.assertEqual(rows, [(f.pk, f.some_attr) for f in self.features])
+
+    def test_stream_dicts(self):
+        rows = list(SdeFeatureModel.objects.order_by('pk').sde_stream(rows='dict'))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['globalid'], self.features[0].globalid)
+        self.assertIn('last_edited_date', rows[0])
+
+    def test_stream_excludes_shape(self):
+        self.assertNotIn('shape', SdePointFeature.objects.all().sde_field_names())
+        self.assertIn('objectid', SdePointFeature.objects.all().sde_field_names())
+
+    def test_stream_bad_rows(self):
+        with self.assertRaises(ValueError):
+            SdeFeatureModel.objects.sde_stream(rows='list')
+
+
+class SdeRecordsTests(BaseModelsTests):
+
+    def setUp(self):
+        super().setUp()
+        self.feature = create_sde_feature(SdeFeatureModel, some_attr='record', created_user='SomeUser')
+
+    def test_records(self):
+        records = list(SdeFeatureModel.objects.as_records('objectid', 'some_attr', 'last_edited_user'))
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record.pk, self.feature.pk)
+        self.assertEqual(record.some_attr, 'record')
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertIsNone(record.created_user)
+        self.assertEqual(record.get_last_edited_user(), 'arcsde_test_fixture')
+        self.assertEqual(record.as_dict(), dict(objectid=self.feature.pk, some_attr='record',
+                                                last_edited_user='arcsde_test_fixture'))
+
+    def test_revision_helpers(self):
+        record = SdeFeatureModel.objects.as_records().get()
+        user = self._get_user()
+        self.assertTrue(record.was_created_by(user))
+        self.assertFalse(record.was_last_edited_by(user))
+        info = record.get_report_version_info()
+        self.assertEqual(info['created_by'], 'SomeUser')
+        self.assertEqual(info['edited_on'], self.feature.last_edited_date)
+
+    def test_localized_datetimes(self):
+        record = SdeFeatureModel.objects.as_records('dt', 'last_edited_date').get()
+        self.assertEqual(record.dt.tzinfo, tz.LOCAL_TIME_ZONE)
+        self.assertEqual(record.last_edited_date.tzinfo, tz.LOCAL_TIME_ZONE)
+        self.assertEqual(record.last_edited_date, self.feature.last_edited_date)
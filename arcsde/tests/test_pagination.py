@@ -0,0 +1,111 @@
+"""
+    Test suite for SDE keyset pagination
+"""
+from django.core.paginator import EmptyPage, InvalidPage
+from django.http import Http404
+from django.template import Context, Template
+from django.test import TestCase, RequestFactory
+from django.views.generic import ListView
+
+from arcsde.pagination import SdeKeysetPaginator
+from arcsde.views import SdeKeysetPaginationMixin
+from .models import SdeFeatureModel, create_sde_feature
+
+
+class FeatureList(SdeKeysetPaginationMixin, ListView):
+    model = SdeFeatureModel
+    paginate_by = 3
+
+
+# A typical ListView pagination template, written for the Paginator interface
+PAGINATION_TEMPLATE = Template(
+    '{% for f in object_list %}{{ f.some_attr }} {% endfor %}'
+    '| {{ page_obj.start_index }}-{{ page_obj.end_index }} of {{ paginator.count }}, page {{ page_obj.number }}'
+    '{% if page_obj.has_previous %} prev={{ page_obj.previous_page_number }}{% endif %}'
+    '{% if page_obj.has_next %} next={{ page_obj.next_page_number }} after={{ page_obj.next_after }}{% endif %}'
+)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.features = [create_sde_feature(SdeFeatureModel, some_attr=str(i)) for i in range(7)]
+        self.pks = sorted(f.pk for f in self.features)
+
+    def test_keyset_field(self):
+        self.assertEqual(SdeFeatureModel.objects.all().sde_keyset_field(), 'objectid')
+        attachments_model = SdeFeatureModel.sde_attachments
+        self.assertEqual(attachments_model.objects.all().sde_keyset_field(), 'globalid')
+
+    def test_keyset_page(self):
+        page = SdeFeatureModel.objects.sde_keyset_page(after=self.pks[2], page_size=3)
+        self.assertEqual([f.pk for f in page], self.pks[3:6])
+
+    def test_page_after(self):
+        paginator = SdeKeysetPaginator(SdeFeatureModel.objects.all(), 3)
+        page = paginator.page_after()
+        self.assertEqual([f.pk for f in page], self.pks[:3])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+        page = paginator.page_after(page.next_after)
+        self.assertEqual([f.pk for f in page], self.pks[3:6])
+        page = paginator.page_after(page.next_after)
+        self.assertEqual([f.pk for f in page], self.pks[6:])
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_page_values(self):
+        paginator = SdeKeysetPaginator(SdeFeatureModel.objects.values('objectid', 'some_attr'), 4)
+        page = paginator.page_after()
+        self.assertEqual(page.next_after, self.pks[3])
+
+    def test_page_number(self):
+        paginator = SdeKeysetPaginator(SdeFeatureModel.objects.all(), 3)
+        self.assertEqual(paginator.num_pages, 3)
+        self.assertEqual([f.pk for f in paginator.page(2)], self.pks[3:6])
+        self.assertEqual([f.pk for f in paginator.page(3)], self.pks[6:])
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+
+    def test_list_view(self):
+        view = FeatureList()
+        view.setup(RequestFactory().get('/', {'after': self.pks[1]}))
+        view.object_list = view.get_queryset()
+        context = view.get_context_data()
+        self.assertEqual([f.pk for f in context['object_list']], self.pks[2:5])
+        self.assertEqual(context['page_obj'].next_after, self.pks[4])
+
+        view.setup(RequestFactory().get('/', {'page': 3}))
+        context = view.get_context_data()
+        self.assertEqual([f.pk for f in context['object_list']], self.pks[6:])
+
+    def render(self, **params):
+        response = FeatureList.as_view()(RequestFactory().get('/', params))
+        return PAGINATION_TEMPLATE.render(Context(response.context_data))
+
+    def test_list_view_template(self):
+        self.assertEqual(self.render(page=2), f'3 4 5 | 4-6 of 7, page 2 prev=1 next=3 after={self.pks[5]}')
+        self.assertEqual(self.render(after=self.pks[2]), f'3 4 5 | 4-6 of 7, page 2 prev=1 next=3 after={self.pks[5]}')
+        self.assertEqual(self.render(after=self.pks[5]), '6 | 7-7 of 7, page 3 prev=2')
+
+    def test_list_view_template_unaligned(self):
+        # pages needn't start on a page boundary:  indexes are exact, the page number is rounded up
+        self.assertEqual(self.render(after=self.pks[0]), f'1 2 3 | 2-4 of 7, page 2 prev=1 next=3 after={self.pks[3]}')
+
+    def test_page_after_indexes(self):
+        paginator = SdeKeysetPaginator(SdeFeatureModel.objects.all(), 3)
+        page = paginator.page_after()
+        self.assertEqual((page.number, page.start_index(), page.end_index()), (1, 1, 3))
+        with self.assertRaises(EmptyPage):
+            page.previous_page_number()
+        page = paginator.page_after(str(self.pks[5]))  # key values from the query string are converted
+        self.assertEqual(page.after, self.pks[5])
+        self.assertEqual((page.number, page.start_index(), page.end_index()), (3, 7, 7))
+        with self.assertRaises(EmptyPage):
+            page.next_page_number()
+
+    def test_invalid_after(self):
+        with self.assertRaises(InvalidPage):
+            SdeKeysetPaginator(SdeFeatureModel.objects.all(), 3).page_after('abc')
+        with self.assertRaises(Http404):
+            FeatureList.as_view()(RequestFactory().get('/', {'after': 'abc'}))
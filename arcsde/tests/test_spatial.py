@@ -0,0 +1,286 @@
+"""
+    Test suite for SDE spatial queries
+    SQLite has no LATERAL joins or SDE spatial functions, so these tests mostly inspect the generated SQL.
+"""
+from unittest import mock
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+
+from arcsde import settings, wkb
+from arcsde.models.functions import SdeExtent, ExtentField, SdeGeometry
+from .models import SdePointFeature, SdeGeomFeature, SdeEnvelopeFeature
+from .test_wkb import wkb_polygon
+
+
+class SdeAnnotateFromIntersectsTests(TestCase):
+
+    def sql(self, qs):
+        sql, params = qs.query.sql_with_params()
+        return sql, params
+
+    def test_lateral_join(self):
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'objectid', 'globalid', prefix='geom_')
+        sql, params = self.sql(qs)
+        self.assertEqual(sql.count('LATERAL'), 1)  # one join fetches all fields
+        self.assertIn('LEFT OUTER JOIN LATERAL (SELECT U0."objectid", U0."globalid" FROM "sde_geom_feature" U0', sql)
+        self.assertIn('ST_Intersects("sde_point_feature"."shape", U0."shape")', sql)
+        self.assertIn('ORDER BY U0."objectid" ASC LIMIT 1) "sde_geom_feature" ON TRUE', sql)
+        self.assertIn('"sde_geom_feature"."objectid" AS "geom_objectid"', sql)
+        self.assertIn('"sde_geom_feature"."globalid" AS "geom_globalid"', sql)
+
+    def test_parameterized(self):
+        candidates = SdeGeomFeature.objects.filter(globalid='some-id')
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(
+            SdeGeomFeature, 'globalid', prefix='geom_', queryset=candidates
+        )
+        sql, params = self.sql(qs)
+        self.assertNotIn('some-id', sql)
+        self.assertIn('some-id', params)
+
+    def test_tie_break(self):
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(
+            SdeGeomFeature, 'globalid', prefix='geom_', order_by=('-created_date', )
+        )
+        sql, params = self.sql(qs)
+        self.assertIn('ORDER BY U0."created_date" DESC, U0."objectid" ASC LIMIT 1', sql)
+
+    def test_constraint_field(self):
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(
+            SdeGeomFeature, 'globalid', prefix='geom_', where_constraint_field='created_user'
+        )
+        sql, params = self.sql(qs)
+        self.assertIn('U0."created_user" = ("sde_point_feature"."created_user")', sql)
+
+    def test_self_join(self):
+        qs = SdeGeomFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='other_')
+        sql, params = self.sql(qs)
+        self.assertIn('ST_Intersects("sde_geom_feature"."shape", U0."shape")', sql)
+        self.assertIn('LIMIT 1) T2 ON TRUE', sql)
+        self.assertIn('T2."globalid" AS "other_globalid"', sql)
+
+    def test_chained_joins(self):
+        qs = SdePointFeature.objects \
+            .sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='geom_') \
+            .sde_annotate_from_intersects(SdeGeomFeature, 'objectid', prefix='geom_')
+        sql, params = self.sql(qs)
+        self.assertEqual(sql.count('LATERAL'), 2)
+        self.assertIn('"sde_geom_feature"."globalid" AS "geom_globalid"', sql)
+        self.assertIn('T3."objectid" AS "geom_objectid"', sql)
+
+    def test_filter_on_annotation(self):
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='geom_')
+        sql, params = self.sql(qs.filter(geom_globalid='abc'))
+        self.assertIn('WHERE "sde_geom_feature"."globalid" = %s', sql)
+
+    def test_subquery(self):
+        inner = SdePointFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='geom_')
+        qs = SdeGeomFeature.objects.filter(globalid__in=inner.values('geom_globalid'))
+        str(inner.query)  # compiling the inner query first must not change its aliases
+        sql, params = self.sql(qs)
+        self.assertIn('ST_Intersects(U0."shape", "sde_geom_feature"."shape")', sql)
+
+
+class SdeEnvelopePrefilterTests(TestCase):
+
+    def sql(self, qs):
+        return qs.query.sql_with_params()[0]
+
+    def test_env_intersects(self):
+        sql = self.sql(SdePointFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='geom_'))
+        self.assertIn('WHERE (ST_EnvIntersects("sde_point_feature"."shape", U0."shape") AND '
+                      'ST_Intersects("sde_point_feature"."shape", U0."shape"))', sql)
+
+    def test_no_prefilter(self):
+        with mock.patch.object(settings, 'SDE_SPATIAL_ENVELOPE_PREFILTER', False):
+            qs = SdePointFeature.objects.sde_annotate_from_intersects(SdeGeomFeature, 'globalid', prefix='geom_')
+            sql = self.sql(qs)
+        self.assertNotIn('ST_EnvIntersects', sql)
+
+    def test_envelope_columns(self):
+        qs = SdeEnvelopeFeature.objects.sde_annotate_from_intersects(SdeEnvelopeFeature, 'globalid', prefix='other_')
+        sql = self.sql(qs)
+        self.assertNotIn('ST_EnvIntersects', sql)
+        self.assertIn('"sde_envelope_feature"."minx" <= (U0."maxx")', sql)
+        self.assertIn('"sde_envelope_feature"."maxy" >= (U0."miny")', sql)
+        self.assertIn('ST_Intersects("sde_envelope_feature"."shape", U0."shape")', sql)
+
+    def test_envelope_columns_one_side(self):
+        qs = SdePointFeature.objects.sde_annotate_from_intersects(SdeEnvelopeFeature, 'globalid', prefix='env_')
+        sql = self.sql(qs)
+        self.assertIn('ST_MinX("sde_point_feature"."shape") <= (U0."maxx")', sql)
+        self.assertIn('ST_MaxY("sde_point_feature"."shape") >= (U0."miny")', sql)
+
+    def test_raw_sql_annotation(self):
+        with mock.patch.object(SdeEnvelopeFeature, 'sde_envelope_fields', None):
+            qs = SdePointFeature.objects.sde_annotate_from_intersect(SdeEnvelopeFeature, 'minx')
+            self.assertIn('(ST_EnvIntersects(sde_point_feature."shape", lhs."shape") AND ST_Intersects', self.sql(qs))
+        qs = SdePointFeature.objects.sde_annotate_from_intersect(SdeEnvelopeFeature, 'minx')
+        sql = self.sql(qs)
+        self.assertIn('ST_MinX(sde_point_feature."shape") <= (lhs."maxx")', sql)  # precomputed sde_envelope_fields
+        self.assertNotIn('ST_EnvIntersects', sql)
+        SdePointFeature.objects.create()
+        self.assertIsNone(qs.get().minx)
+
+
+class SdeSpatialLookupTests(TestCase):
+    WKT = 'POINT (-123.4 49.2)'
+
+    def sql(self, qs):
+        return qs.query.sql_with_params()
+
+    def test_intersects(self):
+        sql, params = self.sql(SdeGeomFeature.objects.filter(shape__sde_intersects=(self.WKT, settings.SDE_SRID)))
+        self.assertIn('(ST_EnvIntersects("sde_geom_feature"."shape", st_geometry(%s, %s)) AND '
+                      'ST_Intersects("sde_geom_feature"."shape", st_geometry(%s, %s)))', sql)
+        self.assertNotIn('ST_Transform', sql)   # same spatial reference as the layer
+        self.assertEqual(params, (self.WKT, settings.SDE_SRID) * 2)
+
+    def test_transform(self):
+        sql, params = self.sql(SdePointFeature.objects.filter(shape__sde_intersects=(self.WKT, 4326)))
+        self.assertIn('ST_Intersects("sde_point_feature"."shape", ST_Transform(st_geometry(%s, %s), %s))', sql)
+        self.assertEqual(params[-3:], (self.WKT, 4326, settings.SDE_SRID))
+        with mock.patch.object(SdePointFeature, 'sde_srid', 4326, create=True):
+            sql, params = self.sql(SdePointFeature.objects.filter(shape__sde_intersects=(self.WKT, 4326)))
+        self.assertNotIn('ST_Transform', sql)
+
+    def test_wkb(self):
+        polygon = wkb_polygon([[(0, 0), (1, 0), (1, 1), (0, 0)]])
+        sql, params = self.sql(SdeGeomFeature.objects.filter(shape__sde_bbox=(polygon, settings.SDE_SRID)))
+        self.assertIn('WHERE (ST_EnvIntersects("sde_geom_feature"."shape", ST_GeomFromWKB(%s, %s)))', sql)
+        self.assertIn(polygon, params)
+
+    def test_expression(self):
+        qs = SdeGeomFeature.objects.filter(shape__sde_bbox=SdeGeometry(self.WKT, settings.SDE_SRID))
+        self.assertIn('ST_EnvIntersects("sde_geom_feature"."shape", st_geometry(%s, %s))', self.sql(qs)[0])
+
+    def test_dwithin(self):
+        sql, params = self.sql(SdePointFeature.objects.filter(shape__sde_dwithin=(self.WKT, settings.SDE_SRID, 250)))
+        self.assertIn('ST_EnvIntersects("sde_point_feature"."shape", ST_Buffer(st_geometry(%s, %s), %s))', sql)
+        self.assertIn('ST_Distance("sde_point_feature"."shape", st_geometry(%s, %s)) <= (%s)', sql)
+        self.assertEqual(SdePointFeature.objects.filter(shape__sde_dwithin=(self.WKT, settings.SDE_SRID, 100)).count(), 0)
+        SdePointFeature.objects.create()
+        self.assertEqual(SdePointFeature.objects.filter(shape__sde_dwithin=(self.WKT, settings.SDE_SRID, 100)).count(), 1)
+        self.assertEqual(SdePointFeature.objects.filter(shape__sde_dwithin=(self.WKT, settings.SDE_SRID, 99)).count(), 0)
+
+    def test_envelope_columns(self):
+        for x in (0, 50):
+            SdeEnvelopeFeature.objects.create(shape=wkb_polygon([[(x, 0), (x + 10, 0), (x + 10, 10), (x, 0)]]).hex(),
+                                              minx=x, miny=0, maxx=x + 10, maxy=10)
+        bbox = wkb_polygon([[(45, 5), (55, 5), (55, 6), (45, 5)]])
+        qs = SdeEnvelopeFeature.objects.filter(shape__sde_bbox=(bbox, settings.SDE_SRID))
+        sql = self.sql(qs)[0]
+        self.assertNotIn('ST_EnvIntersects', sql)
+        self.assertIn('"sde_envelope_feature"."minx" <= (ST_MaxX(ST_GeomFromWKB(%s, %s)))', sql)
+        self.assertEqual(list(qs.values_list('minx', flat=True)), [50])
+
+    def test_sde_intersects_geom(self):
+        qs = SdeGeomFeature.objects.sde_intersects_geom(self.WKT, settings.SDE_SRID)
+        self.assertIn('ST_Intersects("sde_geom_feature"."shape", st_geometry(%s, %s))', self.sql(qs)[0])
+        SdeGeomFeature.objects.create()
+        self.assertFalse(qs.exists())
+        self.assertTrue(SdeGeomFeature.objects.exclude(shape__sde_intersects=(self.WKT, settings.SDE_SRID)).exists())
+
+    def test_bad_value(self):
+        for value in (self.WKT, (self.WKT, ), (self.WKT, 3005, 10)):
+            with self.assertRaises(ValueError):
+                SdeGeomFeature.objects.filter(shape__sde_intersects=value)
+        with self.assertRaises(ValueError):
+            SdeGeomFeature.objects.filter(shape__sde_dwithin=(self.WKT, 3005))
+
+
+class SdeAggregatesTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for user, x in (('east', 10), ('west', 0), ('west', -20)):
+            shape = wkb_polygon([[(x, 0), (x + 10, 0), (x + 10, 5), (x, 5), (x, 0)]]).hex()
+            SdeGeomFeature.objects.create(shape=shape, created_user=user)
+
+    def test_total_area(self):
+        summary = SdeGeomFeature.objects.sde_area_summary()
+        self.assertEqual(summary['count'], 3)
+        self.assertAlmostEqual(summary['area_ha'], 3 * 3.14)  # mock ST_Area is 31400 m^2
+
+    def test_area_summary_group_by(self):
+        summary = list(SdeGeomFeature.objects.sde_area_summary(group_by='created_user', area_name='ha'))
+        self.assertEqual([(row['created_user'], row['count']) for row in summary], [('east', 1), ('west', 2)])
+        self.assertAlmostEqual(summary[1]['ha'], 2 * 3.14)
+
+    def test_area_sql(self):
+        sql = str(SdeGeomFeature.objects.sde_area_summary(group_by=('created_user', )).query)
+        self.assertIn('SUM(ST_Area("sde_geom_feature"."shape") * 0.0001) AS "area_ha"', sql)
+        self.assertIn('GROUP BY "sde_geom_feature"."created_user"', sql)
+
+    def test_extent(self):
+        self.assertEqual(SdeGeomFeature.objects.sde_extent(), (-20, 0, 20, 5))
+        self.assertEqual(SdeGeomFeature.objects.filter(created_user='east').sde_extent(), (10, 0, 20, 5))
+        self.assertIsNone(SdeGeomFeature.objects.filter(created_user='nobody').sde_extent())
+
+    def test_filtered_extent(self):
+        extent = SdeGeomFeature.objects.aggregate(
+            extent=SdeExtent('shape', filter=Q(created_user='west'))
+        )['extent']
+        self.assertEqual(extent, (-20, 0, 10, 5))
+
+    def test_extent_postgres_sql(self):
+        compiler = SdeGeomFeature.objects.all().query.get_compiler(connection=connection)
+        extent = SdeExtent('shape').resolve_expression(compiler.query)
+        sql, params = extent.as_sql(compiler, connection)
+        self.assertEqual(sql, 'ARRAY[MIN(ST_MinX("sde_geom_feature"."shape")), MIN(ST_MinY("sde_geom_feature"."shape")), '
+                              'MAX(ST_MaxX("sde_geom_feature"."shape")), MAX(ST_MaxY("sde_geom_feature"."shape"))]')
+        self.assertEqual(ExtentField().from_db_value([1.0, 2.0, 3.0, 4.0], None, None), (1, 2, 3, 4))
+        self.assertIsNone(ExtentField().from_db_value([None] * 4, None, None))
+
+
+class SdeNearestTests(TestCase):
+    WKT = 'POINT (-123.4 49.2)'
+
+    def test_nearest(self):
+        for i in range(3):
+            SdePointFeature.objects.create()
+        qs = SdePointFeature.objects.sde_nearest(self.WKT, k=2, srid=settings.SDE_SRID)
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('ST_Distance("sde_point_feature"."shape", st_geometry(%s, %s)) AS "distance"', sql)
+        self.assertIn('ORDER BY 7 ASC, "sde_point_feature"."objectid" ASC LIMIT 2', sql)
+        nearest = list(qs)
+        self.assertEqual(len(nearest), 2)
+        self.assertEqual(nearest[0].distance, 100.0)
+
+    def test_transform(self):
+        sql, params = SdePointFeature.objects.sde_nearest(self.WKT, srid=4326).query.sql_with_params()
+        self.assertIn('ST_Distance("sde_point_feature"."shape", ST_Transform(st_geometry(%s, %s), %s))', sql)
+        self.assertEqual(params[:3], (self.WKT, 4326, settings.SDE_SRID))
+
+    def test_max_distance(self):
+        SdePointFeature.objects.create()
+        qs = SdePointFeature.objects.sde_nearest(self.WKT, k=5, max_distance=50, distance_name='d')
+        self.assertIn('ST_Buffer(st_geometry(%s, %s), %s)', qs.query.sql_with_params()[0])
+        self.assertFalse(qs.exists())  # mock distance is 100
+        self.assertEqual(SdePointFeature.objects.sde_nearest(self.WKT, k=5, max_distance=150).get().distance, 100.0)
+
+    def test_knn_operator(self):
+        with mock.patch.object(settings, 'SDE_KNN_OPERATOR', '<->'):
+            qs = SdePointFeature.objects.sde_nearest(self.WKT, k=5)
+            sql, params = qs.query.sql_with_params()
+        self.assertIn('ORDER BY ("sde_point_feature"."shape" <-> st_geometry(%s, %s)) ASC LIMIT 5', sql)
+        self.assertIn('AS "distance"', sql)
+
+
+class SdeShapeGeneralizedTests(TestCase):
+
+    def test_wkb(self):
+        SdeGeomFeature.objects.create(shape=wkb_polygon([[(0, 0), (10, 0), (10, 10), (0, 0)]]).hex())
+        qs = SdeGeomFeature.objects.sde_shape_generalized(25.0)
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('ST_AsBinary(ST_Generalize("sde_geom_feature"."shape", %s)) AS "shape_generalized"', sql)
+        self.assertEqual(params, (25.0, ))
+        self.assertEqual(wkb.decode_wkb(qs.get().shape_generalized).geom_type, 'Polygon')
+
+    def test_wkt_transformed(self):
+        qs = SdeGeomFeature.objects.sde_shape_generalized(25.0, 'simple', output='wkt', srid=4326)
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('ST_AsText(ST_Transform(ST_Generalize("sde_geom_feature"."shape", %s), 4326)) AS "simple"', sql)
+        self.assertEqual(params, (25.0, ))
+        with self.assertRaises(AssertionError):
+            SdeGeomFeature.objects.sde_shape_generalized(25.0, output='geojson')
@@ -0,0 +1,154 @@
+"""
+    Test suite for image attachment thumbnails
+    Pillow is optional:  tests that actually resize images are skipped without it.
+"""
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command, CommandError
+from django.template import Context, Template
+from django.test import TestCase
+
+from arcsde.attachments import thumbnails
+from .models import mock_globalid
+from .test_attachments import BaseAttachmentModelTests
+from .test_views import get_user
+
+
+class ThumbnailCacheTests(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = thumbnails.ThumbnailCache(os.path.join(directory.name, 'thumbs'), max_bytes=25)
+
+    def age(self, key, seconds):
+        """ Make the cached file for key look like it was last used some seconds ago """
+        mtime = os.stat(self.cache.path(key)).st_mtime - seconds
+        os.utime(self.cache.path(key), (mtime, mtime))
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', b'0123456789')
+        self.assertIn('a', self.cache)
+        self.assertEqual(self.cache.get('a'), b'0123456789')
+        self.assertEqual(self.cache.stats(), dict(files=1, bytes=10, max_bytes=25))
+
+    def test_lru(self):
+        self.cache.set('a', b'0123456789')
+        self.cache.set('b', b'0123456789')
+        self.age('a', 20)
+        self.age('b', 10)
+        self.cache.get('a')              # a is now the most recently used
+        self.cache.set('c', b'0123456789')  # exceeds max_bytes - evicts b, the least recently used
+        self.assertNotIn('b', self.cache)
+        self.assertIn('a', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(self.cache.stats()['bytes'], 20)
+
+    def test_clear(self):
+        self.cache.set('a', b'0123456789')
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['files'], 0)
+
+    def test_require_pillow(self):
+        with mock.patch.object(thumbnails, 'Image', None):
+            with self.assertRaises(ImproperlyConfigured):
+                thumbnails.make_thumbnail(b'', 100)
+
+    def test_thumbnail_format(self):
+        with mock.patch.object(thumbnails.settings, 'SDE_THUMBNAIL_FORMAT', 'gif'):
+            with self.assertRaises(ImproperlyConfigured):
+                thumbnails.thumbnail_format()
+
+
+class BaseThumbnailTests(BaseAttachmentModelTests):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = thumbnails.ThumbnailCache(directory.name)
+        patcher = mock.patch.object(thumbnails, 'thumbnail_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.attachment = self.get_attachment_model().get_test_object()
+        self.attachment.related_object = self.feature
+        self.attachment.globalid = '{%s}' % mock_globalid()
+        self.attachment.att_name = 'red dot'
+        self.attachment.save()
+
+
+class ThumbnailViewTests(BaseThumbnailTests):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(get_user())
+
+    def test_thumbnail_key(self):
+        self.assertEqual(thumbnails.thumbnail_key(self.attachment, 'small'),
+                         '{}-{}-small.jpeg'.format(self.attachment.globalid.strip('{}'), self.attachment.data_size))
+
+    def test_cached_thumbnail(self):
+        self.cache.set(thumbnails.thumbnail_key(self.attachment, 'small'), b'cached thumbnail')
+        response = self.client.get(self.attachment.thumbnail_url('small'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'cached thumbnail')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        response = self.client.get(self.attachment.thumbnail_url('small'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_found(self):
+        self.assertEqual(self.client.get(self.attachment.thumbnail_url('enormous')).status_code, 404)
+        self.attachment.content_type = 'application/pdf'
+        self.attachment.save()
+        self.assertEqual(self.client.get(self.attachment.thumbnail_url('small')).status_code, 404)
+
+    @unittest.skipIf(thumbnails.Image is None, 'Pillow is not installed')
+    def test_generate_thumbnail(self):
+        response = self.client.get(self.attachment.thumbnail_url('small'))
+        self.assertEqual(response.status_code, 200)
+        image = thumbnails.Image.open(io.BytesIO(response.content))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertIn(thumbnails.thumbnail_key(self.attachment, 'small'), self.cache)
+
+    def test_template_tag(self):
+        html = Template('{% load sde_tags %}{% attachment_thumbnail attachment "medium" %}').render(
+            Context({'attachment': self.attachment})
+        )
+        self.assertIn('<img src="{}" loading="lazy"'.format(self.attachment.thumbnail_url('medium')), html)
+        self.assertIn('href="{}"'.format(self.attachment.image_url()), html)
+
+
+def fake_thumbnail(data, size, fmt):
+    return b'%d' % size
+
+
+class ThumbnailBackfillTests(BaseThumbnailTests):
+
+    def backfill(self, **kwargs):
+        with mock.patch.object(thumbnails, 'require_pillow'), \
+             mock.patch.object(thumbnails, 'make_thumbnail', fake_thumbnail):
+            return thumbnails.backfill_thumbnails(self.get_attachment_model().objects.all(), processes=0, **kwargs)
+
+    def test_backfill(self):
+        self.assertEqual(self.backfill(sizes=('small', )), 1)
+        self.assertEqual(self.cache.get(thumbnails.thumbnail_key(self.attachment, 'small')), b'160')
+        self.assertEqual(self.backfill(), len(thumbnails.settings.SDE_THUMBNAIL_SIZES) - 1)  # only the missing ones
+        self.assertEqual(self.backfill(), 0)
+
+    def test_command(self):
+        with mock.patch.object(thumbnails, 'require_pillow'), \
+             mock.patch.object(thumbnails, 'make_thumbnail', fake_thumbnail):
+            out = io.StringIO()
+            call_command('sde_thumbnails', 'arcsde_tests.SdeFeatureModel', '--sizes', 'small', '--processes', '0',
+                         stdout=out)
+        self.assertIn('Generated 1 thumbnails', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('sde_thumbnails', 'arcsde_tests.SdeGeomFeature')
+        with self.assertRaises(CommandError):
+            call_command('sde_thumbnails', 'arcsde_tests.SdeFeatureModel', '--sizes', 'enormous')
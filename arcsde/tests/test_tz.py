@@ -1,7 +1,7 @@
 """
     Test suite for SDE Time Zone logic
 """
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from django.test import TestCase
 
@@ -53,3 +53,38 @@ class TzTests(TestCase):
         sde = tz.delocalize(dt)
         self.assertEqual(sde.tzinfo, ZoneInfo(settings.SDE_DB_TIME_ZONE))
         self.assertNotEqual(dt.hour, sde.hour)
+
+
+class FastLocalizeTests(TestCase):
+    def assertSameLocalTime(self, expected, actual):
+        self.assertEqual(expected, actual)
+        self.assertEqual(expected.tzinfo, actual.tzinfo)
+        self.assertEqual((expected.replace(tzinfo=None), expected.fold), (actual.replace(tzinfo=None), actual.fold))
+
+    def test_matches_localize(self):
+        """ Test that fast path yields identical results, across DST transitions in both directions """
+        start = datetime(2023, 3, 12, 8)  # UTC, 2 hrs before Canada/Pacific spring forward
+        for dt in (start + timedelta(minutes=m) for m in range(0, 240, 7)):
+            self.assertSameLocalTime(tz.localize(dt), tz.fast_localize(dt))
+        start = datetime(2023, 11, 5, 7)  # UTC, 2 hrs before Canada/Pacific fall back - includes repeated hour
+        for dt in (start + timedelta(minutes=m) for m in range(0, 240, 7)):
+            self.assertSameLocalTime(tz.localize(dt), tz.fast_localize(dt))
+
+    def test_aware_and_edge_values(self):
+        for dt in (datetime.now(tz=ZoneInfo('UTC')), datetime.now(tz=timezone.utc),
+                   datetime.now(tz=ZoneInfo(settings.TIME_ZONE)), datetime(1, 1, 1), datetime(9999, 12, 31)):
+            self.assertEqual(tz.localize(dt), tz.fast_localize(dt))
+        self.assertIsNone(tz.fast_localize(None))
+
+    def test_localize_many(self):
+        values = [datetime(2020, 1, 1) + timedelta(hours=h) for h in range(0, 24 * 365, 5)] + [None]
+        for expected, actual in zip([tz.localize(v) for v in values], tz.localize_many(values)):
+            if expected is None:
+                self.assertIsNone(actual)
+            else:
+                self.assertSameLocalTime(expected, actual)
+
+    def test_offset_table(self):
+        starts, intervals = tz.UtcOffsetTable(ZoneInfo('Canada/Pacific')).year(2023)
+        self.assertEqual(starts[1:], [datetime(2023, 3, 12, 10), datetime(2023, 11, 5, 9), datetime(2023, 11, 5, 10)])
+        self.assertEqual([fold for *_, fold in intervals], [0, 0, 1, 0])
@@ -1,9 +1,15 @@
 """
     Test suite for SDE attachment views
 """
+from unittest import mock
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.urls import reverse
-from django.test import Client
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from arcsde import settings
+from arcsde.attachments.views import parse_byte_range
 from .test_attachments import BaseAttachmentModelTests
 from .models import mock_globalid
 
@@ -57,6 +63,17 @@ class AttachmentsViewsTests(BaseAttachmentModelTests):
         self.assertIn(bytes('<form action="{}"'.format(self.get_caption_save_url()),encoding='utf-8'), response.content)
         # print(response.content)
 
+    def test_AjaxAttachedImagesView_url_mode(self):
+        c = Client()
+        login(c)
+        with mock.patch.object(settings, 'SDE_ATTACHMENT_IMAGE_MODE', 'url'):
+            response = c.get(self.get_images_list_url(), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'data:image/png;base64,', response.content)
+        self.assertIn(bytes('<img src="{}" loading="lazy"'.format(self.attachment.image_url()), encoding='utf-8'),
+                      response.content)
+        self.assertIn('data', response.context['attachment'].get_deferred_fields())  # metadata only
+
     def test_AjaxAttachedCaptionSave(self):
         c = Client()
         login(c)
@@ -68,3 +85,108 @@ class AttachmentsViewsTests(BaseAttachmentModelTests):
         self.assertEqual(response.json()['caption_text'], new_caption)
         attached = self.get_attachment_model().objects.get(pk=self.attachment.pk)
         self.assertEqual(attached.att_name, new_caption)
+
+    def test_AjaxAttachedCaptionSave_metadata_only(self):
+        c = Client()
+        login(c)
+        attach_table = self.get_attachment_model()._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            response = c.post(self.get_caption_save_url(), data={'att_name': 'New Caption Text'},
+                              HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        attach_queries = [q['sql'] for q in queries if attach_table in q['sql']]
+        self.assertTrue(attach_queries)
+        self.assertFalse([sql for sql in attach_queries if '"data"' in sql])   # the blob is never loaded
+
+
+class AttachmentDownloadViewTests(BaseAttachmentModelTests):
+
+    def setUp(self):
+        super().setUp()
+        self.attachment = self.get_attachment_model().get_test_object()
+        self.attachment.related_object = self.feature
+        self.attachment.globalid = mock_globalid()
+        self.attachment.save()
+        self.data = bytes(self.attachment.data)
+        self.client.force_login(get_user())
+
+    def get_download_url(self):
+        return self.attachment.download_url()
+
+    def get(self, **headers):
+        return self.client.get(self.get_download_url(), **headers)
+
+    def test_download_url(self):
+        self.assertEqual(self.get_download_url(), '/arcsde/attachments/download/arcsde_tests/SdeFeatureModel/{}/{}/'.format(
+            self.feature.pk, self.attachment.pk))
+
+    def test_stream(self):
+        with mock.patch.object(settings, 'SDE_ATTACHMENT_CHUNK_SIZE', 16):
+            response = self.get()
+            chunks = list(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(chunks), -(-len(self.data) // 16))   # read from the DB, one chunk at a time
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['ETag'], self.attachment.data_etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/{}'.format(len(self.data)))
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_suffix_and_open_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+        response = self.get(HTTP_RANGE='bytes=60-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[60:])
+        response = self.get(HTTP_RANGE='bytes=0-1,4-5')   # multiple ranges are not supported - whole resource sent
+        self.assertEqual(response.status_code, 200)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes={}-'.format(len(self.data)))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */{}'.format(len(self.data)))
+
+    def test_not_modified(self):
+        response = self.get(HTTP_IF_NONE_MATCH=self.attachment.data_etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.attachment.data_etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_if_range(self):
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.attachment.data_etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_not_found(self):
+        url = reverse('arcsde:attachments:download', kwargs={'related_model_app': 'arcsde_tests',
+            'related_model': 'SdeFeatureModel', 'related_pk': self.feature.pk, 'attachment_pk': self.attachment.pk + 1})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_iter_data_loaded(self):
+        self.assertEqual(b''.join(self.attachment.iter_data(2, 12, chunk_size=3)), self.data[2:12])
+
+
+class ByteRangeTests(TestCase):
+
+    def test_parse_byte_range(self):
+        self.assertEqual(parse_byte_range('bytes=0-99', 1000), (0, 100))
+        self.assertEqual(parse_byte_range('bytes=900-2000', 1000), (900, 1000))
+        self.assertEqual(parse_byte_range('bytes=-100', 1000), (900, 1000))
+        self.assertEqual(parse_byte_range('bytes=-2000', 1000), (0, 1000))
+        self.assertIsNone(parse_byte_range('bytes=5-1', 1000))
+        self.assertIsNone(parse_byte_range('items=0-1', 1000))
+        self.assertIsNone(parse_byte_range('bytes=-', 1000))
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            parse_byte_range('bytes=-0', 1000)
@@ -0,0 +1,114 @@
+"""
+    Test suite for WKB decoding of SDE shapes
+"""
+import struct
+from array import array
+from django.test import TestCase
+
+from arcsde import wkb
+from arcsde.models.functions import CoordinatesField
+from .models import SdePointFeature, SdeGeomFeature
+
+
+def wkb_ring(points, endian='<'):
+    return struct.pack(f'{endian}I', len(points)) + b''.join(struct.pack(f'{endian}dd', *p) for p in points)
+
+
+def wkb_polygon(rings, endian='<'):
+    byte_order = 1 if endian == '<' else 0
+    return struct.pack(f'{endian}BII', byte_order, 3, len(rings)) + b''.join(wkb_ring(r, endian) for r in rings)
+
+
+SQUARE = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+HOLE = [(2, 2), (4, 2), (4, 4), (2, 2)]
+
+
+class WkbDecoderTests(TestCase):
+
+    def test_point(self):
+        geom = wkb.decode_wkb(struct.pack('<BIdd', 1, 1, 1.5, -2.5))
+        self.assertEqual(geom.geom_type, 'Point')
+        self.assertEqual(geom.coords, array('d', [1.5, -2.5]))
+        self.assertEqual(geom.dims, 2)
+
+    def test_big_endian(self):
+        geom = wkb.decode_wkb(struct.pack('>BIdd', 0, 1, 1.5, -2.5))
+        self.assertEqual(geom.coords, array('d', [1.5, -2.5]))
+
+    def test_hex(self):
+        geom = wkb.decode_wkb(struct.pack('<BIdd', 1, 1, 1.5, -2.5).hex())
+        self.assertEqual(geom.coords, array('d', [1.5, -2.5]))
+
+    def test_linestring(self):
+        geom = wkb.decode_wkb(struct.pack('<BI', 1, 2) + wkb_ring([(0, 0), (1, 1), (2, 0)]))
+        self.assertEqual(geom.geom_type, 'LineString')
+        self.assertEqual(geom.coords, array('d', [0, 0, 1, 1, 2, 0]))
+
+    def test_polygon(self):
+        for endian in '<>':
+            geom = wkb.decode_wkb(wkb_polygon([SQUARE, HOLE], endian))
+            self.assertEqual(geom.geom_type, 'Polygon')
+            self.assertEqual(len(geom.coords), 2)
+            self.assertEqual(geom.coords[1], array('d', [c for p in HOLE for c in p]))
+
+    def test_multipolygon(self):
+        data = struct.pack('<BII', 1, 6, 2) + wkb_polygon([SQUARE]) + wkb_polygon([SQUARE, HOLE])
+        geom = wkb.decode_wkb(memoryview(data))
+        self.assertEqual(geom.geom_type, 'MultiPolygon')
+        self.assertEqual([len(p) for p in geom.coords], [1, 2])
+
+    def test_collection(self):
+        data = struct.pack('<BII', 1, 7, 2) + struct.pack('<BIdd', 1, 1, 1, 2) + wkb_polygon([SQUARE])
+        geom = wkb.decode_wkb(data)
+        self.assertEqual([g.geom_type for g in geom.coords], ['Point', 'Polygon'])
+
+    def test_iso_z(self):
+        geom = wkb.decode_wkb(struct.pack('<BIddd', 1, 1001, 1, 2, 3))
+        self.assertEqual(geom.dims, 3)
+        self.assertEqual(geom.coords, array('d', [1, 2, 3]))
+
+    def test_ewkb_srid(self):
+        geom = wkb.decode_wkb(struct.pack('<BIidd', 1, 1 | wkb.EWKB_SRID, 3005, 1, 2))
+        self.assertEqual(geom.srid, 3005)
+        self.assertEqual(geom.coords, array('d', [1, 2]))
+
+    def test_errors(self):
+        with self.assertRaises(wkb.WkbError):
+            wkb.decode_wkb(struct.pack('<BIdd', 1, 1, 1, 2)[:-3])
+        with self.assertRaises(wkb.WkbError):
+            wkb.decode_wkb(struct.pack('<BI', 1, 42))
+
+
+class WkbAnnotationTests(TestCase):
+
+    def test_point_wkb(self):
+        SdePointFeature.objects.create(shape=struct.pack('<BIdd', 1, 1, 123, 987).hex())
+        feature = SdePointFeature.objects.sde_shape_as_wkb().get()
+        self.assertEqual(wkb.decode_wkb(feature.shape_wkb).coords, array('d', [123, 987]))
+
+    def test_transformed_wkb(self):
+        sql = str(SdeGeomFeature.objects.sde_shape_as_wkb('wkb', srid=4326).query)
+        self.assertIn('ST_AsBinary(ST_Transform("sde_geom_feature"."shape", 4326)) AS "wkb"', sql)
+
+    def test_coordinates(self):
+        SdePointFeature.objects.create(shape=struct.pack('<BIdd', 1, 1, 123, 987).hex())
+        feature = SdePointFeature.objects.sde_coordinates_from_shape().get()
+        self.assertEqual(feature.coordinates, (123, 987))
+        self.assertEqual((feature.coordinates.long, feature.coordinates.lat), (123, 987))
+
+    def test_coordinates_single_transform(self):
+        sql = str(SdePointFeature.objects.sde_coordinates_from_shape('xy', srid=3005).query)
+        self.assertEqual(sql.count('ST_Transform'), 1)
+        self.assertIn('ST_AsBinary(ST_Transform("sde_point_feature"."shape", 3005)) AS "xy"', sql)
+
+    def test_coordinates_precision(self):
+        field = CoordinatesField(precision=2)
+        value = field.from_db_value(memoryview(struct.pack('<BIdd', 1, 1, -123.45678, 49.12345)), None, None)
+        self.assertEqual(value, (-123.46, 49.12))
+        self.assertIsNone(field.from_db_value(None, None, None))
+        with self.assertRaises(wkb.WkbError):
+            field.from_db_value(wkb_polygon([SQUARE]), None, None)
+
+    def test_coordinates_point_only(self):
+        with self.assertRaises(AssertionError):
+            SdeGeomFeature.objects.sde_coordinates_from_shape()
@@ -3,4 +3,5 @@ from django.urls import include, path
 
 urlpatterns = [
     path('arcsde/', include('arcsde.urls')),
+    path('arcsde/layers/', include('arcsde.layers.urls')),
 ]
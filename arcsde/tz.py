@@ -1,4 +1,6 @@
 """ SDE stores all datetime fields in UTC - a few forms need to work on these in local timezone """
+import bisect
+import datetime as dt
 from zoneinfo import ZoneInfo
 from django.utils import timezone
 from arcsde import settings
@@ -40,3 +42,109 @@ def delocalize(datetime):
         return dt.astimezone(SDE_DB_TIME_ZONE)
     except OverflowError:
         return None
+
+
+class UtcOffsetTable:
+    """
+    A cache of the UTC offset intervals for a time zone, computed one year at a time on first use.
+    Converts naive UTC datetimes to the time zone with a bisect lookup and some arithmetic,
+        yielding results identical to datetime.astimezone(zone), including fold for repeated wall times.
+    """
+    PROBE_SECONDS = 6 * 3600  # assumes offset changes at most once in any 6-hour span, true of all real zones.
+
+    def __init__(self, zone):
+        self.zone = zone
+        self._years = {}
+        self._last = (dt.datetime.max, dt.datetime.min, None, 0)  # most recently used interval
+
+    def _offset(self, utc):
+        """ UTC offset of zone at the given naive UTC datetime """
+        return self.zone.fromutc(utc.replace(tzinfo=self.zone)).utcoffset()
+
+    def _transition(self, start, lo, hi, offset):
+        """ Return first second in (lo, hi] seconds from start where offset differs from given offset """
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self._offset(start + dt.timedelta(seconds=mid)) == offset:
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    def _build_year(self, year):
+        """
+        Return (starts, intervals) for given year, where intervals[i] = (start, end, offset, fold)
+            gives the UTC offset and fold for naive UTC datetimes from starts[i] up to (not including) end
+        """
+        start = dt.datetime(year, 1, 1)
+        end = dt.datetime(year + 1, 1, 1)
+        year_seconds = int((end - start).total_seconds())
+        offset = self._offset(start)
+        starts, offsets = [start], [(offset, 0)]
+        for lo in range(0, year_seconds, self.PROBE_SECONDS):
+            hi = min(lo + self.PROBE_SECONDS, year_seconds - 1)
+            if self._offset(start + dt.timedelta(seconds=hi)) == offset:
+                continue
+            transition = start + dt.timedelta(seconds=self._transition(start, lo, hi, offset))
+            new_offset = self._offset(transition)
+            if new_offset < offset:  # clocks go back: local wall times after transition are repeated (fold=1)
+                starts += [transition, transition + (offset - new_offset)]
+                offsets += [(new_offset, 1), (new_offset, 0)]
+            else:
+                starts.append(transition)
+                offsets.append((new_offset, 0))
+            offset = new_offset
+        ends = starts[1:] + [end]
+        return starts, [(s, e, *o) for s, e, o in zip(starts, ends, offsets)]
+
+    def year(self, year):
+        try:
+            return self._years[year]
+        except KeyError:
+            table = self._years[year] = self._build_year(year)
+            return table
+
+    def interval(self, utc):
+        """ Return (start, end, offset, fold) for the offset interval containing the naive UTC datetime """
+        starts, intervals = self.year(utc.year)
+        return intervals[bisect.bisect_right(starts, utc) - 1]
+
+    def localize_utc(self, utc):
+        """ Convert a naive UTC datetime to an aware datetime in zone """
+        interval = self._last
+        if not interval[0] <= utc < interval[1]:  # successive values usually fall in the same interval
+            interval = self._last = self.interval(utc)
+        local = (utc + interval[2]).replace(tzinfo=self.zone)
+        return local.replace(fold=1) if interval[3] else local
+
+
+LOCAL_OFFSETS = UtcOffsetTable(LOCAL_TIME_ZONE)
+_SDE_TZ_IS_UTC = SDE_DB_TIME_ZONE.key in ('UTC', 'Etc/UTC')
+_UTC_ZONES = (dt.timezone.utc, SDE_DB_TIME_ZONE)
+
+
+def fast_localize(datetime):
+    """
+    Same result as localize(datetime), but converts naive or UTC datetimes with cached UTC offset intervals.
+    Used to convert datetimes read from the SDE DB - falls back to localize() for any other input.
+    """
+    if datetime is None:
+        return None
+    if _SDE_TZ_IS_UTC and dt.MINYEAR < datetime.year < dt.MAXYEAR:
+        if datetime.tzinfo is None:
+            return LOCAL_OFFSETS.localize_utc(datetime)
+        if datetime.tzinfo in _UTC_ZONES:
+            return LOCAL_OFFSETS.localize_utc(datetime.replace(tzinfo=None))
+    return localize(datetime)
+
+
+def localize_many(datetimes):
+    """ Return a list with each of the datetimes (e.g., a result column from SDE DB) localized """
+    if not _SDE_TZ_IS_UTC:
+        return [localize(value) for value in datetimes]
+    localize_utc = LOCAL_OFFSETS.localize_utc
+    return [
+        localize_utc(value) if value is not None and value.tzinfo is None and dt.MINYEAR < value.year < dt.MAXYEAR
+        else fast_localize(value)
+        for value in datetimes
+    ]
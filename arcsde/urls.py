@@ -3,6 +3,7 @@ from django.urls import include, path
 
 app_name = 'arcsde'
 
+# Feature layer endpoints (vector tiles, GeoJSON export) are opt-in - include 'arcsde.layers.urls' separately
 urlpatterns = [
     path('attachments/', include('arcsde.attachments.urls')),
 ]
@@ -3,9 +3,13 @@
 """
 from django import http
 from django.contrib import messages
+from django.core.paginator import InvalidPage
 from django.template.loader import get_template
+from django.utils.translation import gettext as _
 from django.views import generic
 
+from arcsde.pagination import SdeKeysetPaginator
+
 
 class JSONResponseMixin(object):
     """
@@ -71,3 +75,24 @@ class AjaxOnlyView(JSONResponseMixin, generic.base.ContextMixin, generic.base.Vi
             'success' : False,
             'errors' : self.get_form_errors(form, strip_tags)
         }
+
+
+class SdeKeysetPaginationMixin:
+    """
+        A MultipleObjectMixin (e.g., ListView) mixin that paginates an SDE feature queryset by keyset.
+        Links to the next page as ?after=<page_obj.next_after> for constant per-page latency on deep pages;
+            ?page=<number> continues to work as usual.
+    """
+    paginator_class = SdeKeysetPaginator
+    after_kwarg = 'after'
+
+    def paginate_queryset(self, queryset, page_size):
+        after = self.kwargs.get(self.after_kwarg) or self.request.GET.get(self.after_kwarg)
+        if not after:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = self.get_paginator(queryset, page_size, allow_empty_first_page=self.get_allow_empty())
+        try:
+            page = paginator.page_after(after)
+        except InvalidPage as e:
+            raise http.Http404(_('Invalid page (%(after)s): %(message)s') % {'after': after, 'message': str(e)})
+        return paginator, page, page.object_list, page.has_other_pages()
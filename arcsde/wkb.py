@@ -0,0 +1,107 @@
+"""
+    A compact decoder for OGC Well-Known Binary (WKB) geometries, e.g., from ArcSdeQuerySet.sde_shape_as_wkb()
+
+    WKB is much smaller on the wire than WKT and far cheaper to parse.  Coordinates are decoded into flat
+    array('d') sequences [x0, y0, x1, y1, ...] (with z and / or m ordinates interleaved for 3D / 4D geometries),
+    so a polygon with thousands of vertices is a handful of compact arrays, not thousands of tuples of floats.
+
+    Decoded coordinates, by geometry type:
+        Point:               array('d')  [x, y]
+        LineString:          array('d')  [x0, y0, x1, y1, ...]
+        Polygon:             list of rings, each an array('d'), exterior ring first
+        MultiPoint:          list of Point coordinates
+        MultiLineString:     list of LineString coordinates
+        MultiPolygon:        list of Polygon coordinates
+        GeometryCollection:  list of WkbGeometry
+    Handles ISO (e.g., 1001 = Point Z) and PostGIS EWKB (Z / M / SRID flags) geometry type codes.
+"""
+import struct
+import sys
+from array import array
+from typing import NamedTuple, Optional
+
+GEOMETRY_TYPES = {
+    1: 'Point', 2: 'LineString', 3: 'Polygon',
+    4: 'MultiPoint', 5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection',
+}
+
+EWKB_Z, EWKB_M, EWKB_SRID = 0x80000000, 0x40000000, 0x20000000
+
+NATIVE_BYTE_ORDER = 1 if sys.byteorder == 'little' else 0
+
+
+class WkbError(ValueError):
+    """ Raised for malformed or unsupported WKB data """
+
+
+class WkbGeometry(NamedTuple):
+    geom_type: str       # one of GEOMETRY_TYPES
+    coords: object       # see module docstring
+    dims: int = 2        # number of ordinates per vertex
+    srid: Optional[int] = None  # only available from EWKB
+
+
+class _Reader:
+    """ Decodes WKB from a bytes-like object, tracking the current offset """
+    def __init__(self, data):
+        self.data = memoryview(data).cast('B')
+        self.offset = 0
+
+    def unpack(self, fmt):
+        try:
+            values = struct.unpack_from(fmt, self.data, self.offset)
+        except struct.error as e:
+            raise WkbError(f'Truncated WKB data at offset {self.offset}.') from e
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def doubles(self, n, swap):
+        """ Return the next n doubles as an array('d') """
+        end = self.offset + 8 * n
+        if end > len(self.data):
+            raise WkbError(f'Truncated WKB data at offset {self.offset}.')
+        values = array('d')
+        values.frombytes(self.data[self.offset:end])
+        if swap:
+            values.byteswap()
+        self.offset = end
+        return values
+
+    def geometry(self):
+        byte_order, = self.unpack('B')
+        if byte_order not in (0, 1):
+            raise WkbError(f'Invalid WKB byte order {byte_order}.')
+        swap = byte_order != NATIVE_BYTE_ORDER
+        endian = '<' if byte_order else '>'
+        type_code, = self.unpack(f'{endian}I')
+
+        srid = None
+        if type_code & EWKB_SRID:
+            srid, = self.unpack(f'{endian}i')
+        dims = 2 + bool(type_code & EWKB_Z) + bool(type_code & EWKB_M)
+        type_code &= 0x0fffffff
+        iso_dims, type_code = divmod(type_code, 1000)
+        dims += (0, 1, 1, 2)[iso_dims] if iso_dims < 4 else 0
+        geom_type = GEOMETRY_TYPES.get(type_code)
+        if geom_type is None:
+            raise WkbError(f'Unsupported WKB geometry type {type_code}.')
+
+        count = lambda: self.unpack(f'{endian}I')[0]
+        if type_code == 1:
+            coords = self.doubles(dims, swap)
+        elif type_code == 2:
+            coords = self.doubles(count() * dims, swap)
+        elif type_code == 3:
+            coords = [self.doubles(count() * dims, swap) for _ in range(count())]
+        elif type_code == 7:
+            coords = [self.geometry() for _ in range(count())]
+        else:  # multi-geometries are a sequence of complete WKB geometries
+            coords = [self.geometry().coords for _ in range(count())]
+        return WkbGeometry(geom_type, coords, dims, srid)
+
+
+def decode_wkb(data):
+    """ Decode WKB data (bytes, memoryview, or hex string) into a WkbGeometry """
+    if isinstance(data, str):
+        data = bytes.fromhex(data)
+    return _Reader(data).geometry()
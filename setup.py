@@ -23,6 +23,10 @@ requirements = [
         'Django>=3.2.18,<5.0',
     ]
 
+extra_requirements = {
+    'thumbnails': ['Pillow'],   # arcsde.attachments.thumbnails
+}
+
 test_requirements = [ ]
 
 setup(
@@ -40,6 +44,7 @@ setup(
     ],
     description="Abstractions and base classes for creating django models from Arc SDE feature tables.",
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme,
     include_package_data=True,